@@ -1,3 +1,15 @@
-from .app import create_app
+# The application is only built when `application` is first accessed, so
+# importing the package (tests, migrations, agency.wsgi) stays cheap.
+def __getattr__(name):
+    global application
 
-application = create_app()
+    if name == 'create_app':
+        from .app import create_app
+        return create_app
+
+    if name == 'application':
+        from .app import create_app
+        application = create_app()
+        return application
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,48 +2,118 @@
 # Imports
 # ----------------------------------------------------------------------------#
 
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_cors import CORS
-from flask_migrate import Migrate
-from .auth.auth import AuthError, requires_auth
+import os
+import threading
+import time
+from flask import Flask, request, abort, jsonify, current_app, url_for, \
+    stream_with_context, _request_ctx_stack
+from werkzeug.middleware.proxy_fix import ProxyFix
+from .auth.auth import AuthError, auth_keys, requires_auth
+from .batch import BatchAborted, TOKEN_PAYLOAD, parse_requests, run_batch
+from .cache import cache
+from .coalesce import coalescer
 from .config import Config
-from .models import db, Actor, Movie
+from .cors import cors
+from .fragments import fragments
+from .health import readiness
+from .jobs import submit
+from .models import db, unit_of_work, Actor, Movie, Stat, Change, Job, \
+    JobFile
+from .profiling import profiler
+from .ratelimit import RateLimiter, RateLimitExceeded
+from .readmodel import read_model
+from .schema import ValidationError
+from .slowlog import slow_queries
 
 
 # ----------------------------------------------------------------------------#
 # Creating app and set routes
 # ----------------------------------------------------------------------------#
 
-def create_app(config_class=Config):
+# Builds the application.
+# With serving=True only what is needed to answer requests is set up: no
+# Flask-Migrate/Alembic and no CLI commands, and their modules are never
+# imported.
+def create_app(config_class=Config, serving=False):
     # create and configure the app
     app = Flask(__name__)
     app.config.from_object(config_class)
     app.url_map.strict_slashes = False
-    db.init_app(app)
-    migrate = Migrate(app, db)
-    cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
-
-    # CORS Headers
-    @app.after_request
-    def after_request(response):
-        response.headers.add(
-            'Access-Control-Allow-Headers',
-            'Content-Type,Authorization,true'
-        )
-        response.headers.add(
-            'Access-Control-Allow-Methods',
-            'GET,PATCH,POST,DELETE,OPTIONS'
+    if not app.config.get('SECRET_KEY'):
+        app.config['SECRET_KEY'] = os.urandom(32)
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app, x_for=app.config['TRUSTED_PROXIES']
         )
-
-        return response
+    db.init_app(app)
+    auth_keys.init_app(app)
+    RateLimiter(app)
+    cache.init_app(app)
+    coalescer.init_app(app)
+    read_model.init_app(app)
+    fragments.init_app(app)
+    readiness.init_app(app, db)
+    cors.init_app(app)
+    profiler.init_app(app)
+    slow_queries.init_app(app)
+
+    # Gunicorn workers drop the pooled connections inherited from a
+    # --preload master in post_fork, see gunicorn.conf.py.
+    if not serving:
+        from flask_migrate import Migrate
+        from .cli import agency_cli
+
+        migrate = Migrate(app, db)
+        app.cli.add_command(agency_cli)
+
+    # Each long poll of /changes holds a worker thread for up to
+    # CHANGES_MAX_WAIT seconds; past CHANGES_MAX_WAITERS of them, requests
+    # answer at once instead, as with wait=0.
+    change_waiters = threading.BoundedSemaphore(
+        app.config['CHANGES_MAX_WAITERS']
+    )
 
     @app.route('/', methods=['GET'])
     def index():
         return jsonify({'message': 'Welcome to Capstone Project'})
 
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        """
+        Liveness probe, answered without any I/O
+
+        Decorators:
+            app.route
+
+        Returns:
+            dict -- response with json
+        """
+
+        return jsonify({'status': 'ok'}), 200
+
+    @app.route('/readyz', methods=['GET'])
+    def readyz():
+        """
+        Readiness probe: database, connection pool and Auth0 key set
+
+        Decorators:
+            app.route
+
+        Returns:
+            dict -- response with json, 503 when not ready
+        """
+
+        ready, checks = readiness.check()
+
+        return jsonify({
+            'status': 'ready' if ready else 'unavailable',
+            'checks': checks
+        }), 200 if ready else 503
+
     @app.route('/actors', methods=['GET'])
     @requires_auth('read:actors')
+    @coalescer.coalesced
+    @cache.cached('actors')
     def read_actors():
         """
         List of actors
@@ -51,20 +121,47 @@ def create_app(config_class=Config):
         Decorators:
             app.route
             requires_auth
+            coalescer.coalesced
+            cache.cached
 
         Returns:
             dict -- response with json
             error -- not found
         """
 
-        actors = Actor.query.all()
+        actors = Actor.select(*list_arguments(Actor))
 
         if not actors:
             abort(404)
 
+        return fragments.list_response('actors', Actor, actors), 200
+
+    @app.route('/actors/<int:actor_id>', methods=['GET'])
+    @requires_auth('read:actors')
+    @coalescer.coalesced
+    @cache.cached('actors')
+    def read_actor(actor_id):
+        """
+        Actor by id
+
+        Decorators:
+            app.route
+            requires_auth
+            coalescer.coalesced
+            cache.cached
+
+        Returns:
+            dict -- response with json
+            error -- not found
+        """
+
+        actor = Actor.find(actor_id)
+        if not actor:
+            abort(404)
+
         return jsonify({
             'success': True,
-            'actors': [actor.format() for actor in actors]
+            'actor': actor.format()
         }), 200
 
     @app.route('/actors', methods=['POST'])
@@ -82,28 +179,22 @@ def create_app(config_class=Config):
             error -- unprocessable entity
         """
 
-        data = request.get_json()
+        values, bulk = Actor.schema.load_many(request.get_json(silent=True))
 
-        if data is None:
-            abort(422)
-
-        if 'name' not in data:
-            abort(422)
-        if 'age' not in data:
-            abort(422)
-        if 'gender' not in data:
-            abort(422)
+        actors = [Actor(**fields) for fields in values]
+        with unit_of_work():
+            for actor in actors:
+                actor.insert()
 
-        actor = Actor(
-            name=data['name'],
-            age=data['age'],
-            gender=data['gender']
-        )
-        actor.insert()
+        if bulk:
+            return jsonify({
+                'success': True,
+                'actors': [actor.format() for actor in actors]
+            }), 200
 
         return jsonify({
             'success': True,
-            'actor': actor.format()
+            'actor': actors[0].format()
         }), 200
 
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
@@ -119,25 +210,20 @@ def create_app(config_class=Config):
         Returns:
             dict -- response with json
             error -- not found
+            error -- unprocessable entity
         """
 
+        values = Actor.schema.load(request.get_json(silent=True), partial=True)
+
         if not actor_id:
             abort(404)
 
-        actor = Actor.query.get(actor_id)
+        actor = Actor.get_live(actor_id)
         if not actor:
             abort(404)
 
-        data = request.get_json()
-
-        if 'name' in data and data['name']:
-            actor.name = data['name']
-
-        if 'age' in data and data['age']:
-            actor.age = data['age']
-
-        if 'gender' in data and data['gender']:
-            actor.gender = data['gender']
+        for name, value in values.items():
+            setattr(actor, name, value)
 
         actor.update()
 
@@ -164,7 +250,7 @@ def create_app(config_class=Config):
         if not actor_id:
             abort(404)
 
-        actor = Actor.query.get(actor_id)
+        actor = Actor.get_live(actor_id)
         if not actor:
             abort(404)
 
@@ -177,6 +263,8 @@ def create_app(config_class=Config):
 
     @app.route('/movies', methods=['GET'])
     @requires_auth('read:movies')
+    @coalescer.coalesced
+    @cache.cached('movies')
     def read_movies():
         """
         List of movies
@@ -184,20 +272,47 @@ def create_app(config_class=Config):
         Decorators:
             app.route
             requires_auth
+            coalescer.coalesced
+            cache.cached
 
         Returns:
             dict -- response with json
             error -- not found
         """
 
-        movies = Movie.query.all()
+        movies = Movie.select(*list_arguments(Movie))
 
         if not movies:
             abort(404)
 
+        return fragments.list_response('movies', Movie, movies), 200
+
+    @app.route('/movies/<int:movie_id>', methods=['GET'])
+    @requires_auth('read:movies')
+    @coalescer.coalesced
+    @cache.cached('movies')
+    def read_movie(movie_id):
+        """
+        Movie by id
+
+        Decorators:
+            app.route
+            requires_auth
+            coalescer.coalesced
+            cache.cached
+
+        Returns:
+            dict -- response with json
+            error -- not found
+        """
+
+        movie = Movie.find(movie_id)
+        if not movie:
+            abort(404)
+
         return jsonify({
             'success': True,
-            'movies': [movie.format() for movie in movies]
+            'movie': movie.format()
         }), 200
 
     @app.route('/movies', methods=['POST'])
@@ -215,22 +330,22 @@ def create_app(config_class=Config):
             error -- unprocessable entity
         """
 
-        data = request.get_json()
+        values, bulk = Movie.schema.load_many(request.get_json(silent=True))
 
-        if data is None:
-            abort(422)
-
-        if 'title' not in data:
-            abort(422)
-        if 'release' not in data:
-            abort(422)
+        movies = [Movie(**fields) for fields in values]
+        with unit_of_work():
+            for movie in movies:
+                movie.insert()
 
-        movie = Movie(title=data['title'], release=data['release'])
-        movie.insert()
+        if bulk:
+            return jsonify({
+                'success': True,
+                'movies': [movie.format() for movie in movies]
+            }), 200
 
         return jsonify({
             'success': True,
-            'movie': movie.format()
+            'movie': movies[0].format()
         }), 200
 
     @app.route('/movies/<int:movie_id>', methods=['PATCH'])
@@ -246,22 +361,20 @@ def create_app(config_class=Config):
         Returns:
             dict -- response with json
             error -- not found
+            error -- unprocessable entity
         """
 
+        values = Movie.schema.load(request.get_json(silent=True), partial=True)
+
         if not movie_id:
             abort(404)
 
-        movie = Movie.query.get(movie_id)
+        movie = Movie.get_live(movie_id)
         if not movie:
             abort(404)
 
-        data = request.get_json()
-
-        if 'title' in data and data['title']:
-            movie.title = data['title']
-
-        if 'release' in data and data['release']:
-            movie.release = data['release']
+        for name, value in values.items():
+            setattr(movie, name, value)
 
         movie.update()
 
@@ -288,7 +401,7 @@ def create_app(config_class=Config):
         if not movie_id:
             abort(404)
 
-        movie = Movie.query.get(movie_id)
+        movie = Movie.get_live(movie_id)
         if not movie:
             abort(404)
 
@@ -299,6 +412,247 @@ def create_app(config_class=Config):
             'movie_id': movie_id
         }), 200
 
+    @app.route('/stats', methods=['GET'])
+    @requires_auth()
+    def read_stats():
+        """
+        Aggregate statistics of the tables the caller may read
+
+        Decorators:
+            app.route
+            requires_auth
+
+        Returns:
+            dict -- response with json
+            error -- forbidden without read:actors or read:movies
+        """
+
+        tables = readable_tables()
+        if not tables:
+            abort(403)
+
+        stats = Stat.format_all()
+        return jsonify({
+            'success': True,
+            'stats': {
+                table: stats[table] for table in tables if table in stats
+            }
+        }), 200
+
+    @app.route('/slow-queries', methods=['GET'])
+    @requires_auth('debug:queries')
+    def read_slow_queries():
+        """
+        Slow statements of the worker answering, by fingerprint
+
+        Decorators:
+            app.route
+            requires_auth
+
+        Returns:
+            dict -- response with json
+        """
+
+        log = current_app.extensions['slow_queries']
+        if log is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'pid': os.getpid(),
+            'threshold_ms': log.threshold * 1000,
+            'dropped': log.dropped,
+            'queries': log.report()
+        }), 200
+
+    @app.route('/batch', methods=['POST'])
+    @requires_auth()
+    def batch():
+        """
+        Runs several API requests in one round trip
+
+        The token is verified once; each sub-request still needs its own
+        permission. With `atomic`, every change is committed together or
+        rolled back at the first failed sub-request.
+
+        Decorators:
+            app.route
+            requires_auth
+
+        Returns:
+            dict -- response with json
+            error -- status of the failed sub-request of an atomic batch
+        """
+
+        data = request.get_json(silent=True)
+        requests = parse_requests(
+            data, current_app.config['BATCH_MAX_REQUESTS']
+        )
+        environ = {
+            'REMOTE_ADDR': request.remote_addr,
+            TOKEN_PAYLOAD: _request_ctx_stack.top.current_user,
+        }
+
+        try:
+            responses = run_batch(
+                app, requests, environ, atomic=bool(data.get('atomic'))
+            )
+        except BatchAborted as aborted:
+            status = aborted.responses[-1]['status']
+            return jsonify({
+                'success': False,
+                'error': status,
+                'message': 'Batch rolled back.',
+                'failed': aborted.index,
+                'responses': aborted.responses
+            }), status
+
+        return jsonify({
+            'success': True,
+            'responses': responses
+        }), 200
+
+    @app.route('/jobs/<kind>', methods=['POST'])
+    @requires_auth('submit:jobs')
+    def submit_job(kind):
+        """
+        Queues a long running job for `flask agency worker`
+
+        Answers at once with the job's status URL.
+
+        Decorators:
+            app.route
+            requires_auth
+
+        Returns:
+            dict -- response with json
+        """
+
+        job = submit(kind, _request_ctx_stack.top.current_user)
+        status_url = url_for('read_job', job_id=job.id)
+
+        return jsonify({
+            'success': True,
+            'job': job.format(),
+            'status_url': status_url
+        }), 202, {'Location': status_url}
+
+    @app.route('/jobs/<int:job_id>', methods=['GET'])
+    @requires_auth('read:jobs')
+    def read_job(job_id):
+        """
+        Status of a job, with the URL of its result once exported
+
+        Decorators:
+            app.route
+            requires_auth
+
+        Returns:
+            dict -- response with json
+        """
+
+        job = Job.query.get(job_id)
+        if job is None:
+            abort(404)
+
+        data = {'success': True, 'job': job.format()}
+        if job.status == 'succeeded' and 'file' in (job.result or {}):
+            data['result_url'] = url_for('read_job_result', job_id=job.id)
+
+        return jsonify(data), 200
+
+    @app.route('/jobs/<int:job_id>/result', methods=['GET'])
+    @requires_auth('read:jobs')
+    def read_job_result(job_id):
+        """
+        File written by a finished export job
+
+        Decorators:
+            app.route
+            requires_auth
+
+        Returns:
+            file -- response with csv
+        """
+
+        job = Job.query.get(job_id)
+        if job is None or job.status != 'succeeded' or \
+                'file' not in (job.result or {}):
+            abort(404)
+        name = job.result['file']
+        if not JobFile.exists(name):
+            abort(404)
+
+        return current_app.response_class(
+            stream_with_context(JobFile.read(name)), mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={name}'}
+        )
+
+    @app.route('/changes', methods=['GET'])
+    @requires_auth('read:actors')
+    def read_changes():
+        """
+        Changes of actors and movies after a cursor, oldest first
+
+        Without `since` only the current cursor is returned. With `wait`,
+        the request is held until a change arrives or the delay ends.
+
+        Decorators:
+            app.route
+            requires_auth
+
+        Returns:
+            dict -- response with json
+        """
+
+        tables = readable_tables()
+
+        if 'since' not in request.args:
+            return jsonify({
+                'success': True,
+                'changes': [],
+                'cursor': Change.cursor()
+            }), 200
+
+        try:
+            since = int(request.args['since'])
+            limit = int(request.args.get(
+                'limit', current_app.config['CHANGES_PAGE_SIZE']
+            ))
+            wait = float(request.args.get('wait', 0))
+        except ValueError:
+            abort(422)
+
+        if since < 0 or wait < 0 or not \
+                0 < limit <= current_app.config['CHANGES_MAX_PAGE_SIZE']:
+            abort(422)
+
+        # Entries after the cursor were purged, the client must resync.
+        if since < Change.horizon():
+            abort(410)
+
+        waiting = wait > 0 and change_waiters.acquire(blocking=False)
+        deadline = time.monotonic() + min(
+            wait if waiting else 0, current_app.config['CHANGES_MAX_WAIT']
+        )
+        try:
+            while True:
+                changes = Change.since(since, tables, limit)
+                if changes or time.monotonic() >= deadline:
+                    break
+                # Hand the connection back to the pool while waiting.
+                db.session.remove()
+                time.sleep(current_app.config['CHANGES_POLL_INTERVAL'])
+        finally:
+            if waiting:
+                change_waiters.release()
+
+        return jsonify({
+            'success': True,
+            'changes': [change.format() for change in changes],
+            'cursor': changes[-1].id if changes else since
+        }), 200
+
     @app.errorhandler(401)
     def not_authorized(error):
         """
@@ -362,6 +716,27 @@ def create_app(config_class=Config):
             "message": "Item not found."
         }), 404
 
+    @app.errorhandler(410)
+    def gone(error):
+        """
+        Gone error
+
+        Decorators:
+            app.errorhandler
+
+        Arguments:
+            error -- error identifical number
+
+        Returns:
+            dict -- response with json
+        """
+
+        return jsonify({
+            "success": False,
+            "error": 410,
+            "message": "Changes were purged, download the tables again."
+        }), 410
+
     @app.errorhandler(422)
     def unprocessable(error):
         """
@@ -383,6 +758,51 @@ def create_app(config_class=Config):
             "message": "Request could not be processed."
         }), 422
 
+    @app.errorhandler(ValidationError)
+    def invalid_payload(error):
+        """
+        Invalid payload error
+
+        Decorators:
+            app.errorhandler
+
+        Arguments:
+            error -- validation error exception
+
+        Returns:
+            dict -- response with json
+        """
+
+        return jsonify({
+            "success": False,
+            "error": 422,
+            "message": "Request could not be processed.",
+            "errors": error.errors
+        }), 422
+
+    @app.errorhandler(RateLimitExceeded)
+    def too_many_requests(error):
+        """
+        Too many requests error
+
+        Decorators:
+            app.errorhandler
+
+        Arguments:
+            error -- rate limit exceeded exception
+
+        Returns:
+            dict -- response with json
+        """
+
+        response = jsonify({
+            "success": False,
+            "error": 429,
+            "message": "Too many requests."
+        })
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 429
+
     @app.errorhandler(AuthError)
     def auth_error(error):
         """
@@ -407,5 +827,52 @@ def create_app(config_class=Config):
     return app
 
 
+# Parses the filter and pagination query arguments of a list endpoint.
+# Filters are the model's `filters`; `page` starts at 1 and `per_page`
+# defaults to LIST_PAGE_SIZE once `page` is given. Without either, every
+# matching row is returned.
+# Returns: filters (list), offset (int), limit (int or None)
+def list_arguments(model):
+    filters = []
+    for argument, (name, operator, type_) in model.filters.items():
+        if argument in request.args:
+            try:
+                value = type_(request.args[argument])
+            except ValueError:
+                abort(422)
+            filters.append((name, operator, value))
+
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = request.args.get('per_page')
+        if per_page is not None:
+            per_page = int(per_page)
+        elif 'page' in request.args:
+            per_page = current_app.config['LIST_PAGE_SIZE']
+    except ValueError:
+        abort(422)
+
+    if page < 1 or (per_page is not None and not
+                    0 < per_page <= current_app.config['LIST_MAX_PAGE_SIZE']):
+        abort(422)
+
+    offset = (page - 1) * per_page if per_page else 0
+    return filters, offset, per_page
+
+
+# Returns: names of the tables the caller's token may read (list)
+def readable_tables():
+    permissions = _request_ctx_stack.top.current_user.get('permissions', [])
+    return [
+        model.__tablename__ for model in (Actor, Movie)
+        if f'read:{model.__tablename__}' in permissions
+    ]
+
+
+# Drops pooled database connections inherited from a parent process.
+def dispose_engine(app):
+    db.get_engine(app).dispose()
+
+
 if __name__ == '__main__':
     app.run()
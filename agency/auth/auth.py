@@ -3,11 +3,16 @@
 # ----------------------------------------------------------------------------#
 
 import json
-from flask import request, _request_ctx_stack, abort
+import threading
+import time
+from flask import request, _request_ctx_stack, abort, current_app
 from functools import wraps
-from jose import jwt
+from jose import jwk, jwt
+from jose.utils import base64url_decode
 import os
 from urllib.request import urlopen
+from ..batch import TOKEN_PAYLOAD
+from ..profiling import profiler
 
 
 # ----------------------------------------------------------------------------#
@@ -17,6 +22,8 @@ from urllib.request import urlopen
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN')
 ALGORITHMS = os.environ.get('AUTH0_ALGORITHMS')
 API_AUDIENCE = os.environ.get('AUTH0_API_AUDIENCE')
+# Tokens signed by locally configured keys may name their own issuer.
+ISSUER = os.environ.get('AUTH_ISSUER') or 'https://%s/' % (AUTH0_DOMAIN)
 
 
 # ----------------------------------------------------------------------------#
@@ -83,17 +90,182 @@ def check_permissions(permission, payload):
     return True
 
 
+# ----------------------------------------------------------------------------#
+# Key providers
+# ----------------------------------------------------------------------------#
+
+# Every provider maps key ids to verification keys, parsed once into
+# python-jose key objects, and exposes key(kid), age() and error.
+
+
+# Retrieves the json web key set from Auth0.
+# Returns: jwks (dictionary)
+def fetch_jwks(domain):
+    myurl = 'https://%s/.well-known/jwks.json' % (domain)
+    jsonurl = urlopen(myurl)
+    content = jsonurl.read().decode(jsonurl.headers.get_content_charset())
+    return json.loads(content)
+
+
+# Parses the signing keys of a json web key set.
+# Returns: keys by key id (dictionary)
+def parse_jwks(jwks, algorithm):
+    return {
+        key['kid']: jwk.construct(key, key.get('alg', algorithm))
+        for key in jwks['keys']
+        if key.get('use', 'sig') == 'sig'
+    }
+
+
+# Parses every <kid>.pem public key of a directory.
+# Returns: keys by key id (dictionary)
+def load_pem_directory(directory, algorithm):
+    keys = {}
+    for name in sorted(os.listdir(directory)):
+        kid, extension = os.path.splitext(name)
+        if extension == '.pem':
+            with open(os.path.join(directory, name)) as pem:
+                keys[kid] = jwk.construct(pem.read(), algorithm)
+    return keys
+
+
+# Keys configured locally, loaded at startup and never refreshed.
+# Lets air-gapped environments and CI verify tokens without Auth0.
+class StaticKeys(object):
+    error = None
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    @classmethod
+    def from_jwks_file(cls, path, algorithm):
+        with open(path) as jwks:
+            return cls(parse_jwks(json.load(jwks), algorithm))
+
+    @classmethod
+    def from_pem_directory(cls, directory, algorithm):
+        return cls(load_pem_directory(directory, algorithm))
+
+    def key(self, kid):
+        return self.keys.get(kid)
+
+    def age(self):
+        return None
+
+
+# Key set shared by every thread of the process.
+# Fetched at most once per ttl, by a single thread while the others wait for
+# it, and early when a token names a key id it does not know yet, which is
+# how Auth0 key rotation shows up. When a refresh fails the previous keys
+# are kept, and retried after min_refresh seconds.
+class JWKSCache(object):
+    def __init__(self, fetch, ttl, min_refresh):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.min_refresh = min_refresh
+        self.keys = None
+        self.fetched_at = None
+        self.retry_at = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    # Returns: seconds since the key set was fetched, None before (float)
+    def age(self):
+        fetched_at = self.fetched_at
+        if fetched_at is None:
+            return None
+        return time.monotonic() - fetched_at
+
+    def key(self, kid):
+        return self.get(kid).get(kid)
+
+    # Returns: keys by key id (dictionary)
+    def get(self, kid=None):
+        keys, age = self.keys, self.age()
+        if keys is not None and age < self.ttl and (
+                kid is None or age < self.min_refresh or kid in keys):
+            return keys
+
+        with self.lock:
+            # Another thread may have refreshed it while we waited.
+            if self.keys is not None and (
+                    self.age() < self.min_refresh or
+                    time.monotonic() < self.retry_at):
+                return self.keys
+            try:
+                keys = self.fetch()
+            except Exception as error:
+                self.error = str(error) or error.__class__.__name__
+                self.retry_at = time.monotonic() + self.min_refresh
+                if self.keys is None:
+                    raise
+                return self.keys
+            self.keys = keys
+            self.fetched_at = self.retry_at = time.monotonic()
+            self.error = None
+            return self.keys
+
+
+# Flask extension holding the key provider selected by AUTH_KEY_PROVIDER:
+# 'auth0' (the tenant's JWKS, cached), 'jwks_file' (AUTH_JWKS_FILE) or
+# 'pem_dir' (AUTH_PEM_DIR, one <kid>.pem per key).
+class AuthKeys(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        algorithms = config['AUTH0_ALGORITHMS']
+        if isinstance(algorithms, str):
+            algorithms = algorithms.split(',')
+        algorithm = algorithms[0].strip()
+
+        provider = config['AUTH_KEY_PROVIDER']
+        if provider == 'jwks_file':
+            keys = StaticKeys.from_jwks_file(
+                config['AUTH_JWKS_FILE'], algorithm
+            )
+        elif provider == 'pem_dir':
+            keys = StaticKeys.from_pem_directory(
+                config['AUTH_PEM_DIR'], algorithm
+            )
+        else:
+            domain = config['AUTH0_DOMAIN']
+            keys = JWKSCache(
+                lambda: parse_jwks(fetch_jwks(domain), algorithm),
+                config['AUTH0_JWKS_TTL'],
+                config['AUTH0_JWKS_MIN_REFRESH']
+            )
+        app.extensions['auth_keys'] = keys
+
+    @property
+    def provider(self):
+        return current_app.extensions['auth_keys']
+
+
+auth_keys = AuthKeys()
+
+
+# ----------------------------------------------------------------------------#
+# Token verification
+# ----------------------------------------------------------------------------#
+
+# Checks the token's algorithm and signature with an already parsed key.
+def verify_signature(token, key, header):
+    if ALGORITHMS and header.get('alg') not in ALGORITHMS:
+        raise jwt.JWTError('The specified alg value is not allowed.')
+    signing_input, _, signature = token.rpartition('.')
+    if not key.verify(
+            signing_input.encode(), base64url_decode(signature.encode())):
+        raise jwt.JWTError('Signature verification failed.')
+
+
 # Verification and decoding of JWT.
 # Receives: token (string)
 # Returns: payload (dictionary)
 def verify_decode_jwt(token):
-    # Retrieve json web key set from Auth0 for verification process.
-    myurl = 'https://%s/.well-known/jwks.json' % (AUTH0_DOMAIN)
-    jsonurl = urlopen(myurl)
-    content = jsonurl.read().decode(jsonurl.headers.get_content_charset())
-    jwks = json.loads(content)
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
 
     if 'kid' not in unverified_header:
         raise AuthError({
@@ -101,25 +273,19 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    key = auth_keys.provider.key(unverified_header['kid'])
 
     # Decode and return the token payload.
-    if rsa_key:
+    if key is not None:
         try:
+            verify_signature(token, key, unverified_header)
             payload = jwt.decode(
                 token,
-                rsa_key,
+                None,
                 algorithms=ALGORITHMS,
                 audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
+                issuer=ISSUER,
+                options={'verify_signature': False}
             )
             return payload
 
@@ -147,22 +313,36 @@ def verify_decode_jwt(token):
 
 
 # Decorator to check permissions and authentication on endpoints.
+# Without a permission, only a valid token is required. Sub-requests of a
+# batch reuse the payload verified once for the batch, see batch.py.
+# Tokens granting debug:profile may ask for the view to be profiled, see
+# profiling.py.
 def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            try:
-                token = get_token_auth_header()
-            except AuthError:
-                abort(401)
-            try:
-                payload = verify_decode_jwt(token)
-            except AuthError:
-                abort(401)
-            try:
-                check_permissions(permission, payload)
-            except AuthError:
-                abort(401)
+            # Throttle by address before any token work, then by subject.
+            limiter = current_app.extensions['ratelimit']
+            payload = request.environ.get(TOKEN_PAYLOAD)
+            if payload is None:
+                limiter.hit_ip(request.remote_addr)
+                try:
+                    token = get_token_auth_header()
+                except AuthError:
+                    abort(401)
+                try:
+                    payload = verify_decode_jwt(token)
+                except AuthError:
+                    abort(401)
+            limiter.hit_subject(payload.get('sub'), permission)
+            if permission:
+                try:
+                    check_permissions(permission, payload)
+                except AuthError:
+                    abort(401)
+            _request_ctx_stack.top.current_user = payload
+            if profiler.requested(payload):
+                return profiler.run(f, *args, **kwargs)
             return f(*args, **kwargs)
 
         return wrapper
@@ -0,0 +1,125 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import logging
+from werkzeug.test import EnvironBuilder
+from .schema import ValidationError
+
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------------#
+# Batch requests
+# ----------------------------------------------------------------------------#
+
+METHODS = ('GET', 'POST', 'PATCH', 'DELETE')
+
+# WSGI environ keys set on sub-requests. They are not HTTP headers, so
+# clients cannot forge them.
+# Token payload verified once for the whole batch, see requires_auth().
+TOKEN_PAYLOAD = 'agency.token_payload'
+# Set inside atomic batches, whose reads must see the batch's own
+# uncommitted writes: response caching and coalescing are skipped.
+TRANSACTION = 'agency.transaction'
+
+
+INTERNAL_ERROR = {
+    'success': False,
+    'error': 500,
+    'message': 'Internal server error.',
+}
+
+
+# BatchAborted Exception
+# Raised inside an atomic batch to roll it back after a failed sub-request.
+class BatchAborted(Exception):
+    def __init__(self, index, responses):
+        self.index = index
+        self.responses = responses
+
+
+# Checks the sub-requests of a batch.
+# Returns: list of (method, path, body) (list)
+def parse_requests(data, max_requests):
+    requests = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(requests, list):
+        raise ValidationError({'requests': 'Must be a list.'})
+    if not 0 < len(requests) <= max_requests:
+        raise ValidationError({
+            'requests': f'Must hold 1 to {max_requests} requests.'
+        })
+
+    parsed, errors = [], {}
+    for index, item in enumerate(requests):
+        if not isinstance(item, dict):
+            errors[index] = {'_schema': 'Must be an object.'}
+            continue
+        method = str(item.get('method', 'GET')).upper()
+        path = item.get('path')
+        item_errors = {}
+        if method not in METHODS:
+            item_errors['method'] = f'Must be one of {", ".join(METHODS)}.'
+        if not isinstance(path, str) or not path.startswith('/'):
+            item_errors['path'] = 'Must be an absolute path.'
+        elif path.split('?', 1)[0].rstrip('/') == '/batch':
+            item_errors['path'] = 'Batches cannot be nested.'
+        if item_errors:
+            errors[index] = item_errors
+        parsed.append((method, path, item.get('body')))
+
+    if errors:
+        raise ValidationError(errors)
+    return parsed
+
+
+# Runs one sub-request through the application's views, in the app context
+# of the batch, and returns its status and JSON body.
+# An unhandled exception answers that sub-request with a 500, so the
+# responses of the others are kept; outside atomic batches its pending
+# changes are rolled back, atomic batches are aborted by run_batch().
+def dispatch(app, method, path, body, environ):
+    builder = EnvironBuilder(
+        path=path, method=method, json=body, environ_base=environ
+    )
+    try:
+        with app.request_context(builder.get_environ()):
+            try:
+                response = app.make_response(app.full_dispatch_request())
+            except Exception:
+                logger.exception('Batch sub-request %s %s failed.',
+                                 method, path)
+                if not environ.get(TRANSACTION):
+                    from .models import db
+                    db.session.rollback()
+                return {'status': 500, 'body': INTERNAL_ERROR}
+    finally:
+        builder.close()
+    return {
+        'status': response.status_code,
+        'body': response.get_json(silent=True),
+    }
+
+
+# Runs the sub-requests in order.
+# In atomic batches they share one transaction, committed after the last
+# one; the first sub-request answering with an error status stops the
+# batch and rolls back every change, raising BatchAborted.
+# Returns: responses of the sub-requests (list)
+def run_batch(app, requests, environ, atomic=False):
+    from .models import unit_of_work
+    responses = []
+    if not atomic:
+        for method, path, body in requests:
+            responses.append(dispatch(app, method, path, body, environ))
+        return responses
+
+    environ = dict(environ, **{TRANSACTION: True})
+    with unit_of_work():
+        for index, (method, path, body) in enumerate(requests):
+            response = dispatch(app, method, path, body, environ)
+            responses.append(response)
+            if response['status'] >= 400:
+                raise BatchAborted(index, responses)
+    return responses
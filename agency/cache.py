@@ -0,0 +1,204 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from functools import wraps
+from flask import current_app, request
+from .batch import TRANSACTION
+
+
+# ----------------------------------------------------------------------------#
+# Cache backends
+# ----------------------------------------------------------------------------#
+
+# Every backend stores bytes under string keys, with an optional timeout in
+# seconds (0 means no expiry).
+
+# Cache kept in the memory of the current process.
+# Invalidations only reach this process, use it with a single worker.
+class MemoryCache(object):
+    def __init__(self, max_entries=1000):
+        self.entries = {}
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires and expires < time.time():
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value, timeout=0):
+        expires = time.time() + timeout if timeout else 0
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self.entries.clear()
+            self.entries[key] = (expires, value)
+
+
+# Cache kept as files in a directory shared by every worker on the host.
+# Point it at a tmpfs such as /dev/shm to keep it in shared memory.
+class FileSystemCache(object):
+    def __init__(self, directory, prune_rate=0.01):
+        self.directory = directory
+        self.prune_rate = prune_rate
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as entry:
+                expires = float(entry.readline())
+                value = entry.read()
+        except (OSError, ValueError):
+            return None
+        if expires and expires < time.time():
+            return None
+        return value
+
+    # Written to a temporary file and renamed, so readers never see
+    # a partial entry.
+    def set(self, key, value, timeout=0):
+        expires = time.time() + timeout if timeout else 0
+        fd, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as entry:
+            entry.write(b'%f\n' % expires)
+            entry.write(value)
+        os.replace(temporary, self.path(key))
+
+        if random.random() < self.prune_rate:
+            self.prune()
+
+    # Removes expired entries, including those of past generations.
+    def prune(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'rb') as entry:
+                    expires = float(entry.readline())
+                if expires and expires < now:
+                    os.remove(path)
+            except (OSError, ValueError):
+                continue
+
+
+# Cache kept in a Redis-protocol store shared by every worker.
+# Accepts any client exposing redis-py's get() and set(), so a local
+# redis-server can stand in for the production store.
+class RedisCache(object):
+    def __init__(self, client, prefix='cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, timeout=0):
+        self.client.set(self.prefix + key, value, ex=timeout or None)
+
+
+# ----------------------------------------------------------------------------#
+# Response cache
+# ----------------------------------------------------------------------------#
+
+# Flask extension caching the JSON body of read endpoints.
+# Entries are grouped by namespace, usually a table name. Every namespace has
+# a generation token stored in the backend next to the entries, and every
+# entry key includes it. invalidate() replaces the token, so all workers
+# sharing the backend stop seeing the old entries at once.
+class ResponseCache(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config['CACHE_BACKEND']
+        if backend == 'filesystem':
+            app.extensions['cache'] = FileSystemCache(app.config['CACHE_DIR'])
+        elif backend == 'redis':
+            if not app.config['CACHE_STORAGE_URL']:
+                raise RuntimeError(
+                    'CACHE_BACKEND=redis needs CACHE_STORAGE_URL (or '
+                    'REDIS_URL) to be set.'
+                )
+            app.extensions['cache'] = RedisCache.from_url(
+                app.config['CACHE_STORAGE_URL']
+            )
+        elif backend == 'memory':
+            app.extensions['cache'] = MemoryCache()
+        else:
+            app.extensions['cache'] = None
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('cache')
+
+    def generation(self, namespace):
+        key = f'generation:{namespace}'
+        token = self.backend.get(key)
+        if token is None:
+            token = uuid.uuid4().hex.encode()
+            self.backend.set(key, token)
+        return token.decode()
+
+    # Drops every entry of the namespace, in every worker.
+    def invalidate(self, namespace):
+        if self.backend is not None:
+            self.backend.set(
+                f'generation:{namespace}', uuid.uuid4().hex.encode()
+            )
+
+    # Decorator caching successful responses of a view by full path.
+    # The generation is read before the view runs, so a response built from
+    # data older than a concurrent invalidation is stored under a stale key.
+    def cached(self, namespace):
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or request.environ.get(TRANSACTION):
+                    return f(*args, **kwargs)
+
+                key = '%s:%s:%s' % (
+                    namespace, self.generation(namespace), request.full_path
+                )
+                body = self.backend.get(key)
+                if body is not None:
+                    return current_app.response_class(
+                        body, mimetype='application/json'
+                    )
+
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code == 200:
+                    self.backend.set(
+                        key, response.get_data(),
+                        current_app.config['CACHE_TIMEOUT']
+                    )
+                return response
+
+            return wrapper
+
+        return cached_decorator
+
+
+cache = ResponseCache()
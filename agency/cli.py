@@ -0,0 +1,202 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import click
+import time
+from datetime import timedelta
+from flask import current_app
+from flask.cli import AppGroup
+from .jobs import create_worker, purge_files
+from .models import db, Actor, Movie, Stat, Change, TableVersion
+from .partitions import create_ahead, existing_partitions, is_partitioned
+from .profiling import Profiler
+from .seed import seed_table
+from .transfer import MODELS, import_csv, export_csv, bulk_loaded
+
+
+# ----------------------------------------------------------------------------#
+# Commands
+# ----------------------------------------------------------------------------#
+
+# Maintenance commands, available as `flask agency <command>`.
+agency_cli = AppGroup('agency', help='Casting agency maintenance commands.')
+
+
+# Removes soft deleted actors and movies past the retention period.
+@agency_cli.command('purge')
+@click.option('--older-than-days', type=int, default=None,
+              help='Retention period, defaults to SOFT_DELETE_RETENTION_DAYS.')
+@click.option('--batch-size', type=int, default=None,
+              help='Rows per transaction, defaults to PURGE_BATCH_SIZE.')
+def purge(older_than_days, batch_size):
+    if older_than_days is None:
+        older_than_days = current_app.config['SOFT_DELETE_RETENTION_DAYS']
+    if batch_size is None:
+        batch_size = current_app.config['PURGE_BATCH_SIZE']
+
+    for model in (Actor, Movie):
+        purged = model.purge(
+            older_than=timedelta(days=older_than_days),
+            batch_size=batch_size
+        )
+        click.echo(f'Purged {purged} rows from {model.__tablename__}.')
+
+    purged = Change.purge(
+        older_than=timedelta(
+            days=current_app.config['CHANGES_RETENTION_DAYS']
+        ),
+        batch_size=batch_size
+    )
+    click.echo(f'Purged {purged} entries from the change log.')
+
+    removed = purge_files()
+    click.echo(f'Removed {removed} old job files.')
+
+
+# Rebuilds the /stats counters, meant to be scheduled periodically.
+@agency_cli.command('refresh-stats')
+def refresh_stats():
+    Stat.refresh()
+    click.echo(f'Refreshed {Stat.query.count()} stats counters.')
+
+
+# Loads a CSV file, header line first, into the actors or movies table.
+@agency_cli.command('import')
+@click.argument('table', type=click.Choice(sorted(MODELS)))
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--chunk-size', type=int, default=None,
+              help='Rows per insert batch, defaults to CSV_CHUNK_SIZE.')
+def import_command(table, source, chunk_size):
+    if chunk_size is None:
+        chunk_size = current_app.config['CSV_CHUNK_SIZE']
+
+    started = time.perf_counter()
+    try:
+        count = import_csv(MODELS[table], source, chunk_size)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint='source')
+    report(count, 'imported into', table, started)
+    bulk_loaded(table)
+
+
+# Generates deterministic actors and movies, see seed.py.
+@agency_cli.command('seed')
+@click.option('--actors', type=int, default=0, help='Actors to add.')
+@click.option('--movies', type=int, default=0, help='Movies to add.')
+@click.option('--seed', type=int, default=0,
+              help='Same seed, same rows.')
+@click.option('--replace', is_flag=True,
+              help='Delete the existing rows of the seeded tables first.')
+@click.option('--chunk-size', type=int, default=10000,
+              help='Rows per insert batch.')
+def seed_command(actors, movies, seed, replace, chunk_size):
+    for table, count in (('actors', actors), ('movies', movies)):
+        if not count:
+            continue
+        if replace:
+            MODELS[table].query.delete()
+            TableVersion.bump(table)
+            db.session.commit()
+        started = time.perf_counter()
+        count = seed_table(MODELS[table], count, seed, chunk_size)
+        report(count, 'seeded into', table, started)
+        bulk_loaded(table)
+
+
+# Writes the live rows of the actors or movies table as CSV.
+@agency_cli.command('export')
+@click.argument('table', type=click.Choice(sorted(MODELS)))
+@click.argument('target', type=click.File('w'), default='-')
+@click.option('--chunk-size', type=int, default=None,
+              help='Rows fetched per round trip, defaults to CSV_CHUNK_SIZE.')
+def export_command(table, target, chunk_size):
+    if chunk_size is None:
+        chunk_size = current_app.config['CSV_CHUNK_SIZE']
+
+    started = time.perf_counter()
+    count = export_csv(MODELS[table], target, chunk_size)
+    report(count, 'exported from', table, started)
+
+
+# Runs queued jobs, see jobs.py.
+@agency_cli.command('worker')
+@click.option('--processes', type=int, default=None,
+              help='Jobs run at once, defaults to JOBS_PROCESSES.')
+@click.option('--once', is_flag=True,
+              help='Exit once no job is queued or running.')
+def worker_command(processes, once):
+    worker = create_worker(current_app._get_current_object(), processes)
+    click.echo(f'Running jobs on {worker.processes} processes.', err=True)
+    count = worker.run(once=once)
+    click.echo(f'Ran {count} jobs.', err=True)
+
+
+# Profiles of sampled requests, see profiling.py.
+@agency_cli.group('profiles')
+def profiles_cli():
+    pass
+
+
+# Lists the stored profiles, oldest first.
+@profiles_cli.command('list')
+def list_profiles():
+    store = Profiler.store(current_app)
+    for name in store.names():
+        with open(store.path(name)) as profile:
+            samples = sum(int(line.rsplit(' ', 1)[1]) for line in profile)
+        click.echo(f'{name}\t{samples} samples')
+
+
+# Prints a profile as collapsed stacks, ready for flamegraph.pl.
+@profiles_cli.command('dump')
+@click.argument('name')
+def dump_profile(name):
+    store = Profiler.store(current_app)
+    try:
+        with open(store.path(name)) as profile:
+            click.echo(profile.read(), nl=False)
+    except (ValueError, OSError):
+        raise click.ClickException(f'No profile named {name}.')
+
+
+# Yearly partitions of the movies table, see partitions.py.
+@agency_cli.group('partitions')
+def partitions_cli():
+    pass
+
+
+# Creates the yearly partitions missing up to --years-ahead years from now;
+# schedule it so that new releases never land in the default partition.
+@partitions_cli.command('create')
+@click.option('--years-ahead', type=int, default=None,
+              help='Years to cover, defaults to MOVIE_PARTITIONS_AHEAD.')
+def create_partitions(years_ahead):
+    if years_ahead is None:
+        years_ahead = current_app.config['MOVIE_PARTITIONS_AHEAD']
+    if not is_partitioned():
+        raise click.ClickException('The movies table is not partitioned.')
+
+    created = create_ahead(years_ahead)
+    for name in created:
+        click.echo(f'Created partition {name}.')
+    click.echo(f'{len(created)} partitions created.', err=True)
+
+
+# Lists the partitions with their bounds and estimated rows.
+@partitions_cli.command('list')
+def list_partitions():
+    if not is_partitioned():
+        raise click.ClickException('The movies table is not partitioned.')
+    for name, bounds, rows in existing_partitions():
+        click.echo(f'{name}\t{bounds}\t~{rows} rows')
+
+
+# Prints throughput to stderr, so exports can be piped from stdout.
+def report(count, action, table, started):
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    click.echo(
+        f'{count} rows {action} {table} in {elapsed:.2f}s '
+        f'({count / elapsed:.0f} rows/s).',
+        err=True
+    )
@@ -0,0 +1,108 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import threading
+from functools import wraps
+from flask import current_app, request, _request_ctx_stack
+from .batch import TRANSACTION
+
+
+# ----------------------------------------------------------------------------#
+# Request coalescing
+# ----------------------------------------------------------------------------#
+
+# One in-flight call, shared by the requests waiting for it.
+class Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+# Runs at most one call per key at a time; callers arriving while it runs
+# wait for it and share its outcome instead of running their own.
+class SingleFlight(object):
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    # Returns: outcome of fn (tuple of body, status and mimetype)
+    def do(self, key, fn, max_wait):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+
+        if not leader:
+            # Past max_wait, stop waiting and do the work ourselves.
+            if not call.done.wait(max_wait):
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.response
+
+        try:
+            call.response = fn()
+            return call.response
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+# Flask extension coalescing concurrent identical read requests.
+# Requests are identical when they hit the same endpoint with the same query
+# string and the caller has the same permissions, see coalesced().
+class RequestCoalescer(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['COALESCE_ENABLED']:
+            app.extensions['coalesce'] = SingleFlight()
+        else:
+            app.extensions['coalesce'] = None
+
+    # Decorator sharing one execution of the view, and one serialized body,
+    # between concurrent identical requests. Must be applied below
+    # requires_auth, which provides the caller's permissions.
+    def coalesced(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            flight = current_app.extensions.get('coalesce')
+            if flight is None or request.environ.get(TRANSACTION):
+                return f(*args, **kwargs)
+
+            payload = getattr(_request_ctx_stack.top, 'current_user', {})
+            key = (
+                request.endpoint,
+                request.query_string,
+                tuple(sorted(kwargs.items())),
+                tuple(sorted(payload.get('permissions', ()))),
+            )
+
+            def run():
+                response = current_app.make_response(f(*args, **kwargs))
+                return (
+                    response.get_data(),
+                    response.status_code,
+                    response.mimetype
+                )
+
+            body, status, mimetype = flight.do(
+                key, run, current_app.config['COALESCE_MAX_WAIT']
+            )
+            return current_app.response_class(
+                body, status=status, mimetype=mimetype
+            )
+
+        return wrapper
+
+
+coalescer = RequestCoalescer()
@@ -1,14 +1,19 @@
 import os
-from dotenv import load_dotenv
+import tempfile
 
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-load_dotenv(os.path.join(basedir, '.env'))
+# Deployments configure the environment directly; only local checkouts have
+# a .env file, so python-dotenv is only imported for them.
+if os.path.exists(os.path.join(basedir, '.env')):
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(basedir, '.env'))
 
 
 class Config(object):
-    SECRET_KEY = os.environ.get('SECRET_KEY', os.urandom(32))
+    # create_app() generates a random key when none is set.
+    SECRET_KEY = os.environ.get('SECRET_KEY')
 
     # Database variables
     SQLALCHEMY_DATABASE_URI = os.environ.get(
@@ -21,12 +26,212 @@ class Config(object):
         'SQLALCHEMY_TEST_DATABASE_URI'
     )
 
+    # Migration variables, see migrations/env.py
+    MIGRATION_LOCK_TIMEOUT = os.environ.get('MIGRATION_LOCK_TIMEOUT', '5s')
+    MIGRATION_STATEMENT_TIMEOUT = os.environ.get(
+        'MIGRATION_STATEMENT_TIMEOUT', '60s'
+    )
+    MIGRATION_INDEX_STATEMENT_TIMEOUT = os.environ.get(
+        'MIGRATION_INDEX_STATEMENT_TIMEOUT', '0'
+    )
+    MIGRATION_COPY_STATEMENT_TIMEOUT = os.environ.get(
+        'MIGRATION_COPY_STATEMENT_TIMEOUT', '0'
+    )
+
+    # Movie partition variables, see partitions.py
+    # `flask agency partitions create` keeps yearly partitions of the movies
+    # table ready MOVIE_PARTITIONS_AHEAD years past the current one.
+    MOVIE_PARTITIONS_AHEAD = int(
+        os.environ.get('MOVIE_PARTITIONS_AHEAD', 3)
+    )
+
+    # CORS variables, see cors.py
+    # Preflight answers are cached by browsers for CORS_MAX_AGE seconds
+    # (Chromium caps it at 7200).
+    CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*')
+    CORS_ALLOW_HEADERS = os.environ.get(
+        'CORS_ALLOW_HEADERS', 'Content-Type,Authorization'
+    )
+    CORS_ALLOW_METHODS = os.environ.get(
+        'CORS_ALLOW_METHODS', 'GET,PATCH,POST,DELETE,OPTIONS'
+    )
+    CORS_MAX_AGE = int(os.environ.get('CORS_MAX_AGE', 7200))
+
+    # Readiness variables, see health.py
+    READY_TIMEOUT = float(os.environ.get('READY_TIMEOUT', 2))
+    READY_MAX_JWKS_AGE = float(os.environ.get('READY_MAX_JWKS_AGE', 3600))
+
+    # Profiling variables, see profiling.py
+    # Requests sending PROFILE_HEADER with a token granting debug:profile are
+    # sampled every PROFILE_INTERVAL seconds, for at most PROFILE_MAX_SECONDS;
+    # the last PROFILE_MAX_FILES profiles are kept in PROFILE_DIR.
+    PROFILING_ENABLED = os.environ.get(
+        'PROFILING_ENABLED', 'false'
+    ).lower() == 'true'
+    PROFILE_HEADER = os.environ.get('PROFILE_HEADER', 'X-Agency-Profile')
+    PROFILE_DIR = os.environ.get(
+        'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'agency-profiles')
+    )
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+    PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 30))
+
+    # Slow query log variables, see slowlog.py
+    # Statements taking SLOW_QUERY_THRESHOLD milliseconds or more are logged
+    # and aggregated per worker by fingerprint; SLOW_QUERY_EXPLAIN captures
+    # their plan on PostgreSQL.
+    SLOW_QUERY_ENABLED = os.environ.get(
+        'SLOW_QUERY_ENABLED', 'true'
+    ).lower() == 'true'
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', 200))
+    SLOW_QUERY_EXPLAIN = os.environ.get(
+        'SLOW_QUERY_EXPLAIN', 'true'
+    ).lower() == 'true'
+    SLOW_QUERY_MAX_FINGERPRINTS = int(
+        os.environ.get('SLOW_QUERY_MAX_FINGERPRINTS', 500)
+    )
+
+    # List endpoint variables
+    LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', 50))
+    LIST_MAX_PAGE_SIZE = int(os.environ.get('LIST_MAX_PAGE_SIZE', 500))
+
+    # Row fragment variables, see fragments.py
+    # List responses reuse the encoded JSON of up to FRAGMENT_CACHE_MAX_ROWS
+    # rows per worker.
+    FRAGMENT_CACHE_ENABLED = os.environ.get(
+        'FRAGMENT_CACHE_ENABLED', 'true'
+    ).lower() == 'true'
+    FRAGMENT_CACHE_MAX_ROWS = int(
+        os.environ.get('FRAGMENT_CACHE_MAX_ROWS', 100000)
+    )
+
+    # Read model variables
+    # When enabled, GET endpoints are answered from an in-process copy of
+    # the live actors and movies, see readmodel.py.
+    READ_MODEL_ENABLED = os.environ.get(
+        'READ_MODEL_ENABLED', 'false'
+    ).lower() == 'true'
+    READ_MODEL_LISTEN = os.environ.get(
+        'READ_MODEL_LISTEN', 'true'
+    ).lower() == 'true'
+    READ_MODEL_POLL_INTERVAL = float(
+        os.environ.get('READ_MODEL_POLL_INTERVAL', 5)
+    )
+
+    # Soft delete variables
+    SOFT_DELETE_RETENTION_DAYS = int(
+        os.environ.get('SOFT_DELETE_RETENTION_DAYS', 30)
+    )
+    PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 500))
+
+    # Batch endpoint variables
+    BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 20))
+
+    # Change feed variables
+    # /changes?wait=<seconds> long-polls, re-checking the change log every
+    # CHANGES_POLL_INTERVAL seconds for at most CHANGES_MAX_WAIT seconds.
+    # Every waiting request holds a thread, so at most CHANGES_MAX_WAITERS
+    # wait at once in each worker (half of the default GUNICORN_THREADS);
+    # further requests answer at once.
+    CHANGES_PAGE_SIZE = int(os.environ.get('CHANGES_PAGE_SIZE', 100))
+    CHANGES_MAX_PAGE_SIZE = int(os.environ.get('CHANGES_MAX_PAGE_SIZE', 1000))
+    CHANGES_MAX_WAIT = float(os.environ.get('CHANGES_MAX_WAIT', 20))
+    CHANGES_MAX_WAITERS = int(os.environ.get('CHANGES_MAX_WAITERS', 2))
+    CHANGES_POLL_INTERVAL = float(
+        os.environ.get('CHANGES_POLL_INTERVAL', 0.5)
+    )
+    CHANGES_RETENTION_DAYS = int(
+        os.environ.get('CHANGES_RETENTION_DAYS', 30)
+    )
+
+    # Job variables, see jobs.py
+    # `flask agency worker` runs up to JOBS_PROCESSES jobs at once; jobs
+    # still running after JOBS_TIMEOUT seconds are failed when a worker
+    # starts.
+    JOBS_PROCESSES = int(
+        os.environ.get('JOBS_PROCESSES', os.cpu_count() or 2)
+    )
+    JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 1))
+    JOBS_TIMEOUT = int(os.environ.get('JOBS_TIMEOUT', 3600))
+    # Exports and uploads (the job_files table) older than
+    # JOBS_RETENTION_HOURS are removed by workers (hourly) and by
+    # `flask agency purge`.
+    JOBS_RETENTION_HOURS = int(os.environ.get('JOBS_RETENTION_HOURS', 72))
+
+    # CSV import and export variables
+    CSV_CHUNK_SIZE = int(os.environ.get('CSV_CHUNK_SIZE', 1000))
+
+    # Rate limit variables
+    # Limits are written as '<requests>/<second|minute|hour|day>'.
+    RATE_LIMIT_ENABLED = os.environ.get(
+        'RATE_LIMIT_ENABLED', 'true'
+    ).lower() == 'true'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_STORAGE_URL = os.environ.get('RATE_LIMIT_STORAGE_URL')
+    RATE_LIMIT_PER_IP = os.environ.get('RATE_LIMIT_PER_IP', '600/minute')
+    # Proxies in front of the app whose X-Forwarded-For entry is trusted,
+    # so RATE_LIMIT_PER_IP counts client addresses rather than the
+    # proxy's. Heroku's router (DYNO is set on dynos) is one; without a
+    # proxy it must stay 0, or clients could pick their own address.
+    TRUSTED_PROXIES = int(
+        os.environ.get('TRUSTED_PROXIES', 1 if 'DYNO' in os.environ else 0)
+    )
+    RATE_LIMIT_DEFAULT = os.environ.get('RATE_LIMIT_DEFAULT', '120/minute')
+    RATE_LIMITS = {
+        'read:actors': '300/minute',
+        'read:movies': '300/minute',
+        'create:actor': '60/minute',
+        'create:movie': '60/minute',
+        'update:actor': '60/minute',
+        'update:movie': '60/minute',
+        'delete:actor': '30/minute',
+        'delete:movie': '30/minute',
+    }
+
+    # Response cache variables
+    # CACHE_BACKEND is one of 'memory', 'filesystem', 'redis' or 'none'.
+    # Only 'filesystem' and 'redis' share entries and invalidations between
+    # workers and with the CLI and job processes of the same host ('redis'
+    # across hosts); 'memory' is refused by gunicorn.conf.py with more than
+    # one worker. CACHE_DIR defaults to the /dev/shm tmpfs when present.
+    # Heroku dynos (DYNO is set) share no filesystem, so 'redis' is the
+    # default there, with the REDIS_URL of the Heroku Redis add-on.
+    CACHE_BACKEND = os.environ.get(
+        'CACHE_BACKEND', 'redis' if 'DYNO' in os.environ else 'filesystem'
+    )
+    CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(
+        '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+        'agency-cache'
+    ))
+    CACHE_STORAGE_URL = os.environ.get(
+        'CACHE_STORAGE_URL', os.environ.get('REDIS_URL')
+    )
+    CACHE_TIMEOUT = int(os.environ.get('CACHE_TIMEOUT', 300))
+
+    # Request coalescing variables
+    # Concurrent identical reads only occur with threaded workers.
+    COALESCE_ENABLED = os.environ.get(
+        'COALESCE_ENABLED', 'true'
+    ).lower() == 'true'
+    COALESCE_MAX_WAIT = float(os.environ.get('COALESCE_MAX_WAIT', 5))
+
     # Auth0 variables
     AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN')
     AUTH0_API_AUDIENCE = os.environ.get('AUTH0_API_AUDIENCE')
     AUTH0_CLIENT_ID = os.environ.get('AUTH0_CLIENT_ID')
     AUTH0_CLIENT_SECRET = os.environ.get('AUTH0_CLIENT_SECRET')
     AUTH0_ALGORITHMS = os.environ.get('AUTH0_ALGORITHMS', ['RS256'])
+    # Seconds the Auth0 key set is reused before being fetched again, and
+    # minimum seconds between refetches triggered by an unknown key id.
+    AUTH0_JWKS_TTL = float(os.environ.get('AUTH0_JWKS_TTL', 600))
+    AUTH0_JWKS_MIN_REFRESH = float(
+        os.environ.get('AUTH0_JWKS_MIN_REFRESH', 30)
+    )
+
+    # Token verification keys: 'auth0', 'jwks_file' or 'pem_dir'
+    AUTH_KEY_PROVIDER = os.environ.get('AUTH_KEY_PROVIDER', 'auth0')
+    AUTH_JWKS_FILE = os.environ.get('AUTH_JWKS_FILE')
+    AUTH_PEM_DIR = os.environ.get('AUTH_PEM_DIR')
 
     # Tokens
     ASSISTANT_ROLE_TOKEN = os.environ.get('ASSISTANT_ROLE_TOKEN')
@@ -0,0 +1,88 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+from flask import request
+
+
+# ----------------------------------------------------------------------------#
+# Cross-origin requests
+# ----------------------------------------------------------------------------#
+
+# WSGI middleware answering CORS preflight requests.
+# A preflight is an OPTIONS request carrying Access-Control-Request-Method;
+# it is answered here, before Flask builds a request context, routes, checks
+# tokens or counts rate limits, with headers computed once at startup.
+class PreflightMiddleware(object):
+    def __init__(self, wsgi_app, policy):
+        self.wsgi_app = wsgi_app
+        self.policy = policy
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] == 'OPTIONS' and \
+                'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in environ:
+            start_response('204 No Content', self.policy.preflight_headers(
+                environ.get('HTTP_ORIGIN')
+            ))
+            return []
+        return self.wsgi_app(environ, start_response)
+
+
+# Allowed origins and the precomputed header sets sent to them.
+# CORS_ORIGINS is '*' or a comma separated list of origins; with a list,
+# the request's origin is echoed back when allowed, with Vary: Origin.
+class CORSPolicy(object):
+    def __init__(self, config):
+        origins = config['CORS_ORIGINS'].strip()
+        self.any_origin = origins == '*'
+        self.origins = frozenset(
+            origin.strip() for origin in origins.split(',') if origin.strip()
+        )
+        self.preflight = [
+            ('Access-Control-Allow-Methods', config['CORS_ALLOW_METHODS']),
+            ('Access-Control-Allow-Headers', config['CORS_ALLOW_HEADERS']),
+            ('Access-Control-Max-Age', str(config['CORS_MAX_AGE'])),
+            ('Content-Length', '0'),
+        ]
+        self.any_origin_headers = [('Access-Control-Allow-Origin', '*')]
+
+    # Returns: headers granting the origin access, empty when it is not
+    # allowed (list)
+    def origin_headers(self, origin):
+        if self.any_origin:
+            return self.any_origin_headers
+        if origin in self.origins:
+            return [
+                ('Access-Control-Allow-Origin', origin), ('Vary', 'Origin')
+            ]
+        return []
+
+    def preflight_headers(self, origin):
+        return self.origin_headers(origin) + self.preflight
+
+
+# Flask extension handling cross-origin requests in one place: preflights
+# in PreflightMiddleware, and Access-Control-Allow-Origin set (never added
+# twice) on every other response.
+class CrossOrigin(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        policy = CORSPolicy(app.config)
+        app.extensions['cors'] = policy
+        app.wsgi_app = PreflightMiddleware(app.wsgi_app, policy)
+
+        @app.after_request
+        def allow_origin(response):
+            for name, value in policy.origin_headers(
+                    request.headers.get('Origin')):
+                if name == 'Vary':
+                    response.vary.add(value)
+                else:
+                    response.headers[name] = value
+            return response
+
+
+cors = CrossOrigin()
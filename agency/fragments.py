@@ -0,0 +1,102 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import threading
+from flask import current_app, json
+from sqlalchemy import inspect
+
+
+# ----------------------------------------------------------------------------#
+# Row fragments
+# ----------------------------------------------------------------------------#
+
+# Encoded JSON of rows, by table and id, with the row version (updated_at)
+# it was encoded from. A fragment is only used while the row's version
+# matches, so a row changed by another worker is encoded again here; the
+# model mutation methods also drop the fragments of the rows they change,
+# see discard(). Past max_rows fragments, the oldest ones are dropped.
+class FragmentStore(object):
+    def __init__(self, max_rows):
+        self.max_rows = max_rows
+        self.fragments = {}
+        self.lock = threading.Lock()
+
+    # Returns: encoded row (bytes)
+    def get(self, table, row):
+        key = (table, row.id)
+        entry = self.fragments.get(key)
+        if entry is not None and entry[0] == row.updated_at:
+            return entry[1]
+
+        fragment = encode(row.format())
+        with self.lock:
+            if len(self.fragments) >= self.max_rows:
+                # Dictionaries keep insertion order: drop the oldest tenth.
+                for old in list(self.fragments)[:self.max_rows // 10 + 1]:
+                    del self.fragments[old]
+            self.fragments[key] = (row.updated_at, fragment)
+        return fragment
+
+    def discard(self, table, ids):
+        with self.lock:
+            for id in ids:
+                self.fragments.pop((table, id), None)
+
+
+# Encodes like jsonify(), without whitespace.
+def encode(data):
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+# Flask extension answering list endpoints from row fragments.
+# With FRAGMENT_CACHE_ENABLED false rows are still encoded one by one and
+# concatenated, just not kept.
+class RowFragments(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['FRAGMENT_CACHE_ENABLED']:
+            app.extensions['fragments'] = FragmentStore(
+                app.config['FRAGMENT_CACHE_MAX_ROWS']
+            )
+        else:
+            app.extensions['fragments'] = None
+
+    # Returns: encoded rows (list)
+    def encode_rows(self, model, rows):
+        store = current_app.extensions.get('fragments')
+        if store is None:
+            return [encode(row.format()) for row in rows]
+        table = model.__tablename__
+        return [store.get(table, row) for row in rows]
+
+    # Builds the same body as jsonify({'success': True, name: [...]}),
+    # concatenating the rows' fragments into the envelope.
+    # Returns: JSON response (Response)
+    def list_response(self, name, model, rows):
+        body = b''.join((
+            b'{"', name.encode(), b'":[',
+            b','.join(self.encode_rows(model, rows)),
+            b'],"success":true}\n'
+        ))
+        return current_app.response_class(body, mimetype='application/json')
+
+    # Drops the fragments of changed rows. Ids are read from the identity
+    # map, as reading attributes of rows expired by the commit would load
+    # them again.
+    def discard(self, rows):
+        store = current_app.extensions.get('fragments')
+        if store is None:
+            return
+        tables = {}
+        for row in rows:
+            id = inspect(row).identity[0]
+            tables.setdefault(row.__tablename__, []).append(id)
+        for table, ids in tables.items():
+            store.discard(table, ids)
+
+
+fragments = RowFragments()
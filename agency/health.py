@@ -0,0 +1,145 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import threading
+from flask import current_app
+from .auth.auth import auth_keys
+from .coalesce import Call
+
+
+# ----------------------------------------------------------------------------#
+# Readiness checks
+# ----------------------------------------------------------------------------#
+
+# Runs `SELECT 1` in a helper thread and waits for it at most timeout
+# seconds, so a hung connection or an exhausted pool cannot hold the probe.
+# A check still running is shared with the next probes instead of being
+# started again.
+class DatabaseProbe(object):
+    def __init__(self, app, db, timeout):
+        self.app = app
+        self.db = db
+        self.timeout = timeout
+        self.pending = None
+        self.lock = threading.Lock()
+
+    # Returns: error message, None when the database answered (string)
+    def check(self):
+        with self.lock:
+            call = self.pending
+            if call is None or call.done.is_set():
+                call = self.pending = Call()
+                thread = threading.Thread(
+                    target=self.run, args=(call,), name='readiness',
+                    daemon=True
+                )
+                thread.start()
+
+        if not call.done.wait(self.timeout):
+            return f'No answer within {self.timeout:g}s.'
+        return call.error
+
+    def run(self, call):
+        try:
+            with self.app.app_context():
+                engine = self.db.get_engine(self.app)
+                with engine.begin() as connection:
+                    if engine.dialect.name == 'postgresql':
+                        connection.execute(
+                            'SET LOCAL statement_timeout = %d'
+                            % (self.timeout * 1000)
+                        )
+                    connection.execute('SELECT 1')
+        except Exception as error:
+            call.error = str(error) or error.__class__.__name__
+        finally:
+            call.done.set()
+
+
+# Returns: connection counts of a QueuePool, empty for pools without them,
+# such as SQLite's (dictionary)
+def pool_status(pool):
+    status = {}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, name, None)
+        if method is not None:
+            status[name] = method()
+    return status
+
+
+# Whether every connection the pool may open is checked out.
+def pool_exhausted(pool):
+    max_overflow = getattr(pool, '_max_overflow', -1)
+    status = pool_status(pool)
+    if max_overflow < 0 or 'checkedout' not in status:
+        return False
+    return status['checkedout'] >= status['size'] + max_overflow
+
+
+# Whether the key set is older than max_age and could not be refreshed.
+# The cache only refetches while verifying tokens, so the keys of an idle
+# worker merely age; and a worker taken out of rotation gets no token that
+# would refresh them, so a stale key set is refetched from a helper thread
+# here (at most once per AUTH0_JWKS_MIN_REFRESH, see JWKSCache.get()).
+def jwks_stale(keys, max_age):
+    age = keys.age()
+    if keys.error is None or age is None or age <= max_age:
+        return False
+    if not keys.lock.locked():
+        threading.Thread(
+            target=refresh_keys, args=(keys,), name='jwks-refresh',
+            daemon=True
+        ).start()
+    return True
+
+
+def refresh_keys(keys):
+    try:
+        keys.get()
+    except Exception:
+        pass
+
+
+# Flask extension answering /readyz.
+# Not ready when the database does not answer within READY_TIMEOUT seconds,
+# when the connection pool is exhausted, or when refreshing the Auth0 key
+# set has failed and it is older than READY_MAX_JWKS_AGE seconds.
+class Readiness(object):
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.extensions['readiness'] = DatabaseProbe(
+            app, db, app.config['READY_TIMEOUT']
+        )
+
+    # Returns: whether the worker is ready, and the result of every check
+    # (tuple)
+    def check(self):
+        probe = current_app.extensions['readiness']
+        pool = probe.db.get_engine(current_app).pool
+
+        if pool_exhausted(pool):
+            database = 'Connection pool exhausted.'
+        else:
+            database = probe.check()
+
+        keys = auth_keys.provider
+        age = keys.age()
+        stale = jwks_stale(keys, current_app.config['READY_MAX_JWKS_AGE'])
+
+        checks = {
+            'database': {'ok': database is None, 'error': database},
+            'pool': pool_status(pool),
+            'jwks': {
+                'ok': not stale,
+                'age': None if age is None else round(age, 1),
+                'error': keys.error,
+            },
+        }
+        return database is None and not stale, checks
+
+
+readiness = Readiness()
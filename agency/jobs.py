@@ -0,0 +1,269 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import io
+import logging
+import multiprocessing
+import tempfile
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from flask import abort, current_app, request
+from .models import db, Job, JobFile, Stat
+from .schema import ValidationError
+from .transfer import MODELS, import_csv, export_csv, bulk_loaded
+
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------------#
+# Job kinds
+# ----------------------------------------------------------------------------#
+
+# Job kinds by name, as (prepare, run).
+# prepare(job_request, payload) runs in the web worker when the job is
+# submitted and returns its params; it must stay quick, raises
+# ValidationError for invalid requests and answers 403 when the token
+# payload lacks the permissions the job needs. run(job) runs in a worker
+# process and returns the job's result.
+JOBS = {}
+
+
+def job_kind(kind, prepare):
+    def decorator(run):
+        JOBS[kind] = (prepare, run)
+        return run
+    return decorator
+
+
+# Removes the exports and uploads older than the retention period: finished
+# exports are only downloaded for a while, and uploads of jobs that were
+# never run would otherwise stay forever.
+# Returns: number of files removed (int)
+def purge_files(older_than=None):
+    if older_than is None:
+        older_than = timedelta(
+            hours=current_app.config['JOBS_RETENTION_HOURS']
+        )
+    return JobFile.purge(datetime.utcnow() - older_than)
+
+
+# Returns: table named by the request (string)
+def requested_table(table):
+    if table not in MODELS:
+        raise ValidationError({
+            'table': f'Must be one of {", ".join(sorted(MODELS))}.'
+        })
+    return table
+
+
+# submit:jobs alone does not grant access to the tables a job reads or
+# writes: jobs need the permission of the matching endpoint.
+def require_permission(payload, permission):
+    if permission not in payload.get('permissions', []):
+        abort(403)
+
+
+def no_params(job_request, payload):
+    return {}
+
+
+def export_params(job_request, payload):
+    data = job_request.get_json(silent=True) or {}
+    table = requested_table(data.get('table'))
+    require_permission(payload, f'read:{table}')
+    return {'table': table}
+
+
+# Streams the uploaded CSV to a job file, the request body never being
+# held in memory.
+def import_params(job_request, payload):
+    table = requested_table(job_request.args.get('table'))
+    require_permission(
+        payload, f'create:{MODELS[table].__name__.lower()}'
+    )
+    name = f'import-{uuid.uuid4().hex}.csv'
+    JobFile.write(name, job_request.stream)
+    return {'table': table, 'file': name}
+
+
+@job_kind('refresh-stats', no_params)
+def refresh_stats(job):
+    Stat.refresh()
+    return {'counters': Stat.query.count()}
+
+
+@job_kind('export', export_params)
+def export_table(job):
+    name = f'export-{job.id}.csv'
+    # Spooled to a local file first, then stored chunk by chunk.
+    with tempfile.TemporaryFile() as spool:
+        target = io.TextIOWrapper(spool, encoding='utf-8', newline='')
+        rows = export_csv(
+            MODELS[job.params['table']], target,
+            current_app.config['CSV_CHUNK_SIZE']
+        )
+        target.flush()
+        spool.seek(0)
+        JobFile.write(name, spool)
+    return {'rows': rows, 'file': name}
+
+
+@job_kind('import', import_params)
+def import_table(job):
+    table = job.params['table']
+    name = job.params['file']
+    try:
+        with tempfile.TemporaryFile() as spool:
+            for chunk in JobFile.read(name):
+                spool.write(chunk)
+            spool.seek(0)
+            source = io.TextIOWrapper(spool, encoding='utf-8', newline='')
+            rows = import_csv(
+                MODELS[table], source, current_app.config['CSV_CHUNK_SIZE']
+            )
+    finally:
+        JobFile.remove(name)
+    bulk_loaded(table)
+    return {'rows': rows}
+
+
+# Queues a job of the given kind for the current request.
+# Returns: the queued job (Job)
+def submit(kind, payload):
+    if kind not in JOBS:
+        raise ValidationError({
+            'kind': f'Must be one of {", ".join(sorted(JOBS))}.'
+        })
+    prepare = JOBS[kind][0]
+    return Job.submit(kind, prepare(request, payload), payload.get('sub'))
+
+
+# ----------------------------------------------------------------------------#
+# Worker
+# ----------------------------------------------------------------------------#
+
+# Runs in a pool process: every job gets a fresh session, committed or
+# rolled back by finish().
+def execute(id):
+    job = Job.query.get(id)
+    try:
+        run = JOBS[job.kind][1]
+        result = run(job)
+    except Exception as error:
+        logger.exception('Job %s failed.', id)
+        db.session.rollback()
+        job.finish(error=str(error) or error.__class__.__name__)
+    else:
+        job.finish(result=result)
+    finally:
+        db.session.remove()
+
+
+def init_process(app):
+    app.app_context().push()
+
+
+# Claims queued jobs and runs them on a pool of forked processes, at most
+# one job per process at a time, so web workers never run them. Old job
+# files are purged on start and then every PURGE_INTERVAL seconds.
+# The pool is forked before the parent holds a database connection, and
+# forked again (after dropping the parent's connections) if a process
+# dies, so parent and children never share a connection.
+class Worker(object):
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, app, processes, poll_interval, timeout):
+        self.app = app
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.pool = None
+        self.purged_at = None
+
+    def purge(self):
+        now = time.monotonic()
+        if self.purged_at is None or \
+                now - self.purged_at >= self.PURGE_INTERVAL:
+            self.purged_at = now
+            removed = purge_files()
+            if removed:
+                logger.info('Removed %d old job files.', removed)
+
+    def start_pool(self):
+        db.session.remove()
+        db.get_engine(self.app).dispose()
+        self.pool = ProcessPoolExecutor(
+            self.processes,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=init_process, initargs=(self.app,)
+        )
+        # Forks every process now, while the parent holds no connection.
+        self.pool.submit(int).result()
+
+    # With once=True, returns when no job is queued or running.
+    # Returns: number of jobs run (int)
+    def run(self, once=False):
+        self.start_pool()
+        failed = Job.fail_stale(self.timeout)
+        if failed:
+            logger.warning('Failed %d jobs left running.', failed)
+
+        running = {}
+        count = 0
+        try:
+            while True:
+                self.purge()
+                while len(running) < self.processes:
+                    job = Job.claim()
+                    if job is None:
+                        break
+                    running[self.pool.submit(execute, job.id)] = job.id
+                    count += 1
+
+                if not running:
+                    if once:
+                        return count
+                    time.sleep(self.poll_interval)
+                    continue
+
+                done, _ = wait(
+                    running, self.poll_interval, return_when=FIRST_COMPLETED
+                )
+                broken = False
+                for future in done:
+                    id = running.pop(future)
+                    error = future.exception()
+                    if isinstance(error, BrokenProcessPool):
+                        broken = True
+                        self.lost(id)
+                    elif error is not None:
+                        logger.error('Job %s could not finish: %s', id, error)
+                if broken:
+                    for id in running.values():
+                        self.lost(id)
+                    running = {}
+                    self.pool.shutdown(wait=False)
+                    self.start_pool()
+        finally:
+            self.pool.shutdown()
+
+    def lost(self, id):
+        job = Job.query.get(id)
+        if job.status == 'running':
+            job.finish(error='Worker process died.')
+
+
+# Returns: worker configured from the application's JOBS_* settings
+# (Worker)
+def create_worker(app, processes=None):
+    return Worker(
+        app,
+        processes or app.config['JOBS_PROCESSES'],
+        app.config['JOBS_POLL_INTERVAL'],
+        timedelta(seconds=app.config['JOBS_TIMEOUT'])
+    )
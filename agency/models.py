@@ -2,23 +2,290 @@
 # Imports
 # ----------------------------------------------------------------------------#
 
+import operator
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.ext import baked
+from .cache import cache
+from .fragments import fragments
+from .readmodel import CHANNEL, read_model
+from .schema import Schema, String, Integer, Date
 
 
 # ----------------------------------------------------------------------------#
 # Configuration
 # ----------------------------------------------------------------------------#
 
+# Sessions are scoped to the current thread (or greenlet, when greenlet is
+# installed) and removed when its app context ends, so every gthread or
+# gevent request gets its own.
 db = SQLAlchemy()
 
+# Hot queries are built with the bakery: their Query construction and SQL
+# compilation run once per shape, later calls only bind new parameters.
+bakery = baked.bakery()
+
+# Compiled SQL of the prebuilt Core statements, see execute_cached().
+compiled_cache = {}
+
+
+# Executes a statement built once at import time within the session's
+# transaction, compiling it only on first use.
+def execute_cached(statement, params):
+    connection = db.session.connection().execution_options(
+        compiled_cache=compiled_cache
+    )
+    return connection.execute(statement, params)
+
+
+# ----------------------------------------------------------------------------#
+# Mixins
+# ----------------------------------------------------------------------------#
+
+# Shared persistence helpers for the agency models.
+# Rows are never removed by delete(); they are marked with deleted_at and
+# physically removed later, in small batches, by purge().
+class CRUDMixin(object):
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    # Every mutation takes the change log lock before writing anything, so
+    # concurrent transactions always lock it before the stats counters and
+    # rows, whatever mix of mutations they group, see Change.lock().
+    def insert(self):
+        Change.lock()
+        db.session.add(self)
+        Stat.record(self.stat_buckets(), 1)
+        self.commit('insert')
+
+    def update(self):
+        Change.lock()
+        if self.deleted_at is None:
+            previous = self.stat_buckets(self.previous)
+            current = self.stat_buckets()
+            if previous != current:
+                Stat.record(previous, -1)
+                Stat.record(current, 1)
+        self.commit('update')
+
+    def delete(self):
+        Change.lock()
+        if self.deleted_at is None:
+            Stat.record(self.stat_buckets(), -1)
+        self.deleted_at = datetime.utcnow()
+        self.commit('delete')
+
+    # Logs the change, commits, then publishes it, see publish().
+    # Inside unit_of_work() the changes are only flushed, and the commit and
+    # publication happen once when the unit of work ends.
+    def commit(self, operation):
+        db.session.flush()
+        Change.record(self, operation)
+        if read_model.enabled:
+            TableVersion.bump(self.__tablename__, self.id)
+
+        rows = db.session.info.get('unit_of_work')
+        if rows is not None:
+            db.session.flush()
+            rows.append(self)
+            return
+
+        db.session.commit()
+        publish([self])
+
+    # Value of an attribute before the pending, unflushed changes.
+    def previous(self, name):
+        history = inspect(self).attrs[name].history
+        if history.deleted:
+            return history.deleted[0]
+        return getattr(self, name)
+
+    # Summary buckets this row is counted in, see Stat.
+    # Accepts: value (function) returning an attribute's value by name,
+    # used by update() to compute the buckets of the previous values.
+    def stat_buckets(self, value=None):
+        raise NotImplementedError
+
+    # Query over the rows that have not been soft deleted.
+    @classmethod
+    def live(cls):
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    # Baked query over the live rows; the model is part of the cache key.
+    @classmethod
+    def baked_live(cls):
+        query = bakery(lambda session: session.query(cls), cls)
+        query += lambda q: q.filter(cls.deleted_at.is_(None))
+        return query
+
+    # Returns the row with the given primary key, unless it was deleted.
+    @classmethod
+    def get_live(cls, id):
+        query = cls.baked_live()
+        query += lambda q: q.filter(cls.id == bindparam('id'))
+        return query(db.session()).params(id=id).first()
+
+    # Read-only lookups for the GET endpoints. Both are answered from the
+    # in-process read model when it is enabled, and return records with the
+    # same format() as the rows otherwise read from the database. Inside a
+    # unit of work with pending changes they read the database, which holds
+    # them.
+    @classmethod
+    def find(cls, id):
+        table = cls.read_model_table()
+        if table is not None:
+            return table.get(id)
+        return cls.get_live(id)
+
+    @classmethod
+    def read_model_table(cls):
+        if db.session.info.get('unit_of_work'):
+            return None
+        return read_model.table(cls)
+
+    # Returns live rows ordered by id, matching every
+    # (attribute, operator, value) filter, paginated by offset and limit.
+    @classmethod
+    def select(cls, filters=(), offset=0, limit=None):
+        table = cls.read_model_table()
+        if table is not None:
+            return table.select(filters, offset, limit)
+
+        # The filtered attributes and operators are part of the cache key,
+        # their values and the page bounds are bound parameters.
+        query = cls.baked_live()
+        params = {}
+        for index, (name, op, value) in enumerate(filters):
+            key = f'filter_{index}'
+            query.add_criteria(
+                lambda q, name=name, op=op, key=key: q.filter(
+                    op(getattr(cls, name), bindparam(key))
+                ),
+                name, op
+            )
+            params[key] = value
+        query += lambda q: q.order_by(cls.id)
+        if offset:
+            query += lambda q: q.offset(bindparam('offset'))
+            params['offset'] = offset
+        if limit is not None:
+            query += lambda q: q.limit(bindparam('limit'))
+            params['limit'] = limit
+        return query(db.session()).params(**params).all()
+
+    # Physically removes rows soft deleted before the cutoff.
+    # Each batch is deleted and committed on its own, so locks are only
+    # ever held on at most batch_size rows at a time.
+    # Returns: number of rows removed (int)
+    @classmethod
+    def purge(cls, older_than=timedelta(days=30), batch_size=500):
+        cutoff = datetime.utcnow() - older_than
+        purged = 0
+
+        while True:
+            ids = [
+                row.id for row in db.session.query(cls.id)
+                .filter(cls.deleted_at.isnot(None))
+                .filter(cls.deleted_at < cutoff)
+                .order_by(cls.deleted_at)
+                .limit(batch_size)
+            ]
+            if not ids:
+                break
+
+            cls.query.filter(cls.id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+            purged += len(ids)
+
+            if len(ids) < batch_size:
+                break
+
+        if purged:
+            TableVersion.bump(cls.__tablename__)
+            db.session.commit()
+        return purged
+
+
+# Groups model mutations into a single transaction.
+# Model methods called inside the block flush instead of committing; the
+# block commits once at the end, or rolls everything back if it raises.
+# Nested blocks join the outermost one. Also usable as a view decorator, to
+# defer the commit to the end of the request.
+@contextmanager
+def unit_of_work():
+    if 'unit_of_work' in db.session.info:
+        yield
+        return
+
+    rows = db.session.info['unit_of_work'] = []
+    try:
+        yield
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        del db.session.info['unit_of_work']
+
+    publish(rows)
+
+
+# Propagates committed rows: drops the cached responses of their tables in
+# every worker and updates this process' read model.
+def publish(rows):
+    for table in {row.__tablename__ for row in rows}:
+        cache.invalidate(table)
+    fragments.discard(rows)
+    read_model.apply(rows)
+
+
+# Partial indexes shared by both tables: one covering the live rows read by
+# the list queries, one covering the soft deleted rows scanned by purge().
+def soft_delete_indexes(table):
+    return (
+        db.Index(
+            f'ix_{table}_live',
+            'id',
+            postgresql_where=db.text('deleted_at IS NULL'),
+            sqlite_where=db.text('deleted_at IS NULL')
+        ),
+        db.Index(
+            f'ix_{table}_deleted_at',
+            'deleted_at',
+            postgresql_where=db.text('deleted_at IS NOT NULL'),
+            sqlite_where=db.text('deleted_at IS NOT NULL')
+        ),
+    )
+
 
 # ----------------------------------------------------------------------------#
 # Models
 # ----------------------------------------------------------------------------#
 
 # Model for the actors table
-class Actor(db.Model):
+class Actor(CRUDMixin, db.Model):
     __tablename__ = 'actors'
+    __table_args__ = soft_delete_indexes('actors')
+
+    # List filters: query argument -> (attribute, operator, type)
+    filters = {
+        'gender': ('gender', operator.eq, str),
+        'min_age': ('age', operator.ge, int),
+        'max_age': ('age', operator.le, int),
+    }
+
+    # Create and update payloads, see schema.py
+    schema = Schema(
+        name=String(),
+        age=Integer(minimum=0, maximum=150),
+        gender=String(),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -33,16 +300,16 @@ class Actor(db.Model):
         self.age = age
         self.gender = gender
 
-    def insert(self):
-        db.session.add(self)
-        db.session.commit()
-
-    def update(self):
-        db.session.commit()
-
-    def delete(self):
-        db.session.delete(self)
-        db.session.commit()
+    def stat_buckets(self, value=None):
+        value = value or (lambda name: getattr(self, name))
+        age = value('age')
+        decade = int(age) // 10 * 10 if age not in (None, '') else None
+        return [
+            ('actors.total', ''),
+            ('actors.by_gender', value('gender') or 'unknown'),
+            ('actors.by_age',
+                f'{decade}-{decade + 9}' if decade is not None else 'unknown'),
+        ]
 
     def format(self):
         return {
@@ -54,8 +321,30 @@ class Actor(db.Model):
 
 
 # Model for the movies table
-class Movie(db.Model):
+class Movie(CRUDMixin, db.Model):
     __tablename__ = 'movies'
+    __table_args__ = soft_delete_indexes('movies') + (
+        db.Index(
+            'ix_movies_release',
+            'release',
+            postgresql_where=db.text('deleted_at IS NULL'),
+            sqlite_where=db.text('deleted_at IS NULL')
+        ),
+    )
+
+    # List filters: query argument -> (attribute, operator, type)
+    # On PostgreSQL movies is partitioned by release year (partitions.py);
+    # comparing the bare column lets the planner skip the other years.
+    filters = {
+        'release_from': ('release', operator.ge, date.fromisoformat),
+        'release_to': ('release', operator.le, date.fromisoformat),
+    }
+
+    # Create and update payloads, see schema.py
+    schema = Schema(
+        title=String(),
+        release=Date(),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String)
@@ -68,20 +357,464 @@ class Movie(db.Model):
         self.title = title
         self.release = release
 
-    def insert(self):
-        db.session.add(self)
+    def stat_buckets(self, value=None):
+        value = value or (lambda name: getattr(self, name))
+        release = value('release')
+        return [
+            ('movies.total', ''),
+            ('movies.by_year', str(release)[:4] if release else 'unknown'),
+        ]
+
+    def format(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'release': str(self.release),
+        }
+
+
+# Model for the stats table
+# Keeps one counter per (metric, bucket), e.g. ('actors.by_gender', 'male'),
+# maintained incrementally by the model mutation methods, so reading the
+# statistics never scans the actors or movies tables. refresh() rebuilds
+# every counter from scratch after bulk loads or on a schedule.
+class Stat(db.Model):
+    __tablename__ = 'stats'
+
+    metric = db.Column(db.String, primary_key=True)
+    bucket = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<Stat metric='{self.metric}' bucket='{self.bucket}'>"
+
+    # Adds delta to each bucket inside the current transaction. A single
+    # upsert per bucket, so writers creating the same bucket at once both
+    # count instead of one failing on the primary key.
+    @classmethod
+    def record(cls, buckets, delta):
+        for metric, bucket in buckets:
+            execute_cached(STAT_INCREMENT, {
+                'stat_metric': metric,
+                'stat_bucket': bucket,
+                'delta': delta,
+            })
+
+    # Recomputes every counter from the live actors and movies.
+    # Counters are overwritten in place rather than deleted and inserted
+    # again, and the change log lock keeps model writes out meanwhile, see
+    # Change.lock().
+    @classmethod
+    def refresh(cls):
+        Change.lock()
+        counts = {}
+        for model in (Actor, Movie):
+            for row in model.live().yield_per(1000):
+                for key in row.stat_buckets():
+                    counts[key] = counts.get(key, 0) + 1
+
+        cls.query.update({cls.count: 0}, synchronize_session=False)
+        if counts:
+            execute_cached(STAT_SET, [
+                {'stat_metric': metric, 'stat_bucket': bucket, 'delta': count}
+                for (metric, bucket), count in counts.items()
+            ])
+        cls.query.filter(cls.count == 0).delete(synchronize_session=False)
         db.session.commit()
 
-    def update(self):
+    # Returns: nested dictionary of every non-empty counter
+    @classmethod
+    def format_all(cls):
+        stats = {}
+        for stat in cls.query.filter(cls.count > 0):
+            scope, name = stat.metric.split('.', 1)
+            group = stats.setdefault(scope, {})
+            if name == 'total':
+                group['total'] = stat.count
+            else:
+                group.setdefault(name, {})[stat.bucket] = stat.count
+        return stats
+
+
+# Model for the table_versions table
+# One counter per table, incremented in the same transaction as every change
+# made through the model methods while the read model is enabled. Workers
+# poll it to find out their in-process copy is stale; on PostgreSQL each
+# change is also announced with NOTIFY.
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<TableVersion name='{self.name}' version='{self.version}'>"
+
+    # Increments the table's version, and announces the changed row on
+    # PostgreSQL; notifications are only delivered once the transaction
+    # commits. Without an id, the whole table is announced as changed, so
+    # every read model reloads it.
+    @classmethod
+    def bump(cls, name, id=None):
+        updated = execute_cached(
+            TABLE_VERSION_INCREMENT, {'table_name': name}
+        ).rowcount
+        if not updated:
+            db.session.add(cls(name=name, version=1))
+            db.session.flush()
+
+        if db.engine.dialect.name == 'postgresql':
+            version = db.session.query(cls.version).filter_by(name=name)
+            db.session.execute(
+                db.text('SELECT pg_notify(:channel, :payload)'),
+                {
+                    'channel': CHANNEL,
+                    'payload': '%s:%s:%s' % (
+                        name, '' if id is None else id, version.scalar()
+                    ),
+                }
+            )
+
+    # Returns: version of every table (dictionary)
+    @classmethod
+    def all(cls):
+        return dict(db.session.query(cls.name, cls.version))
+
+
+# Counter upserts run on every write, see execute_cached(). ON CONFLICT
+# needs PostgreSQL 9.5 or SQLite 3.24.
+STAT_UPSERT = (
+    'INSERT INTO stats (metric, bucket, count) '
+    'VALUES (:stat_metric, :stat_bucket, :delta) '
+    'ON CONFLICT (metric, bucket) DO UPDATE SET count = %s'
+)
+STAT_INCREMENT = db.text(STAT_UPSERT % 'stats.count + excluded.count')
+STAT_SET = db.text(STAT_UPSERT % 'excluded.count')
+
+TABLE_VERSION_INCREMENT = TableVersion.__table__.update().where(
+    TableVersion.__table__.c.name == bindparam('table_name')
+).values(version=TableVersion.__table__.c.version + 1)
+
+
+# Model for the change_horizon table
+# A single row holding the id of the latest purged change, see
+# Change.purge(). Clients resuming from an older cursor missed changes.
+class ChangeHorizon(db.Model):
+    __tablename__ = 'change_horizon'
+
+    ROW_ID = 1
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    change_id = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ChangeHorizon change_id='{self.change_id}'>"
+
+    # Returns: id of the latest purged change, 0 before any purge (int)
+    @classmethod
+    def get(cls):
+        return db.session.query(cls.change_id) \
+            .filter_by(id=cls.ROW_ID).scalar() or 0
+
+    # Moves the horizon forward to change_id, within the current
+    # transaction.
+    @classmethod
+    def advance(cls, change_id):
+        horizon = cls.query.get(cls.ROW_ID)
+        if horizon is None:
+            db.session.add(cls(id=cls.ROW_ID, change_id=change_id))
+        else:
+            horizon.change_id = max(horizon.change_id, change_id)
+
+
+# Model for the changes table
+# Ordered log of every insert, update and delete made through the model
+# methods, read by /changes. Its id is the cursor clients resume from.
+# On PostgreSQL writers take a transaction-level advisory lock before adding
+# their entry, so ids are allocated in commit order and a reader can never
+# see a later id before an earlier one commits.
+class Change(db.Model):
+    __tablename__ = 'changes'
+
+    LOCK_KEY = 728361
+
+    id = db.Column(
+        db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True
+    )
+    table_name = db.Column(db.String, nullable=False)
+    row_id = db.Column(db.Integer)
+    operation = db.Column(db.String, nullable=False)
+    changed_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, index=True
+    )
+    data = db.Column(db.JSON)
+
+    def __repr__(self):
+        return f"<Change id='{self.id}' operation='{self.operation}'>"
+
+    # Held until the transaction ends. Writers take it before any other
+    # lock (stats counters, rows), so they can never deadlock on it.
+    @classmethod
+    def lock(cls):
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(
+                db.text('SELECT pg_advisory_xact_lock(:key)'),
+                {'key': cls.LOCK_KEY}
+            )
+
+    # Adds the change of a row to the current transaction, which already
+    # holds the lock, see CRUDMixin.insert().
+    # Deletes are logged as tombstones, without data.
+    @classmethod
+    def record(cls, row, operation):
+        db.session.add(cls(
+            table_name=row.__tablename__,
+            row_id=row.id,
+            operation=operation,
+            data=None if operation == 'delete' else row.format()
+        ))
+
+    # Tells followers to download a table again, after changes that
+    # bypassed the model methods, such as bulk imports.
+    @classmethod
+    def reset(cls, table_name):
+        cls.lock()
+        db.session.add(cls(table_name=table_name, operation='reset'))
         db.session.commit()
 
-    def delete(self):
-        db.session.delete(self)
+    # Returns: id of the latest change, or of the latest purged one (int)
+    @classmethod
+    def cursor(cls):
+        latest = db.session.query(db.func.max(cls.id)).scalar()
+        return max(latest or 0, cls.horizon())
+
+    # Changes up to this id were purged, see purge().
+    @classmethod
+    def horizon(cls):
+        return ChangeHorizon.get()
+
+    # Returns: at most limit changes after the cursor, on the given tables
+    # (list)
+    @classmethod
+    def since(cls, cursor, tables, limit):
+        return cls.query.filter(cls.id > cursor) \
+            .filter(cls.table_name.in_(tables)) \
+            .order_by(cls.id).limit(limit).all()
+
+    # Removes changes older than the cutoff in batches, recording the
+    # highest purged id as the horizon of the log.
+    # Returns: number of changes removed (int)
+    @classmethod
+    def purge(cls, older_than=timedelta(days=30), batch_size=500):
+        cutoff = datetime.utcnow() - older_than
+        purged = 0
+
+        while True:
+            ids = [
+                row.id for row in db.session.query(cls.id)
+                .filter(cls.changed_at < cutoff)
+                .order_by(cls.id)
+                .limit(batch_size)
+            ]
+            if not ids:
+                break
+
+            cls.query.filter(cls.id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            ChangeHorizon.advance(ids[-1])
+            db.session.commit()
+            purged += len(ids)
+
+            if len(ids) < batch_size:
+                break
+
+        return purged
+
+    def format(self):
+        return {
+            'cursor': self.id,
+            'table': self.table_name,
+            'id': self.row_id,
+            'operation': self.operation,
+            'changed_at': self.changed_at.isoformat(),
+            'data': self.data,
+        }
+
+
+# Model for the jobs table
+# Work too long for a request, run by `flask agency worker`, see jobs.py.
+# A job is 'queued', then 'running', then 'succeeded' or 'failed'.
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String, nullable=False)
+    params = db.Column(db.JSON)
+    status = db.Column(db.String, nullable=False, default='queued')
+    result = db.Column(db.JSON)
+    error = db.Column(db.String)
+    submitted_by = db.Column(db.String)
+    created_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow
+    )
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index(
+            'ix_jobs_queued', 'id',
+            postgresql_where=db.text("status = 'queued'"),
+            sqlite_where=db.text("status = 'queued'")
+        ),
+    )
+
+    def __repr__(self):
+        return (
+            f"<Job id='{self.id}' kind='{self.kind}' status='{self.status}'>"
+        )
+
+    @classmethod
+    def submit(cls, kind, params, submitted_by=None):
+        job = cls(kind=kind, params=params, submitted_by=submitted_by)
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    # Takes the oldest queued job. The conditional update lets several
+    # workers poll the same table without running a job twice.
+    # Returns: the job now running, None when the queue is empty (Job)
+    @classmethod
+    def claim(cls):
+        while True:
+            id = db.session.query(cls.id).filter_by(status='queued') \
+                .order_by(cls.id).limit(1).scalar()
+            if id is None:
+                db.session.commit()
+                return None
+            claimed = cls.query.filter_by(id=id, status='queued').update(
+                {'status': 'running', 'started_at': datetime.utcnow()},
+                synchronize_session=False
+            )
+            db.session.commit()
+            if claimed:
+                return cls.query.get(id)
+
+    # Fails jobs left running past the timeout, by a worker that stopped.
+    # Returns: number of jobs failed (int)
+    @classmethod
+    def fail_stale(cls, timeout):
+        failed = cls.query.filter(
+            cls.status == 'running',
+            cls.started_at < datetime.utcnow() - timeout
+        ).update({
+            'status': 'failed',
+            'error': 'Worker stopped before the job finished.',
+            'finished_at': datetime.utcnow(),
+        }, synchronize_session=False)
+        db.session.commit()
+        return failed
+
+    def finish(self, result=None, error=None):
+        self.status = 'failed' if error else 'succeeded'
+        self.result = result
+        self.error = error
+        self.finished_at = datetime.utcnow()
         db.session.commit()
 
     def format(self):
         return {
             'id': self.id,
-            'title': self.title,
-            'release': str(self.release),
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at':
+                self.started_at and self.started_at.isoformat(),
+            'finished_at':
+                self.finished_at and self.finished_at.isoformat(),
         }
+
+
+# Model for the job_files table
+# Uploads of import jobs and results of export jobs. Web and worker dynos
+# share no filesystem, so files are kept in the database, split in rows of
+# at most CHUNK_SIZE bytes: neither side ever holds a whole file in memory.
+class JobFile(db.Model):
+    __tablename__ = 'job_files'
+
+    CHUNK_SIZE = 1024 * 1024
+
+    name = db.Column(db.String, primary_key=True)
+    position = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow
+    )
+
+    def __repr__(self):
+        return f"<JobFile name='{self.name}' position='{self.position}'>"
+
+    # Stores a binary stream under name, one chunk at a time.
+    # Returns: number of bytes stored (int)
+    @classmethod
+    def write(cls, name, stream):
+        size = 0
+        position = 0
+        created_at = datetime.utcnow()
+        while True:
+            chunk = stream.read(cls.CHUNK_SIZE)
+            if not chunk:
+                break
+            db.session.execute(cls.__table__.insert(), {
+                'name': name, 'position': position, 'data': chunk,
+                'created_at': created_at
+            })
+            size += len(chunk)
+            position += 1
+        if not position:
+            # An empty file still exists.
+            db.session.execute(cls.__table__.insert(), {
+                'name': name, 'position': 0, 'data': b'',
+                'created_at': created_at
+            })
+        db.session.commit()
+        return size
+
+    @classmethod
+    def exists(cls, name):
+        return db.session.query(
+            cls.query.filter_by(name=name).exists()
+        ).scalar()
+
+    # Yields the chunks of a file in order, each loaded when needed.
+    @classmethod
+    def read(cls, name):
+        positions = [
+            position for position, in db.session.query(cls.position)
+            .filter_by(name=name).order_by(cls.position)
+        ]
+        for position in positions:
+            yield db.session.query(cls.data) \
+                .filter_by(name=name, position=position).scalar()
+
+    @classmethod
+    def remove(cls, name):
+        cls.query.filter_by(name=name).delete(synchronize_session=False)
+        db.session.commit()
+
+    # Removes the files stored before the cutoff.
+    # Returns: number of files removed (int)
+    @classmethod
+    def purge(cls, before):
+        names = [
+            name for name, in db.session.query(cls.name).distinct()
+            .filter(cls.created_at < before)
+        ]
+        if names:
+            cls.query.filter(cls.name.in_(names)) \
+                .delete(synchronize_session=False)
+        db.session.commit()
+        return len(names)
@@ -0,0 +1,95 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+from datetime import date
+from flask import current_app
+from sqlalchemy import text
+from .models import db
+
+
+# ----------------------------------------------------------------------------#
+# Movie partitions
+# ----------------------------------------------------------------------------#
+
+# On PostgreSQL the movies table is range partitioned on release, one
+# partition per year, see the movie_partitions migration. Releases before
+# 2000 share movies_history, and rows no partition covers (NULL releases,
+# years not created yet) land in movies_default. The release list filters
+# are plain comparisons on the column, so the planner only scans the
+# partitions overlapping the requested window.
+
+TABLE = 'movies'
+DEFAULT_PARTITION = 'movies_default'
+
+
+def partition_name(year):
+    return f'{TABLE}_y{year}'
+
+
+# Returns: (name, first day, first day of the next year) of the yearly
+# partitions from first_year to last_year included (list)
+def yearly_partitions(first_year, last_year):
+    return [
+        (partition_name(year), date(year, 1, 1), date(year + 1, 1, 1))
+        for year in range(first_year, last_year + 1)
+    ]
+
+
+def is_partitioned():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table '
+        'WHERE partrelid = to_regclass(:table))'
+    ), {'table': TABLE}).scalar()
+
+
+# Returns: (name, bounds, estimated rows) of every partition, by name (list)
+def existing_partitions():
+    return db.session.execute(text(
+        'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), '
+        'greatest(c.reltuples, 0)::bigint '
+        'FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname'
+    ), {'table': TABLE}).fetchall()
+
+
+# Creates a partition, moving into it the rows the default partition
+# already holds for its range. It is built as a plain table and then
+# attached, which only takes a SHARE UPDATE EXCLUSIVE lock on movies, so
+# reads and writes go on meanwhile; the attach still waits at most
+# MIGRATION_LOCK_TIMEOUT for the default partition's lock.
+def create_partition(name, start, end):
+    db.session.execute(text(
+        "SET LOCAL lock_timeout = '%s'"
+        % current_app.config['MIGRATION_LOCK_TIMEOUT']
+    ))
+    db.session.execute(text(
+        f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)'
+    ))
+    db.session.execute(text(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+        'WHERE release >= :start AND release < :end RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved'
+    ), {'start': start, 'end': end})
+    # Bounds must be literals; both are dates built by yearly_partitions().
+    db.session.execute(text(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    db.session.commit()
+
+
+# Creates the yearly partitions missing from the current year to
+# years_ahead years later.
+# Returns: names of the partitions created (list)
+def create_ahead(years_ahead, today=None):
+    year = (today or date.today()).year
+    existing = {row[0] for row in existing_partitions()}
+    created = []
+    for name, start, end in yearly_partitions(year, year + years_ahead):
+        if name not in existing:
+            create_partition(name, start, end)
+            created.append(name)
+    return created
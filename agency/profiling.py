@@ -0,0 +1,168 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from flask import current_app, request
+
+
+# ----------------------------------------------------------------------------#
+# Sampling profiler
+# ----------------------------------------------------------------------------#
+
+PERMISSION = 'debug:profile'
+
+
+# Samples the stack of one thread every interval seconds, for at most
+# max_seconds, from a helper thread; the profiled code runs unmodified.
+# Stacks are collapsed as 'frame;frame;frame', root first, with the number
+# of samples they were seen in, the input format of flamegraph.pl and
+# speedscope.
+class Sampler(object):
+    def __init__(self, thread_id, interval, max_seconds):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.counts = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name='profiler', daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self.stopped.wait(self.interval):
+            if time.monotonic() > deadline:
+                break
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = collapse(frame)
+            self.counts[stack] = self.counts.get(stack, 0) + 1
+
+
+# Returns: stack of the frame, root first (string)
+def collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f'{os.path.basename(code.co_filename)}:{code.co_name}'
+        )
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# Profiles kept as files in a directory, oldest removed first once more
+# than max_files are stored.
+class ProfileStore(object):
+    NAME = re.compile(r'^[\w.-]+\.collapsed$')
+
+    def __init__(self, directory, max_files):
+        self.directory = directory
+        self.max_files = max_files
+
+    # Writes the collapsed stacks, named after the time, the endpoint and
+    # the duration of the request.
+    # Returns: name of the profile (string)
+    def save(self, endpoint, duration, counts):
+        os.makedirs(self.directory, exist_ok=True)
+        name = '%s_%s_%dms.collapsed' % (
+            datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'),
+            re.sub(r'[^\w.-]', '-', endpoint or 'unknown'),
+            duration * 1000
+        )
+        fd, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w') as profile:
+            for stack, count in sorted(counts.items()):
+                profile.write(f'{stack} {count}\n')
+        os.replace(temporary, os.path.join(self.directory, name))
+        self.prune()
+        return name
+
+    def prune(self):
+        for name in self.names()[:-self.max_files or None]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+
+    # Returns: names of the stored profiles, oldest first (list)
+    def names(self):
+        try:
+            return sorted(
+                name for name in os.listdir(self.directory)
+                if self.NAME.match(name)
+            )
+        except OSError:
+            return []
+
+    def path(self, name):
+        if not self.NAME.match(name):
+            raise ValueError(f'Invalid profile name: {name}')
+        return os.path.join(self.directory, name)
+
+
+# Flask extension profiling single requests on demand.
+# Disabled unless PROFILING_ENABLED is set. A request is profiled when it
+# carries the PROFILE_HEADER header and its token grants debug:profile,
+# see requires_auth(); the response names the stored profile in the same
+# header. Sampling needs sync or gthread workers.
+class Profiler(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['PROFILING_ENABLED']:
+            app.extensions['profiler'] = self.store(app)
+        else:
+            app.extensions['profiler'] = None
+
+    @staticmethod
+    def store(app):
+        return ProfileStore(
+            app.config['PROFILE_DIR'], app.config['PROFILE_MAX_FILES']
+        )
+
+    def requested(self, payload):
+        return current_app.extensions.get('profiler') is not None \
+            and current_app.config['PROFILE_HEADER'] in request.headers \
+            and PERMISSION in payload.get('permissions', ())
+
+    # Runs the view under the sampler and stores its profile.
+    def run(self, f, *args, **kwargs):
+        config = current_app.config
+        sampler = Sampler(
+            threading.get_ident(),
+            config['PROFILE_INTERVAL'],
+            config['PROFILE_MAX_SECONDS']
+        )
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = current_app.make_response(f(*args, **kwargs))
+        finally:
+            sampler.stop()
+            name = current_app.extensions['profiler'].save(
+                request.endpoint, time.perf_counter() - started,
+                sampler.counts
+            )
+        response.headers[config['PROFILE_HEADER']] = name
+        return response
+
+
+profiler = Profiler()
@@ -0,0 +1,150 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import math
+import threading
+import time
+
+
+# ----------------------------------------------------------------------------#
+# Rate limiting
+# ----------------------------------------------------------------------------#
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+# RateLimitExceeded Exception
+# Raised when a bucket is empty; retry_after is in seconds.
+class RateLimitExceeded(Exception):
+    def __init__(self, key, retry_after):
+        self.key = key
+        self.retry_after = retry_after
+
+
+# Parses a limit such as '120/minute'.
+# Returns: rate in tokens per second and burst size (tuple)
+def parse_limit(limit):
+    count, period = limit.split('/')
+    count = int(count)
+    return count / PERIODS[period.strip()], count
+
+
+# Token buckets kept in the memory of the current process.
+class MemoryBackend(object):
+    def __init__(self, max_keys=10000):
+        self.buckets = {}
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+
+    # Takes one token from the bucket stored under key.
+    # Returns: seconds to wait before a token is available, 0 if one was taken
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated, _ = self.buckets.get(key, (burst, now, 0))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            retry_after = 0
+
+            if tokens < 1:
+                retry_after = (1 - tokens) / rate
+            else:
+                tokens -= 1
+                if key not in self.buckets and \
+                        len(self.buckets) >= self.max_keys:
+                    self.prune(now)
+
+            # Remember when the bucket will be full again, see prune().
+            self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            return retry_after
+
+    # Drops buckets that have refilled completely, they hold no state.
+    def prune(self, now):
+        for key, (_, _, full_at) in list(self.buckets.items()):
+            if full_at <= now:
+                del self.buckets[key]
+
+
+# Token buckets kept in a Redis-protocol store shared by every worker.
+# Accepts any client exposing redis-py's eval(), so a local redis-server
+# can stand in for the production store.
+class RedisBackend(object):
+    SCRIPT = '''
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local clock = redis.call('TIME')
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or burst
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + (now - updated) * rate)
+        local retry_after = 0
+        if tokens < 1 then
+            retry_after = (1 - tokens) / rate
+        else
+            tokens = tokens - 1
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(retry_after)
+    '''
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def take(self, key, rate, burst):
+        retry_after = self.client.eval(
+            self.SCRIPT, 1, self.prefix + key, rate, burst
+        )
+        if isinstance(retry_after, bytes):
+            retry_after = retry_after.decode()
+        return float(retry_after)
+
+
+# Flask extension applying per-subject and per-IP limits.
+# Limits come from the RATE_LIMIT_* config values, the backend from
+# RATE_LIMIT_BACKEND ('memory' or 'redis').
+class RateLimiter(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['RATE_LIMIT_ENABLED']
+        self.default = parse_limit(app.config['RATE_LIMIT_DEFAULT'])
+        self.per_ip = parse_limit(app.config['RATE_LIMIT_PER_IP'])
+        self.limits = {
+            permission: parse_limit(limit)
+            for permission, limit in app.config['RATE_LIMITS'].items()
+        }
+
+        if app.config['RATE_LIMIT_BACKEND'] == 'redis':
+            self.backend = RedisBackend.from_url(
+                app.config['RATE_LIMIT_STORAGE_URL']
+            )
+        else:
+            self.backend = MemoryBackend()
+
+        app.extensions['ratelimit'] = self
+
+    def take(self, key, limit):
+        retry_after = self.backend.take(key, *limit)
+        if retry_after > 0:
+            raise RateLimitExceeded(key, int(math.ceil(retry_after)))
+
+    # Counts a request against the client address.
+    def hit_ip(self, address):
+        if self.enabled:
+            self.take(f'ip:{address}', self.per_ip)
+
+    # Counts a request against the token subject and permission.
+    def hit_subject(self, subject, permission):
+        if self.enabled:
+            limit = self.limits.get(permission, self.default)
+            self.take(f'sub:{subject}:{permission}', limit)
@@ -0,0 +1,305 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import bisect
+import logging
+import os
+import select
+import threading
+from flask import current_app
+
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL channel the model mutation methods notify on, see
+# TableVersion.bump() in models.py. Payloads are '<table>:<id>:<version>',
+# with an empty id when the whole table changed.
+CHANNEL = 'agency_changes'
+
+
+# ----------------------------------------------------------------------------#
+# Records
+# ----------------------------------------------------------------------------#
+
+# Compact, read-only copy of a row.
+# Subclasses declare the row's columns as __slots__, so a record carries no
+# per-instance dictionary and none of SQLAlchemy's instance state.
+class Record(object):
+    __slots__ = ()
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, getattr(row, name))
+
+    # Uses the model's own format(), which only reads column attributes.
+    def format(self):
+        return self.model.format(self)
+
+
+# Builds the record class of a model, with one slot per column.
+def record_class(model):
+    columns = tuple(
+        name for name in model.__table__.columns.keys()
+        if name != 'deleted_at'
+    )
+    return type(
+        model.__name__ + 'Record', (Record,),
+        {'__slots__': columns, 'model': model}
+    )
+
+
+# ----------------------------------------------------------------------------#
+# Tables
+# ----------------------------------------------------------------------------#
+
+# Live rows of one table, ordered by id.
+# Writers never modify the id list in place, they swap in a new one, so
+# readers can iterate over the list they picked up without locking.
+class Table(object):
+    def __init__(self, model):
+        self.model = model
+        self.record = record_class(model)
+        self.records = {}
+        self.ids = []
+        self.version = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    # Replaces the content with the live rows in the database.
+    def load(self, version):
+        records = {}
+        for row in self.model.live().order_by(self.model.id).yield_per(1000):
+            records[row.id] = self.record(row)
+
+        with self.lock:
+            self.records = records
+            self.ids = list(records)
+            self.version = version
+            self.loaded = True
+
+    # Applies a row as last committed; soft deleted or missing rows are
+    # removed.
+    def apply(self, id, row):
+        with self.lock:
+            ids = self.ids
+            if row is None or row.deleted_at is not None:
+                if self.records.pop(id, None) is not None:
+                    ids = list(ids)
+                    ids.remove(id)
+            else:
+                if id not in self.records:
+                    ids = list(ids)
+                    bisect.insort(ids, id)
+                self.records[id] = self.record(row)
+            self.ids = ids
+
+    def get(self, id):
+        return self.records.get(id)
+
+    # Returns: records matching every (attribute, operator, value) filter,
+    # skipping offset of them and returning at most limit (list)
+    def select(self, filters=(), offset=0, limit=None):
+        records = self.records
+        selected = []
+        skipped = 0
+
+        for id in self.ids:
+            record = records.get(id)
+            if record is None:
+                continue
+            if not all(
+                getattr(record, name) is not None
+                and operator(getattr(record, name), value)
+                for name, operator, value in filters
+            ):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            selected.append(record)
+            if limit is not None and len(selected) >= limit:
+                break
+
+        return selected
+
+
+# ----------------------------------------------------------------------------#
+# Read model
+# ----------------------------------------------------------------------------#
+
+# In-process copy of the live actors and movies.
+# Loaded once per process (or once in a --preload master, and shared by the
+# forked workers), then kept current by a background thread: on PostgreSQL it
+# LISTENs for row notifications, elsewhere it polls the table_versions
+# counters every READ_MODEL_POLL_INTERVAL seconds and reloads changed tables.
+class ReadModelState(object):
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['READ_MODEL_POLL_INTERVAL']
+        self.listen = app.config['READ_MODEL_LISTEN']
+        self.tables = {}
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def register(self, model):
+        self.tables[model.__tablename__] = Table(model)
+
+    # Loads every table that is not loaded yet, once even when several
+    # threads of a worker get here together.
+    def ensure_loaded(self):
+        if all(table.loaded for table in self.tables.values()):
+            return
+        with self.lock:
+            for table in self.tables.values():
+                if not table.loaded:
+                    table.load(self.versions().get(table.model.__tablename__))
+
+    # Makes sure the refresh thread runs in this process; threads do not
+    # survive a fork, so every worker starts its own.
+    def ensure_started(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.start()
+                    self.pid = os.getpid()
+
+    def start(self):
+        thread = threading.Thread(
+            target=self.run, name='read-model', daemon=True
+        )
+        thread.start()
+
+    def versions(self):
+        from .models import TableVersion
+        return TableVersion.all()
+
+    # Reloads the tables whose version changed since they were loaded.
+    def poll(self):
+        with self.app.app_context():
+            try:
+                versions = self.versions()
+                for name, table in self.tables.items():
+                    if table.loaded and table.version != versions.get(name):
+                        table.load(versions.get(name))
+            finally:
+                from .models import db
+                db.session.remove()
+
+    # Applies one notification; out of order versions mean notifications
+    # were missed, so the table is reloaded instead, as it is for changes
+    # to the whole table.
+    def notify(self, payload):
+        name, id, version = payload.split(':')
+        table = self.tables.get(name)
+        if table is None or not table.loaded:
+            return
+
+        if not id or table.version is None \
+                or int(version) != table.version + 1:
+            self.poll()
+            return
+
+        with self.app.app_context():
+            try:
+                table.apply(int(id), table.model.query.get(int(id)))
+                table.version = int(version)
+            finally:
+                from .models import db
+                db.session.remove()
+
+    def run(self):
+        while True:
+            try:
+                if self.listen and self.dialect() == 'postgresql':
+                    self.run_listener()
+                else:
+                    threading.Event().wait(self.interval)
+                    self.poll()
+            except Exception:
+                logger.exception('Read model refresh failed.')
+                threading.Event().wait(self.interval)
+
+    def dialect(self):
+        from .models import db
+        with self.app.app_context():
+            return db.get_engine(self.app).dialect.name
+
+    # Blocks on a dedicated connection, applying notifications as they
+    # arrive, and polls whenever the channel stays quiet for an interval.
+    def run_listener(self):
+        from .models import db
+        with self.app.app_context():
+            connection = db.get_engine(self.app).raw_connection()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.autocommit = True
+            dbapi_connection.cursor().execute(f'LISTEN {CHANNEL}')
+            self.poll()
+
+            while True:
+                ready, _, _ = select.select(
+                    [dbapi_connection], [], [], self.interval
+                )
+                if not ready:
+                    self.poll()
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    self.notify(dbapi_connection.notifies.pop(0).payload)
+        finally:
+            connection.invalidate()
+
+
+# Flask extension answering list and item reads from memory.
+# Disabled unless READ_MODEL_ENABLED is set; every method then returns None
+# and callers fall back to the database.
+class ReadModel(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['READ_MODEL_ENABLED']:
+            from .models import Actor, Movie
+            state = ReadModelState(app)
+            state.register(Actor)
+            state.register(Movie)
+            app.extensions['read_model'] = state
+        else:
+            app.extensions['read_model'] = None
+
+    @property
+    def state(self):
+        return current_app.extensions.get('read_model')
+
+    @property
+    def enabled(self):
+        return self.state is not None
+
+    def table(self, model):
+        state = self.state
+        if state is None:
+            return None
+        state.ensure_started()
+        state.ensure_loaded()
+        return state.tables[model.__tablename__]
+
+    # Loads every table now, e.g. in a --preload master before forking.
+    def load(self):
+        if self.state is not None:
+            self.state.ensure_loaded()
+
+    # Applies rows committed by this process right away, so its own next
+    # read sees them without waiting for the refresh thread.
+    def apply(self, rows):
+        state = self.state
+        if state is None:
+            return
+        for row in rows:
+            table = state.tables.get(row.__tablename__)
+            if table is not None and table.loaded:
+                table.apply(row.id, row)
+
+
+read_model = ReadModel()
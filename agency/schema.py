@@ -0,0 +1,148 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+from datetime import date
+
+
+# ----------------------------------------------------------------------------#
+# Request validation
+# ----------------------------------------------------------------------------#
+
+# ValidationError Exception
+# Raised before any database work when a payload does not match its schema;
+# errors maps each rejected field to a message, or for bulk payloads each
+# rejected item's index to such a mapping.
+class ValidationError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+
+
+# Declares one payload field.
+# Fields compile to a single converter returning the coerced value or raising
+# ValueError with the message reported to the client.
+class Field(object):
+    def __init__(self, required=True):
+        self.required = required
+
+    def compile(self):
+        raise NotImplementedError
+
+
+# Non-empty string, surrounding whitespace removed.
+class String(Field):
+    def __init__(self, required=True, max_length=None):
+        super().__init__(required)
+        self.max_length = max_length
+
+    def compile(self):
+        max_length = self.max_length
+
+        def convert(value):
+            if not isinstance(value, str) or not value.strip():
+                raise ValueError('Must be a non-empty string.')
+            value = value.strip()
+            if max_length is not None and len(value) > max_length:
+                raise ValueError(f'Must be at most {max_length} characters.')
+            return value
+
+        return convert
+
+
+# Whole number, also accepted as a string of digits.
+class Integer(Field):
+    def __init__(self, required=True, minimum=None, maximum=None):
+        super().__init__(required)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def compile(self):
+        minimum, maximum = self.minimum, self.maximum
+
+        def convert(value):
+            if isinstance(value, bool) or \
+                    not isinstance(value, (int, str)):
+                raise ValueError('Must be an integer.')
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError('Must be an integer.')
+            if minimum is not None and value < minimum:
+                raise ValueError(f'Must be at least {minimum}.')
+            if maximum is not None and value > maximum:
+                raise ValueError(f'Must be at most {maximum}.')
+            return value
+
+        return convert
+
+
+# Calendar date written as YYYY-MM-DD.
+class Date(Field):
+    def compile(self):
+        def convert(value):
+            try:
+                return date.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise ValueError('Must be a date formatted as YYYY-MM-DD.')
+
+        return convert
+
+
+# Validates and coerces JSON payloads in one pass.
+# The fields are compiled once, when the schema is declared, so loading a
+# payload only runs the prepared converters.
+class Schema(object):
+    def __init__(self, **fields):
+        self.fields = tuple(
+            (name, field.required, field.compile())
+            for name, field in fields.items()
+        )
+        self.names = frozenset(fields)
+
+    # Returns: coerced values by field name (dict)
+    # With partial=True, as for updates, fields may be left out and null
+    # values count as left out.
+    def load(self, data, partial=False):
+        values, errors = self.convert(data, partial)
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+    # Loads a single object or a bulk array of them.
+    # Returns: list of coerced values by field name, and whether the payload
+    # was an array (tuple)
+    def load_many(self, data, partial=False):
+        if not isinstance(data, list):
+            return [self.load(data, partial)], False
+        if not data:
+            raise ValidationError({'_schema': 'Must not be empty.'})
+
+        loaded, errors = [], {}
+        for index, item in enumerate(data):
+            values, item_errors = self.convert(item, partial)
+            if item_errors:
+                errors[index] = item_errors
+            loaded.append(values)
+        if errors:
+            raise ValidationError(errors)
+        return loaded, True
+
+    # Returns: coerced values and errors by field name (tuple)
+    def convert(self, data, partial):
+        if not isinstance(data, dict):
+            return {}, {'_schema': 'Must be an object.'}
+
+        values, errors = {}, {}
+        for name in data.keys() - self.names:
+            errors[name] = 'Unknown field.'
+        for name, required, convert in self.fields:
+            value = data.get(name)
+            if value is None:
+                if required and not partial:
+                    errors[name] = 'Missing data for required field.'
+                continue
+            try:
+                values[name] = convert(value)
+            except ValueError as error:
+                errors[name] = str(error)
+        return values, errors
@@ -0,0 +1,114 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import csv
+import io
+import random
+from datetime import date
+from .transfer import import_csv
+
+
+# ----------------------------------------------------------------------------#
+# Synthetic data
+# ----------------------------------------------------------------------------#
+
+# Deterministic actors and movies for development and benchmarks.
+# Row i of a table only depends on the seed and i, so two databases seeded
+# with the same arguments hold the same rows, whatever the chunk size.
+
+FIRST_NAMES = {
+    'female': (
+        'Ava', 'Cate', 'Diane', 'Emma', 'Frances', 'Greta', 'Helen',
+        'Isabelle', 'Julianne', 'Kate', 'Laura', 'Meryl', 'Natalie', 'Olivia',
+        'Penelope', 'Rachel', 'Saoirse', 'Tilda', 'Viola', 'Zoe',
+    ),
+    'male': (
+        'Adam', 'Ben', 'Christian', 'Daniel', 'Denzel', 'Ethan', 'Forest',
+        'Gary', 'Harrison', 'Idris', 'Jack', 'Kevin', 'Leonardo', 'Mahershala',
+        'Oscar', 'Philip', 'Robert', 'Samuel', 'Tom', 'Willem',
+    ),
+    'non-binary': ('Alex', 'Jordan', 'Quinn', 'Riley', 'Sam', 'Taylor'),
+}
+LAST_NAMES = (
+    'Adams', 'Bale', 'Blanchett', 'Chastain', 'Davis', 'Day-Lewis', 'Dench',
+    'Elba', 'Foster', 'Gerwig', 'Hanks', 'Hoffman', 'Huppert', 'Jackson',
+    'Keaton', 'Kidman', 'Law', 'Moore', 'Nicholson', 'Oldman', 'Pacino',
+    'Portman', 'Redford', 'Ronan', 'Streep', 'Swinton', 'Washington',
+    'Whitaker', 'Winslet', 'Zhao',
+)
+GENDERS = ('female', 'male', 'non-binary')
+GENDER_WEIGHTS = (48, 48, 4)
+
+ADJECTIVES = (
+    'Silent', 'Last', 'Broken', 'Golden', 'Hidden', 'Midnight', 'Burning',
+    'Distant', 'Lonely', 'Crimson', 'Frozen', 'Wild', 'Secret', 'Endless',
+)
+NOUNS = (
+    'River', 'City', 'Garden', 'Empire', 'Shadow', 'Voyage', 'Summer',
+    'Harbor', 'Kingdom', 'Promise', 'Storm', 'Letter', 'Station', 'Dream',
+)
+PATTERNS = (
+    'The {adjective} {noun}', '{adjective} {noun}', 'A {noun} in {place}',
+    'The {noun} of {place}', '{noun}',
+)
+PLACES = (
+    'Paris', 'Tokyo', 'Winter', 'the North', 'Lisbon', 'Berlin', 'Havana',
+)
+
+FIRST_RELEASE = date(1920, 1, 1).toordinal()
+LAST_RELEASE = date(2025, 12, 31).toordinal()
+
+
+# Random source of one row; string seeds are hashed deterministically.
+def row_random(seed, table, index):
+    return random.Random(f'{seed}:{table}:{index}')
+
+
+# Ages between 18 and 90, most actors in their thirties and forties.
+def actor(seed, index):
+    rng = row_random(seed, 'actors', index)
+    gender = rng.choices(GENDERS, GENDER_WEIGHTS)[0]
+    return {
+        'name': '%s %s' % (
+            rng.choice(FIRST_NAMES[gender]), rng.choice(LAST_NAMES)
+        ),
+        'age': int(rng.triangular(18, 90, 38)),
+        'gender': gender,
+    }
+
+
+# Releases since 1920, weighted towards recent years. Titles repeat, as
+# they do in practice (remakes).
+def movie(seed, index):
+    rng = row_random(seed, 'movies', index)
+    title = rng.choice(PATTERNS).format(
+        adjective=rng.choice(ADJECTIVES),
+        noun=rng.choice(NOUNS),
+        place=rng.choice(PLACES)
+    )
+    release = int(rng.triangular(FIRST_RELEASE, LAST_RELEASE, LAST_RELEASE))
+    return {'title': title, 'release': date.fromordinal(release)}
+
+
+GENERATORS = {'actors': actor, 'movies': movie}
+
+
+# Inserts count generated rows into the model's table, chunk_size rows per
+# statement or COPY, see import_csv().
+# Returns: number of rows inserted (int)
+def seed_table(model, count, seed=0, chunk_size=10000):
+    generate = GENERATORS[model.__tablename__]
+    inserted = 0
+    for start in range(0, count, chunk_size):
+        rows = [
+            generate(seed, index)
+            for index in range(start, min(start + chunk_size, count))
+        ]
+        stream = io.StringIO()
+        writer = csv.DictWriter(stream, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+        stream.seek(0)
+        inserted += import_csv(model, stream, chunk_size)
+    return inserted
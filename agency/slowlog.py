@@ -0,0 +1,221 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from flask import current_app, has_app_context, has_request_context, \
+    request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------------#
+# Fingerprints
+# ----------------------------------------------------------------------------#
+
+# Literals and bound parameters, in the paramstyles of psycopg2 and sqlite3.
+LITERALS = re.compile(r"""
+    '(?:[^']|'')*'              # string
+  | %\(\w+\)s | %s | \?         # pyformat, format and qmark parameters
+  | (?<![\w.:]):\w+             # named parameter
+  | \b\d+(?:\.\d+)?\b           # number
+""", re.VERBOSE)
+LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+SPACES = re.compile(r'\s+')
+
+
+# Replaces literals and parameters with '?', and lists of them with '(...)',
+# so statements only differing in their values share one fingerprint.
+# Returns: normalized statement (string)
+def normalize(statement):
+    statement = LITERALS.sub('?', statement)
+    statement = LISTS.sub('(...)', statement)
+    return SPACES.sub(' ', statement).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+# ----------------------------------------------------------------------------#
+# Slow query log
+# ----------------------------------------------------------------------------#
+
+# Slow executions of one statement shape.
+class SlowQuery(object):
+    def __init__(self, normalized):
+        self.statement = normalized
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.endpoints = {}
+        self.parameters = None
+        self.plan = None
+
+    def add(self, duration, endpoint, parameters):
+        self.count += 1
+        self.total += duration
+        if duration >= self.max:
+            self.max = duration
+            self.parameters = parameters
+        self.endpoints[endpoint] = self.endpoints.get(endpoint, 0) + 1
+
+    def format(self):
+        return {
+            'statement': self.statement,
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 1),
+            'mean_ms': round(self.total / self.count * 1000, 1),
+            'max_ms': round(self.max * 1000, 1),
+            'endpoints': self.endpoints,
+            'parameters': self.parameters,
+            'plan': self.plan,
+        }
+
+
+# Statements of one worker process taking SLOW_QUERY_THRESHOLD milliseconds
+# or more, aggregated by fingerprint (at most SLOW_QUERY_MAX_FINGERPRINTS of
+# them). On PostgreSQL the plan of each fingerprint is captured once, with
+# EXPLAIN (ANALYZE off) on a helper thread, so the slow request does not
+# wait for it.
+class SlowQueryLog(object):
+    def __init__(self, threshold, max_fingerprints, explain):
+        self.threshold = threshold
+        self.max_fingerprints = max_fingerprints
+        self.explain = explain
+        self.queries = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.plans = queue.Queue(maxsize=100)
+        self.pid = None
+
+    def record(self, engine, statement, parameters, executemany, duration):
+        endpoint = has_request_context() and request.endpoint or '-'
+        shown = '<executemany>' if executemany else repr(parameters)[:500]
+        normalized = normalize(statement)
+        key = fingerprint(normalized)
+        logger.warning(
+            'Slow query %s (%.1fms, %s): %s %s',
+            key, duration * 1000, endpoint, SPACES.sub(' ', statement), shown
+        )
+
+        with self.lock:
+            query = self.queries.get(key)
+            new = query is None
+            if new:
+                if len(self.queries) >= self.max_fingerprints:
+                    self.dropped += 1
+                    return
+                query = self.queries[key] = SlowQuery(normalized)
+            query.add(duration, endpoint, shown)
+
+        if new and self.explain and not executemany and \
+                engine.dialect.name == 'postgresql':
+            self.request_plan(query, engine, statement, parameters)
+
+    # Queues the statement for EXPLAIN; dropped when the queue is full.
+    def request_plan(self, query, engine, statement, parameters):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            threading.Thread(
+                target=self.run, name='slow-query-explain', daemon=True
+            ).start()
+        try:
+            self.plans.put_nowait((query, engine, statement, parameters))
+        except queue.Full:
+            pass
+
+    def run(self):
+        while True:
+            query, engine, statement, parameters = self.plans.get()
+            try:
+                query.plan = explain(engine, statement, parameters)
+            except Exception as error:
+                query.plan = f'EXPLAIN failed: {error}'
+
+    # Returns: slow statements, slowest in total first (list)
+    def report(self):
+        with self.lock:
+            queries = [
+                dict(query.format(), fingerprint=key)
+                for key, query in self.queries.items()
+            ]
+        return sorted(queries, key=lambda query: -query['total_ms'])
+
+    def reset(self):
+        with self.lock:
+            self.queries = {}
+            self.dropped = 0
+
+
+# Runs EXPLAIN on a raw DBAPI cursor, which the cursor events below do not
+# see, in a transaction rolled back afterwards.
+# Returns: plan, one line per node (string)
+def explain(engine, statement, parameters):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN (ANALYZE off) ' + statement, parameters)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+# Cursor events of every engine. Statements are timed on the connection
+# and handed to the slow query log of the current application, if any;
+# Flask-SQLAlchemy may replace an application's engine, so the listeners
+# are not tied to one.
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    started = conn.info.pop('query_started', None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    log = current_app.extensions.get('slow_queries') \
+        if has_app_context() else None
+    if log is not None and duration >= log.threshold:
+        log.record(conn.engine, statement, parameters, executemany, duration)
+
+
+def listen():
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+
+# Flask extension keeping the slow query log of the application, unless
+# SLOW_QUERY_ENABLED is false.
+class SlowQueries(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['SLOW_QUERY_ENABLED']:
+            app.extensions['slow_queries'] = None
+            return
+        app.extensions['slow_queries'] = SlowQueryLog(
+            app.config['SLOW_QUERY_THRESHOLD'] / 1000,
+            app.config['SLOW_QUERY_MAX_FINGERPRINTS'],
+            app.config['SLOW_QUERY_EXPLAIN']
+        )
+        listen()
+
+
+slow_queries = SlowQueries()
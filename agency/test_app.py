@@ -2,14 +2,37 @@
 # Imports
 # ---------------------------------------------------------
 
+import io
 import json
+import math
 import os
+import re
+import rsa
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
+from datetime import date, datetime, timedelta
 from flask import url_for
 from flask_sqlalchemy import SQLAlchemy
+from jose import jwt
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from .app import create_app
+from .auth import auth
+from .auth.auth import JWKSCache
+from .coalesce import SingleFlight
 from .config import Config
-from .models import db, Actor, Movie
+from .jobs import create_worker
+from .models import db, unit_of_work, Actor, Movie, Stat, Change, Job, \
+    JobFile, TableVersion
+from .partitions import yearly_partitions
+from .ratelimit import RedisBackend
+from .profiling import Profiler, ProfileStore, Sampler
+from .slowlog import normalize
 
 
 # ---------------------------------------------------------
@@ -19,6 +42,115 @@ from .models import db, Actor, Movie
 class TestConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_TEST_DATABASE_URI')
+    # A fresh cache for every app, as test databases are recreated.
+    CACHE_BACKEND = 'memory'
+
+
+# Counts the statements run while active, and the time spent in them.
+class QueryCounter(object):
+    def __enter__(self):
+        self.durations = []
+        event.listen(Engine, 'before_cursor_execute', self.before)
+        event.listen(Engine, 'after_cursor_execute', self.after)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self.before)
+        event.remove(Engine, 'after_cursor_execute', self.after)
+
+    def before(self, conn, cursor, statement, parameters, context,
+               executemany):
+        conn.info['budget_started'] = time.perf_counter()
+
+    def after(self, conn, cursor, statement, parameters, context,
+              executemany):
+        started = conn.info.pop('budget_started')
+        self.durations.append(time.perf_counter() - started)
+
+    @property
+    def count(self):
+        return len(self.durations)
+
+    @property
+    def milliseconds(self):
+        return sum(self.durations) * 1000
+
+
+# Stand-in for a redis-py client, keeping values as bytes in memory.
+# eval() only knows RedisBackend.SCRIPT, which it runs step by step with the
+# same commands and argument conversions as the Lua version.
+class FakeRedis(object):
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+        self.expires = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        assert isinstance(value, bytes)
+        self.values[key] = value
+        self.expires[key] = ex
+
+    def eval(self, script, numkeys, *keys_and_args):
+        assert script == RedisBackend.SCRIPT and numkeys == 1
+        key, rate, burst = (str(value) for value in keys_and_args)
+        rate, burst = float(rate), float(burst)
+        now = time.time()
+        state = self.hashes.get(key, {})
+        tokens = float(state.get('tokens', burst))
+        updated = float(state.get('updated', now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        retry_after = 0
+        if tokens < 1:
+            retry_after = (1 - tokens) / rate
+        else:
+            tokens -= 1
+        self.hashes[key] = {'tokens': str(tokens), 'updated': str(now)}
+        self.expires[key] = math.ceil(burst / rate) + 1
+        return str(retry_after).encode()
+
+
+# Rows of actors, movies and change log entries the budgets are checked
+# against, so queries growing with the data cannot pass unnoticed.
+BUDGET_ROWS = 5000
+BUDGET_TIME_SCALE = float(os.getenv('QUERY_BUDGET_TIME_SCALE') or 0)
+
+# Most statements each request may run, and milliseconds spent in them, on
+# PostgreSQL; SQLite skips the change log lock and runs one less per
+# written row. Lower a budget when a change saves queries, never raise it
+# without explaining why in the commit.
+# Statement counts are always checked. Times depend on the machine, so
+# they are only checked with QUERY_BUDGET_TIME_SCALE set, as the factor
+# applied to them (1 on the reference machine, more on slower ones).
+QUERY_BUDGETS = [
+    ('GET', '/actors', None, 1, 100),
+    ('GET', '/actors?min_age=30&per_page=500', None, 1, 100),
+    ('GET', '/actors/7', None, 1, 50),
+    ('GET', '/movies', None, 1, 100),
+    ('GET', '/movies?release_from=1990-01-01', None, 1, 100),
+    ('GET', '/movies/7', None, 1, 50),
+    ('POST', '/actors', {
+        'name': "Jack Nicholson", 'age': 83, 'gender': "male"
+    }, 7, 100),
+    ('POST', '/actors', [
+        {'name': f"Actor {i}", 'age': 30, 'gender': "female"}
+        for i in range(20)
+    ], 140, 500),
+    ('POST', '/movies', {'title': "Joker", 'release': "2020-01-01"}, 7, 100),
+    ('PATCH', '/actors/7', {'age': 44}, 11, 100),
+    ('PATCH', '/movies/7', {'title': "Heat"}, 5, 100),
+    ('DELETE', '/actors/8', None, 7, 100),
+    ('DELETE', '/movies/8', None, 6, 100),
+    ('GET', '/stats', None, 1, 50),
+    ('GET', '/changes', None, 2, 50),
+    ('GET', '/changes?since=0', None, 2, 100),
+    ('POST', '/batch', {'requests': [
+        {'method': 'GET', 'path': '/actors/9'},
+        {'method': 'PATCH', 'path': '/actors/9', 'body': {'age': 50}},
+    ]}, 12, 150),
+]
 
 
 class AgencyTestCase(unittest.TestCase):
@@ -40,6 +172,14 @@ class AgencyTestCase(unittest.TestCase):
         db.session.remove()
         db.drop_all()
 
+    def test_serving_profile_should_skip_migrations(self):
+        app = create_app(TestConfig, serving=True)
+        res = app.test_client().get('/')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('migrate', app.extensions)
+        self.assertIn('migrate', self.app.extensions)
+
     def test_should_not_return_actors(self):
         res = self.client().get(
             '/actors',
@@ -72,6 +212,839 @@ class AgencyTestCase(unittest.TestCase):
         actors = Actor.query.all()
         self.assertEqual(len(data['actors']), len(actors))
 
+    def test_should_cache_actors_until_invalidated(self):
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        Actor(name="Robert De Niro", age="77", gender="male").insert()
+        self.client().get('/actors', headers=headers)
+
+        # Rows written behind the models' back are not seen until the
+        # next invalidation.
+        db.session.execute(Actor.__table__.insert().values(
+            name="Al Pacino", age=80, gender="male"
+        ))
+        db.session.commit()
+        res = self.client().get('/actors', headers=headers)
+        self.assertEqual(len(json.loads(res.data)['actors']), 1)
+
+        Actor(name="Meryl Streep", age="71", gender="female").insert()
+        res = self.client().get('/actors', headers=headers)
+        self.assertEqual(len(json.loads(res.data)['actors']), 3)
+
+    def test_cache_invalidation_should_reach_every_worker(self):
+        class SharedCacheConfig(TestConfig):
+            CACHE_BACKEND = 'filesystem'
+            CACHE_DIR = tempfile.mkdtemp()
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        Actor(name="Robert De Niro", age="41", gender="male").insert()
+        first = create_app(SharedCacheConfig, serving=True).test_client()
+        second = create_app(SharedCacheConfig, serving=True).test_client()
+
+        def age(client):
+            res = client.get('/actors', headers=headers)
+            return json.loads(res.data)['actors'][0]['age']
+
+        self.assertEqual((age(first), age(second)), (41, 41))
+        first.patch('/actors/1', headers=headers, data=json.dumps({'age': 77}))
+        self.assertEqual(age(second), 77)
+
+    def test_redis_cache_should_share_invalidations_between_hosts(self):
+        class RedisCacheConfig(TestConfig):
+            CACHE_BACKEND = 'redis'
+            CACHE_STORAGE_URL = 'redis://localhost:6379/0'
+
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        Actor(name="Robert De Niro", age="41", gender="male").insert()
+        client = FakeRedis()
+        with mock.patch('redis.Redis.from_url', return_value=client):
+            first = create_app(RedisCacheConfig, serving=True).test_client()
+            second = create_app(RedisCacheConfig, serving=True).test_client()
+
+        def age(client):
+            res = client.get('/actors', headers=headers)
+            return json.loads(res.data)['actors'][0]['age']
+
+        self.assertEqual((age(first), age(second)), (41, 41))
+        first.patch('/actors/1', headers=headers, data=json.dumps({'age': 77}))
+        self.assertEqual(age(second), 77)
+        entries = [key for key in client.values if key.startswith('cache:')]
+        self.assertTrue(entries)
+        self.assertIn(self.app.config['CACHE_TIMEOUT'], [
+            client.expires[key] for key in entries
+        ])
+
+    def test_should_return_actor_by_id(self):
+        actor = Actor(name="Robert De Niro", age="77", gender="male")
+        actor.insert()
+
+        res = self.client().get(
+            '/actors/%s' % actor.id,
+            headers={
+                'Authorization':
+                    f'Bearer {self.app.config.get("ASSISTANT_ROLE_TOKEN")}'
+            }
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['actor']['name'], actor.name)
+
+    def test_concurrent_identical_reads_should_share_one_call(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def work():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return (b'{}', 200, 'application/json')
+
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(flight.do('key', work, 5))
+            )
+            for _ in range(5)
+        ]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+
+    def test_should_filter_and_paginate_actors(self):
+        for age in (25, 35, 45, 55):
+            Actor(name="Meryl Streep", age=age, gender="female").insert()
+        Actor(name="Al Pacino", age=80, gender="male").insert()
+
+        res = self.client().get(
+            '/actors?gender=female&min_age=30&page=2&per_page=2',
+            headers={
+                'Authorization':
+                    f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+            }
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['age'] for actor in data['actors']], [55])
+
+    def test_should_not_accept_malformed_list_arguments(self):
+        res = self.client().get(
+            '/movies?release_from=yesterday',
+            headers={
+                'Authorization':
+                    f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+            }
+        )
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_read_model_should_answer_reads_and_follow_changes(self):
+        class ReadModelConfig(TestConfig):
+            READ_MODEL_ENABLED = True
+            CACHE_BACKEND = 'none'
+
+        app = create_app(ReadModelConfig)
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+
+        with app.app_context():
+            actor = Actor(name="Robert De Niro", age="77", gender="male")
+            actor.insert()
+            res = app.test_client().get('/actors', headers=headers)
+            self.assertEqual(len(json.loads(res.data)['actors']), 1)
+
+            actor.name = "Al Pacino"
+            actor.update()
+            res = app.test_client().get(
+                '/actors/%s' % actor.id, headers=headers
+            )
+            self.assertEqual(json.loads(res.data)['actor']['name'],
+                             "Al Pacino")
+
+            actor.delete()
+            res = app.test_client().get('/actors', headers=headers)
+            self.assertEqual(res.status_code, 404)
+
+    def test_read_model_should_reload_tables_seeded_elsewhere(self):
+        class ReadModelConfig(TestConfig):
+            READ_MODEL_ENABLED = True
+            READ_MODEL_POLL_INTERVAL = 0.05
+            CACHE_BACKEND = 'none'
+
+        app = create_app(ReadModelConfig)
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+
+        def count():
+            res = app.test_client().get('/actors', headers=headers)
+            return len(json.loads(res.data)['actors'])
+
+        with app.app_context():
+            Actor(name="Robert De Niro", age="77", gender="male").insert()
+            self.assertEqual(count(), 1)
+
+            subprocess.run(
+                [sys.executable, '-m', 'flask', 'agency', 'seed',
+                 '--actors', '25'],
+                cwd=os.path.dirname(os.path.dirname(__file__)),
+                env=dict(
+                    os.environ, FLASK_APP='agency', CACHE_BACKEND='none',
+                    SQLALCHEMY_DATABASE_URI=app.config[
+                        'SQLALCHEMY_DATABASE_URI'
+                    ]
+                ),
+                check=True, capture_output=True
+            )
+            deadline = time.monotonic() + 5
+            while count() != 26 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(count(), 26)
+
+    def test_mutations_should_lock_before_writing(self):
+        movie = Movie(title="The Godfather", release=date(1972, 3, 24))
+        movie.insert()
+        events = []
+
+        def statement(conn, cursor, sql, parameters, context, executemany):
+            write = re.match(r'(INSERT INTO|UPDATE) (\w+)', sql)
+            if write:
+                events.append(f'{write.group(1).split()[0]} {write.group(2)}')
+
+        event.listen(Engine, 'before_cursor_execute', statement)
+        try:
+            with mock.patch.object(
+                Change, 'lock', side_effect=lambda: events.append('lock')
+            ):
+                with unit_of_work():
+                    movie.title = "The Godfather Part II"
+                    movie.update()
+                    Actor(name="Al Pacino", age=80, gender="male").insert()
+        finally:
+            event.remove(Engine, 'before_cursor_execute', statement)
+
+        # Each mutation locks before its row and counter writes.
+        self.assertEqual(events, [
+            'lock', 'UPDATE movies', 'INSERT changes',
+            'lock', 'INSERT stats', 'INSERT stats', 'INSERT stats',
+            'INSERT actors', 'INSERT changes',
+        ])
+
+    def test_changes_should_follow_inserts_updates_and_deletes(self):
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        res = self.client().get('/changes', headers=headers)
+        cursor = json.loads(res.data)['cursor']
+
+        actor = Actor(name="Robert De Niro", age="77", gender="male")
+        actor.insert()
+        actor.name = "Al Pacino"
+        actor.update()
+        actor.delete()
+
+        res = self.client().get(
+            f'/changes?since={cursor}&wait=1', headers=headers
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [change['operation'] for change in data['changes']],
+            ['insert', 'update', 'delete']
+        )
+        self.assertEqual(data['changes'][1]['data']['name'], "Al Pacino")
+        self.assertIsNone(data['changes'][2]['data'])
+        self.assertEqual(data['cursor'], data['changes'][-1]['cursor'])
+
+    def test_changes_should_not_wait_past_max_waiters(self):
+        class BusyConfig(TestConfig):
+            CHANGES_MAX_WAITERS = 0
+
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        started = time.monotonic()
+        res = create_app(BusyConfig).test_client().get(
+            '/changes?since=0&wait=5', headers=headers
+        )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['changes'], [])
+        self.assertLess(time.monotonic() - started, 2)
+
+    def test_changes_should_be_gone_after_purge(self):
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        Actor(name="Robert De Niro", age="77", gender="male").insert()
+        Change.purge(older_than=timedelta(0))
+
+        res = self.client().get('/changes?since=0', headers=headers)
+
+        self.assertEqual(res.status_code, 410)
+        self.assertEqual(Change.cursor(), 1)
+        # Read models only see table versions, never the horizon.
+        self.assertNotIn('changes', TableVersion.all())
+
+    def test_jwks_cache_should_fetch_once_for_concurrent_threads(self):
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            time.sleep(0.05)
+            return {'a': 'key'}
+
+        jwks = JWKSCache(fetch, ttl=600, min_refresh=30)
+        threads = [
+            threading.Thread(target=jwks.get, args=('a',))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(jwks.key('a'), 'key')
+        self.assertEqual(len(fetches), 1)
+
+    def test_pem_directory_keys_should_verify_tokens_offline(self):
+        public_key, private_key = rsa.newkeys(1024)
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, 'ci.pem'), 'wb') as pem:
+            pem.write(public_key.save_pkcs1())
+
+        class OfflineConfig(TestConfig):
+            AUTH_KEY_PROVIDER = 'pem_dir'
+            AUTH_PEM_DIR = directory
+
+        claims = {'sub': 'ci|1', 'iss': auth.ISSUER, 'permissions': []}
+        if auth.API_AUDIENCE:
+            claims['aud'] = auth.API_AUDIENCE
+
+        def sign(kid):
+            return jwt.encode(
+                claims, private_key.save_pkcs1().decode(),
+                algorithm='RS256', headers={'kid': kid}
+            )
+
+        with create_app(OfflineConfig).app_context():
+            self.assertEqual(auth.verify_decode_jwt(sign('ci'))['sub'],
+                             'ci|1')
+            with self.assertRaises(auth.AuthError):
+                auth.verify_decode_jwt(sign('unknown'))
+
+    def test_should_return_field_errors_for_invalid_actor(self):
+        res = self.client().post(
+            '/actors',
+            data=json.dumps({'name': "", 'age': "old", 'nmae': "x"}),
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization':
+                    f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+            }
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(set(data['errors']),
+                         {'name', 'age', 'gender', 'nmae'})
+        self.assertEqual(Actor.query.count(), 0)
+
+    def test_should_create_actors_in_bulk_or_not_at_all(self):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        actors = [
+            {'name': "Jack Nicholson", 'age': "83", 'gender': "male"},
+            {'name': "Meryl Streep", 'age': 71, 'gender': "female"},
+        ]
+
+        res = self.client().post(
+            '/actors', data=json.dumps(actors + [{'name': "Nobody"}]),
+            headers=headers
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(list(data['errors']), ['2'])
+        self.assertEqual(Actor.query.count(), 0)
+
+        res = self.client().post(
+            '/actors', data=json.dumps(actors), headers=headers
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['age'] for actor in data['actors']],
+                         [83, 71])
+
+    def test_should_not_update_movie_with_malformed_release(self):
+        res = self.client().patch(
+            '/movies/1',
+            data=json.dumps({'release': '21/05/1994'}),
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization':
+                    f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+            }
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertIn('release', data['errors'])
+
+    def test_baked_select_should_key_on_filters_not_values(self):
+        Actor(name="Robert De Niro", age=77, gender="male").insert()
+        Actor(name="Jack Nicholson", age=83, gender="male").insert()
+        min_age, max_age = Actor.filters['min_age'], Actor.filters['max_age']
+
+        older = Actor.select([('age', min_age[1], 80)])
+        younger = Actor.select([('age', max_age[1], 80)])
+        oldest = Actor.select([('age', min_age[1], 83)], 0, 1)
+
+        self.assertEqual([actor.age for actor in older], [83])
+        self.assertEqual([actor.age for actor in younger], [77])
+        self.assertEqual([actor.age for actor in oldest], [83])
+        self.assertEqual(Actor.get_live(older[0].id).name, "Jack Nicholson")
+
+    def test_readyz_should_report_database_and_pool(self):
+        res = self.client().get('/readyz')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['status'], 'ready')
+        self.assertTrue(data['checks']['database']['ok'])
+        self.assertIn('pool', data['checks'])
+
+    def test_readyz_should_fail_when_database_is_unreachable(self):
+        class UnreachableConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:////nonexistent/agency.db'
+
+        app = create_app(UnreachableConfig)
+        res = app.test_client().get('/readyz')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertFalse(data['checks']['database']['ok'])
+        self.assertEqual(app.test_client().get('/healthz').status_code, 200)
+
+    def test_readyz_should_only_fail_on_keys_that_failed_to_refresh(self):
+        fetched = threading.Event()
+
+        def fetch():
+            fetched.set()
+            return {'a': 'key'}
+
+        keys = JWKSCache(fetch, ttl=600, min_refresh=30)
+        keys.keys = {'a': 'key'}
+        # No token verified for an hour: old, but never failed to refresh.
+        keys.fetched_at = keys.retry_at = time.monotonic() - 3660
+        self.app.extensions['auth_keys'] = keys
+
+        self.assertEqual(self.client().get('/readyz').status_code, 200)
+        self.assertFalse(fetched.is_set())
+
+        keys.error = 'timed out'
+        self.assertEqual(self.client().get('/readyz').status_code, 503)
+        # The probe itself retries, as a drained worker verifies no token.
+        self.assertTrue(fetched.wait(5))
+        deadline = time.monotonic() + 5
+        while keys.error is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.client().get('/readyz').status_code, 200)
+
+    def test_preflight_should_be_answered_before_auth(self):
+        res = self.client().options('/actors/1', headers={
+            'Origin': 'https://casting.example.com',
+            'Access-Control-Request-Method': 'PATCH',
+        })
+
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(res.headers['Access-Control-Max-Age'],
+                         str(self.app.config['CORS_MAX_AGE']))
+        self.assertIn('PATCH', res.headers['Access-Control-Allow-Methods'])
+
+    def test_should_allow_origin_once_per_response(self):
+        res = self.client().get('/', headers={
+            'Origin': 'https://casting.example.com'
+        })
+
+        self.assertEqual(
+            res.headers.getlist('Access-Control-Allow-Origin'), ['*']
+        )
+
+    def test_batch_should_run_sub_requests_in_order(self):
+        res = self.client().post(
+            '/batch',
+            data=json.dumps({'requests': [
+                {'method': 'POST', 'path': '/actors', 'body': {
+                    'name': "Meryl Streep", 'age': 71, 'gender': "female"
+                }},
+                {'method': 'GET', 'path': '/actors?gender=female'},
+            ]}),
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization':
+                    f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+            }
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [response['status'] for response in data['responses']],
+            [200, 200]
+        )
+        self.assertEqual(
+            data['responses'][1]['body']['actors'][0]['name'],
+            "Meryl Streep"
+        )
+
+    def test_atomic_batch_should_roll_back_on_failure(self):
+        res = self.client().post(
+            '/batch',
+            data=json.dumps({'atomic': True, 'requests': [
+                {'method': 'POST', 'path': '/actors', 'body': {
+                    'name': "Meryl Streep", 'age': 71, 'gender': "female"
+                }},
+                {'method': 'PATCH', 'path': '/actors/1111',
+                 'body': {'age': 72}},
+            ]}),
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization':
+                    f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+            }
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(Actor.query.count(), 0)
+
+    def test_batch_should_answer_500_for_unhandled_errors(self):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+
+        def batch(atomic):
+            with mock.patch.object(Actor, 'find', side_effect=RuntimeError):
+                res = self.client().post('/batch', headers=headers, data=(
+                    json.dumps({'atomic': atomic, 'requests': [
+                        {'method': 'POST', 'path': '/actors', 'body': {
+                            'name': "Meryl Streep", 'age': 71,
+                            'gender': "female"
+                        }},
+                        {'method': 'GET', 'path': '/actors/1'},
+                    ]})
+                ))
+            return res, json.loads(res.data)
+
+        res, data = batch(atomic=False)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [response['status'] for response in data['responses']],
+            [200, 500]
+        )
+        self.assertEqual(Actor.query.count(), 1)
+
+        res, data = batch(atomic=True)
+        self.assertEqual(res.status_code, 500)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(Actor.query.count(), 1)
+
+    def test_endpoints_should_stay_within_query_budgets(self):
+        class BudgetConfig(TestConfig):
+            CACHE_BACKEND = 'none'
+            RATE_LIMIT_ENABLED = False
+
+        app = create_app(BudgetConfig)
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        db.session.execute(Actor.__table__.insert(), [
+            {'name': f"Actor {i}", 'age': 18 + i % 70,
+             'gender': ('male', 'female')[i % 2]}
+            for i in range(BUDGET_ROWS)
+        ])
+        db.session.execute(Movie.__table__.insert(), [
+            {'title': f"Movie {i}", 'release': date(1950 + i % 70, 1, 1)}
+            for i in range(BUDGET_ROWS)
+        ])
+        db.session.execute(Change.__table__.insert(), [
+            {'table_name': 'actors', 'row_id': i + 1, 'operation': 'insert',
+             'changed_at': datetime.utcnow()}
+            for i in range(BUDGET_ROWS)
+        ])
+        db.session.commit()
+        Stat.refresh()
+
+        for method, path, body, statements, milliseconds in QUERY_BUDGETS:
+            with self.subTest(method=method, path=path):
+                with QueryCounter() as counter:
+                    res = app.test_client().open(
+                        path, method=method, headers=headers,
+                        data=None if body is None else json.dumps(body)
+                    )
+
+                self.assertEqual(res.status_code, 200)
+                self.assertLessEqual(counter.count, statements)
+                if BUDGET_TIME_SCALE:
+                    self.assertLessEqual(
+                        counter.milliseconds,
+                        milliseconds * BUDGET_TIME_SCALE
+                    )
+
+    def test_seed_should_generate_the_same_rows_for_a_seed(self):
+        runner = self.app.test_cli_runner()
+        args = ['agency', 'seed', '--actors', '30', '--movies', '20',
+                '--seed', '3', '--replace', '--chunk-size', '7']
+
+        def rows():
+            return [
+                {name: value for name, value in row.format().items()
+                 if name != 'id'}
+                for model in (Actor, Movie)
+                for row in model.query.order_by(model.id)
+            ]
+
+        first = runner.invoke(args=args)
+        seeded = rows()
+        second = runner.invoke(args=args)
+
+        self.assertEqual((first.exit_code, second.exit_code), (0, 0))
+        self.assertEqual(len(seeded), 50)
+        self.assertEqual(rows(), seeded)
+        self.assertEqual(Stat.format_all()['actors']['total'], 30)
+
+    def test_worker_should_run_queued_jobs_on_processes(self):
+        Actor(name="Robert De Niro", age="77", gender="male").insert()
+        exported = Job.submit('export', {'table': 'actors'}).id
+        broken = Job.submit('export', {'table': 'directors'}).id
+
+        count = create_worker(self.app, processes=2).run(once=True)
+
+        self.assertEqual(count, 2)
+        job = Job.query.get(exported)
+        self.assertEqual((job.status, job.result['rows']), ('succeeded', 1))
+        payload = {'sub': 'ci|1', 'permissions': ['read:jobs']}
+        with mock.patch('agency.auth.auth.verify_decode_jwt',
+                        return_value=payload):
+            res = self.client().get(
+                f'/jobs/{exported}/result',
+                headers={'Authorization': 'Bearer token'}
+            )
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Robert De Niro', res.data)
+        job = Job.query.get(broken)
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.finished_at)
+
+        JobFile.write(
+            'import-1.csv', io.BytesIO(b'name,age,gender\nAl Pacino,80,male\n')
+        )
+        imported = Job.submit(
+            'import', {'table': 'actors', 'file': 'import-1.csv'}
+        ).id
+        create_worker(self.app, processes=1).run(once=True)
+
+        job = Job.query.get(imported)
+        self.assertEqual((job.status, job.result['rows']), ('succeeded', 1))
+        self.assertFalse(JobFile.exists('import-1.csv'))
+
+    def test_jobs_should_require_the_table_permissions(self):
+        def submit(path, permissions, **kwargs):
+            payload = {
+                'sub': 'ci|1', 'permissions': ['submit:jobs'] + permissions
+            }
+            with mock.patch('agency.auth.auth.verify_decode_jwt',
+                            return_value=payload):
+                return self.client().post(
+                    path, headers={'Authorization': 'Bearer token'}, **kwargs
+                )
+
+        export = {'json': {'table': 'actors'}}
+        self.assertEqual(submit('/jobs/export', [], **export).status_code, 403)
+        self.assertEqual(
+            submit('/jobs/export', ['read:actors'], **export).status_code, 202
+        )
+        upload = {'data': 'name,age,gender\nAl Pacino,80,male\n'}
+        path = '/jobs/import?table=actors'
+        self.assertEqual(
+            submit(path, ['read:actors'], **upload).status_code, 403
+        )
+        self.assertEqual(
+            submit(path, ['create:actor'], **upload).status_code, 202
+        )
+        self.assertEqual(Job.query.count(), 2)
+
+    def test_old_job_files_should_be_purged(self):
+        for name in ('export-1.csv', 'import-abc.csv', 'export-2.csv'):
+            JobFile.write(name, io.BytesIO(b'id\n'))
+        JobFile.query.filter(JobFile.name != 'export-2.csv').update({
+            'created_at': datetime.utcnow() - timedelta(hours=73)
+        }, synchronize_session=False)
+        db.session.commit()
+
+        create_worker(self.app, processes=1).run(once=True)
+
+        self.assertEqual(
+            [name for name, in db.session.query(JobFile.name)],
+            ['export-2.csv']
+        )
+
+    def test_list_should_reuse_row_fragments_until_row_changes(self):
+        class FragmentConfig(TestConfig):
+            CACHE_BACKEND = 'none'
+
+        app = create_app(FragmentConfig)
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        store = app.extensions['fragments']
+
+        with app.app_context():
+            actor = Actor(name="Robert De Niro", age="77", gender="male")
+            actor.insert()
+            id = actor.id
+            app.test_client().get('/actors', headers=headers)
+            self.assertIn(('actors', id), store.fragments)
+
+            actor.name = "Al Pacino"
+            actor.update()
+            self.assertNotIn(('actors', id), store.fragments)
+
+            # A new version written by another process is encoded again.
+            db.session.execute(Actor.__table__.update().values(
+                age=80, updated_at=datetime.utcnow()
+            ))
+            db.session.commit()
+            res = app.test_client().get('/actors', headers=headers)
+
+        self.assertEqual(json.loads(res.data)['actors'], [
+            {'id': id, 'name': "Al Pacino", 'age': 80, 'gender': "male"}
+        ])
+
+    def test_sampler_should_collapse_stacks_into_bounded_store(self):
+        def busy():
+            deadline = time.monotonic() + 0.05
+            while time.monotonic() < deadline:
+                pass
+
+        sampler = Sampler(threading.get_ident(), 0.001, 5)
+        sampler.start()
+        busy()
+        sampler.stop()
+        store = ProfileStore(tempfile.mkdtemp(), 2)
+        names = [store.save('read_actors', 0.05, sampler.counts)
+                 for _ in range(3)]
+
+        self.assertTrue(any(
+            stack.endswith('test_app.py:busy') for stack in sampler.counts
+        ))
+        self.assertEqual(store.names(), names[1:])
+
+    def test_should_dump_stored_profile(self):
+        self.app.config['PROFILE_DIR'] = tempfile.mkdtemp()
+        store = Profiler.store(self.app)
+        name = store.save('read_movies', 0.01, {'app.py:read_movies': 3})
+        runner = self.app.test_cli_runner()
+
+        listed = runner.invoke(args=['agency', 'profiles', 'list'])
+        dumped = runner.invoke(args=['agency', 'profiles', 'dump', name])
+        missing = runner.invoke(args=['agency', 'profiles', 'dump', '../x'])
+
+        self.assertIn(f'{name}\t3 samples', listed.output)
+        self.assertEqual(dumped.output, 'app.py:read_movies 3\n')
+        self.assertEqual(missing.exit_code, 1)
+
+    def test_partitions_should_cover_consecutive_years(self):
+        partitions = yearly_partitions(2026, 2028)
+        # create_all() builds movies as a single table.
+        result = self.app.test_cli_runner().invoke(
+            args=['agency', 'partitions', 'create']
+        )
+
+        self.assertEqual(
+            [name for name, start, end in partitions],
+            ['movies_y2026', 'movies_y2027', 'movies_y2028']
+        )
+        self.assertEqual(
+            partitions[0][1:], (date(2026, 1, 1), date(2027, 1, 1))
+        )
+        self.assertEqual(partitions[1][1], partitions[0][2])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('not partitioned', result.output)
+
+    def test_normalize_should_share_fingerprint_across_values(self):
+        self.assertEqual(
+            normalize(
+                "SELECT * FROM actors WHERE name = 'O''Brien' "
+                "AND id IN (%(id_1)s, %(id_2)s) LIMIT 50"
+            ),
+            "SELECT * FROM actors WHERE name = ? AND id IN (...) LIMIT ?"
+        )
+
+    def test_slow_queries_should_aggregate_by_endpoint(self):
+        class SlowQueryConfig(TestConfig):
+            SLOW_QUERY_THRESHOLD = 0
+            CACHE_BACKEND = 'none'
+
+        app = create_app(SlowQueryConfig)
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+        Actor(name="Robert De Niro", age="77", gender="male").insert()
+
+        for age in (30, 40):
+            app.test_client().get(f'/actors?min_age={age}', headers=headers)
+        queries = [
+            query for query in app.extensions['slow_queries'].report()
+            if query['endpoints'].get('read_actors')
+        ]
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0]['count'], 2)
+        self.assertIn('actors.age >= ?', queries[0]['statement'])
+
     def test_should_create_new_actor(self):
         new_actor_data = {
             'name': "Jack Nicholson",
@@ -144,6 +1117,72 @@ class AgencyTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(data['actor_id'], actor.id)
 
+    def test_deleted_actor_should_not_be_listed(self):
+        actor = Actor(name="Humphrey Bogart", age="57", gender="male")
+        actor.insert()
+        Actor(name="Lauren Bacall", age="89", gender="female").insert()
+
+        res = self.client().delete(
+            '/actors/%s' % actor.id,
+            headers={
+                'Authorization':
+                    f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+            }
+        )
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get(
+            '/actors',
+            headers={
+                'Authorization':
+                    f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+            }
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 1)
+        self.assertIsNotNone(Actor.query.get(actor.id).deleted_at)
+
+    def test_purge_should_remove_expired_soft_deleted_rows(self):
+        expired = Actor(name="Humphrey Bogart", age="57", gender="male")
+        expired.insert()
+        recent = Actor(name="Lauren Bacall", age="89", gender="female")
+        recent.insert()
+
+        expired.deleted_at = datetime.utcnow() - timedelta(days=365)
+        expired.update()
+        recent.delete()
+        expired_id, recent_id = expired.id, recent.id
+
+        result = self.app.test_cli_runner().invoke(
+            args=['agency', 'purge', '--batch-size', '1']
+        )
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIsNone(Actor.query.get(expired_id))
+        self.assertIsNotNone(Actor.query.get(recent_id))
+
+    def test_unit_of_work_should_commit_once_at_block_end(self):
+        with unit_of_work():
+            actor = Actor(name="Robert De Niro", age="77", gender="male")
+            actor.insert()
+            actor.age = 78
+            actor.update()
+            self.assertIsNotNone(actor.id)
+
+        db.session.rollback()
+        self.assertEqual(Actor.query.get(actor.id).age, 78)
+
+    def test_unit_of_work_should_roll_back_on_error(self):
+        with self.assertRaises(ValueError):
+            with unit_of_work():
+                Actor(name="Robert De Niro", age="77", gender="male").insert()
+                Actor(name="Al Pacino", age="80", gender="male").insert()
+                raise ValueError()
+
+        self.assertEqual(Actor.query.count(), 0)
+
     def test_should_not_allow_new_actor_missing_age(self):
         new_actor_data = {
             'name': "Marlon Brando",
@@ -301,6 +1340,37 @@ class AgencyTestCase(unittest.TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(data['movie_id'], movie.id)
 
+    def test_should_import_and_export_movies_csv(self):
+        runner = self.app.test_cli_runner(mix_stderr=False)
+
+        result = runner.invoke(
+            args=['agency', 'import', 'movies', '-'],
+            input='title,release\nCasablanca,1943-01-23\nRaging Bull,\n'
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('rows/s', result.stderr)
+        self.assertEqual(Movie.query.count(), 2)
+
+        result = runner.invoke(args=['agency', 'export', 'movies', '-'])
+        lines = result.stdout.splitlines()
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(lines[0], 'id,title,release')
+        self.assertEqual(len(lines), 3)
+
+    def test_should_reject_movie_ids_when_partitioned(self):
+        runner = self.app.test_cli_runner(mix_stderr=False)
+
+        with mock.patch('agency.transfer.is_partitioned', return_value=True):
+            result = runner.invoke(
+                args=['agency', 'import', 'movies', '-'],
+                input='id,title,release\n1,Casablanca,1943-01-23\n'
+            )
+
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('id column', result.stderr)
+        self.assertEqual(Movie.query.count(), 0)
+
     def test_should_not_allow_new_movie_missing_date(self):
         new_movie_data = {
             'title': "The Shawshank Redemption"
@@ -355,6 +1425,150 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['error'], 404)
         self.assertFalse(data['success'])
 
+    def test_should_return_stats(self):
+        Actor(name="Robert De Niro", age="77", gender="male").insert()
+        Actor(name="Meryl Streep", age="71", gender="female").insert()
+        actor = Actor(name="Jack Nicholson", age="83", gender="male")
+        actor.insert()
+        actor.delete()
+        Movie(title="The Godfather", release="1972-03-24").insert()
+
+        res = self.client().get(
+            '/stats',
+            headers={
+                'Authorization':
+                    f'Bearer {self.app.config.get("ASSISTANT_ROLE_TOKEN")}'
+            }
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['stats']['actors']['total'], 2)
+        self.assertEqual(
+            data['stats']['actors']['by_gender'],
+            {'male': 1, 'female': 1}
+        )
+        self.assertEqual(data['stats']['actors']['by_age'], {'70-79': 2})
+        self.assertEqual(data['stats']['movies']['by_year'], {'1972': 1})
+
+    def test_stats_should_only_include_readable_tables(self):
+        Actor(name="Robert De Niro", age="77", gender="male").insert()
+        Movie(title="The Godfather", release=date(1972, 3, 24)).insert()
+
+        def stats(permissions):
+            payload = {'sub': 'ci|1', 'permissions': permissions}
+            with mock.patch('agency.auth.auth.verify_decode_jwt',
+                            return_value=payload):
+                return self.client().get(
+                    '/stats', headers={'Authorization': 'Bearer token'}
+                )
+
+        res = stats(['read:movies'])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(json.loads(res.data)['stats']), ['movies'])
+        res = stats(['read:actors'])
+        self.assertEqual(list(json.loads(res.data)['stats']), ['actors'])
+        self.assertEqual(stats(['create:actor']).status_code, 403)
+
+    def test_refresh_stats_should_rebuild_counters(self):
+        Actor(name="Robert De Niro", age="77", gender="male").insert()
+        Stat.query.delete()
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(
+            args=['agency', 'refresh-stats']
+        )
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(Stat.format_all()['actors']['total'], 1)
+
+    def test_stats_should_upsert_counters(self):
+        Stat.record([('actors.by_gender', 'non-binary')], 1)
+        db.session.commit()
+        # A counter created by another writer in the meantime.
+        with db.engine.begin() as connection:
+            connection.execute(
+                Stat.__table__.insert(),
+                {'metric': 'actors.by_age', 'bucket': '20-29', 'count': 4}
+            )
+        Stat.record([
+            ('actors.by_gender', 'non-binary'), ('actors.by_age', '20-29')
+        ], 1)
+        db.session.commit()
+
+        self.assertEqual(Stat.format_all()['actors'], {
+            'by_gender': {'non-binary': 2}, 'by_age': {'20-29': 5}
+        })
+        Stat.refresh()
+        self.assertEqual(Stat.query.count(), 0)
+
+    def test_should_throttle_subject_over_rate_limit(self):
+        class ThrottledConfig(TestConfig):
+            RATE_LIMITS = dict(TestConfig.RATE_LIMITS, **{
+                'read:actors': '1/minute'
+            })
+
+        app = create_app(ThrottledConfig)
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+
+        app.test_client().get('/actors', headers=headers)
+        res = app.test_client().get('/actors', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['error'], 429)
+        self.assertFalse(data['success'])
+        self.assertGreater(int(res.headers['Retry-After']), 0)
+
+    def test_should_throttle_subject_through_redis_backend(self):
+        class RedisLimitConfig(TestConfig):
+            RATE_LIMITS = dict(TestConfig.RATE_LIMITS, **{
+                'read:actors': '1/minute'
+            })
+            RATE_LIMIT_BACKEND = 'redis'
+            RATE_LIMIT_STORAGE_URL = 'redis://localhost:6379/0'
+
+        client = FakeRedis()
+        with mock.patch('redis.Redis.from_url', return_value=client):
+            app = create_app(RedisLimitConfig)
+        headers = {
+            'Authorization':
+                f'Bearer {self.app.config.get("PRODUCER_ROLE_TOKEN")}'
+        }
+
+        first = app.test_client().get('/actors', headers=headers)
+        second = app.test_client().get('/actors', headers=headers)
+
+        self.assertNotEqual(first.status_code, 429)
+        self.assertEqual(second.status_code, 429)
+        self.assertGreater(int(second.headers['Retry-After']), 0)
+        key = next(key for key in client.hashes if ':read:actors' in key)
+        self.assertTrue(key.startswith('ratelimit:sub:'))
+        # Kept at least as long as the bucket takes to refill.
+        self.assertGreaterEqual(client.expires[key], 61)
+
+    def test_should_throttle_client_address_behind_proxy(self):
+        class ProxiedConfig(TestConfig):
+            RATE_LIMIT_PER_IP = '1/minute'
+            TRUSTED_PROXIES = 1
+
+        client = create_app(ProxiedConfig).test_client()
+
+        def status(address):
+            return client.get(
+                '/actors', headers={'X-Forwarded-For': address}
+            ).status_code
+
+        self.assertEqual(status('203.0.113.1'), 401)
+        self.assertEqual(status('203.0.113.1'), 429)
+        self.assertEqual(status('203.0.113.2'), 401)
+        # Only the entry added by the trusted proxy counts.
+        self.assertEqual(status('203.0.113.2, 203.0.113.1'), 429)
+
     def test_assistant_role_should_return_all_actors(self):
         actor = Actor(name="Robert De Niro", age="77", gender="male")
         actor.insert()
@@ -0,0 +1,173 @@
+# ----------------------------------------------------------------------------#
+# Imports
+# ----------------------------------------------------------------------------#
+
+import csv
+from datetime import date, datetime
+from .cache import cache
+from .models import db, Actor, Movie, Stat, Change, TableVersion
+from .partitions import TABLE as PARTITIONED_TABLE, is_partitioned
+
+
+# ----------------------------------------------------------------------------#
+# CSV transfer
+# ----------------------------------------------------------------------------#
+
+# Bulk CSV import and export for the agency tables.
+# On PostgreSQL rows are streamed with COPY through the psycopg2 connection;
+# other databases fall back to csv parsing and chunked executemany inserts.
+
+# Tables that can be imported and exported, by name.
+MODELS = {'actors': Actor, 'movies': Movie}
+
+# Bookkeeping columns that are not part of exported files.
+SKIPPED_COLUMNS = ('deleted_at', 'updated_at')
+
+
+# Checks the CSV header against the table and returns its column names.
+def get_columns(model, header):
+    columns = [name.strip() for name in header]
+    unknown = set(columns) - set(model.__table__.columns.keys())
+    if unknown:
+        raise ValueError(
+            'Unknown columns for %s: %s'
+            % (model.__tablename__, ', '.join(sorted(unknown)))
+        )
+    return columns
+
+
+# The partitioned movies table has no primary key to reject duplicate ids
+# (it would have to include release, which may be NULL), so its ids only
+# come from the sequence.
+def check_ids(model, columns):
+    if (
+        'id' in columns
+        and model.__tablename__ == PARTITIONED_TABLE
+        and is_partitioned()
+    ):
+        raise ValueError(
+            'The id column cannot be imported into the partitioned %s '
+            'table, remove it to assign new ids.' % model.__tablename__
+        )
+
+
+# Converts a CSV field to the python type of its column.
+def coerce(column, value):
+    if value == '':
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+# Moves the id sequence past ids loaded explicitly from a file.
+def reset_sequence(cursor, model):
+    cursor.execute(
+        "SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+        "COALESCE(MAX(id), 1)) FROM " + model.__tablename__,
+        (model.__tablename__,)
+    )
+
+
+# Loads rows from a CSV stream with a header line into the model's table.
+# Returns: number of rows loaded (int)
+def import_csv(model, stream, chunk_size=1000):
+    header = stream.readline()
+    columns = get_columns(model, next(csv.reader([header])))
+    check_ids(model, columns)
+
+    if is_postgres():
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.copy_expert(
+                'COPY %s (%s) FROM STDIN WITH (FORMAT csv)'
+                % (model.__tablename__, ', '.join(columns)),
+                stream
+            )
+            count = cursor.rowcount
+            if 'id' in columns:
+                reset_sequence(cursor, model)
+            connection.commit()
+        finally:
+            connection.close()
+        return count
+
+    table = model.__table__
+    types = [table.columns[name] for name in columns]
+    count = 0
+    chunk = []
+
+    try:
+        for row in csv.reader(stream):
+            chunk.append({
+                name: coerce(column, value)
+                for name, column, value in zip(columns, types, row)
+            })
+            if len(chunk) >= chunk_size:
+                db.session.execute(table.insert(), chunk)
+                count += len(chunk)
+                chunk = []
+
+        if chunk:
+            db.session.execute(table.insert(), chunk)
+            count += len(chunk)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return count
+
+
+# Writes the model's live rows to a CSV stream, header line first.
+# Returns: number of rows written (int)
+def export_csv(model, stream, chunk_size=1000):
+    columns = [
+        name for name in model.__table__.columns.keys()
+        if name not in SKIPPED_COLUMNS
+    ]
+
+    if is_postgres():
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.copy_expert(
+                'COPY (SELECT %s FROM %s WHERE deleted_at IS NULL '
+                'ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER true)'
+                % (', '.join(columns), model.__tablename__),
+                stream
+            )
+            count = cursor.rowcount
+        finally:
+            connection.close()
+        return count
+
+    writer = csv.writer(stream)
+    writer.writerow(columns)
+    query = db.session.query(
+        *[model.__table__.columns[name] for name in columns]
+    ).filter(model.deleted_at.is_(None)).order_by(model.id)
+
+    count = 0
+    for row in query.yield_per(chunk_size):
+        writer.writerow(['' if value is None else value for value in row])
+        count += 1
+    return count
+
+
+# Bulk loads bypass the incremental counters, cache invalidation, the table
+# versions and the change log: read models, whatever process they run in,
+# reload the table, and change log followers download it again.
+def bulk_loaded(table):
+    Stat.refresh()
+    cache.invalidate(table)
+    TableVersion.bump(table)
+    Change.reset(table)
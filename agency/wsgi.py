@@ -0,0 +1,15 @@
+# ----------------------------------------------------------------------------#
+# Serving entry point
+# ----------------------------------------------------------------------------#
+
+# Used by gunicorn (see Procfile). Builds the serving-only profile, which is
+# safe to load once in the master with --preload.
+from .app import create_app
+from .readmodel import read_model
+
+application = create_app(serving=True)
+
+# Load the read model before forking, so workers share its pages.
+if application.config['READ_MODEL_ENABLED']:
+    with application.app_context():
+        read_model.load()
@@ -0,0 +1,115 @@
+# ----------------------------------------------------------------------------#
+# Compiled query benchmark
+# ----------------------------------------------------------------------------#
+
+# Compares the Python overhead of the hot model queries, built with a fresh
+# Query on every call (as before) and baked or precompiled (as now).
+# Usage: python benchmarks/compiled_queries.py [--rows N] [--calls N]
+#
+# Runs against SQLALCHEMY_DATABASE_URI, or an in-memory SQLite database when
+# it is not set, which keeps the time spent in the database itself small.
+# Each case is the statement behind one route: the list page of read_actors
+# and read_movies, the lookup of update_* and delete_*, and the counter
+# update every write runs.
+
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agency.app import create_app  # noqa: E402
+from agency.config import Config  # noqa: E402
+from agency.models import db, Actor, Movie, Stat  # noqa: E402
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'SQLALCHEMY_DATABASE_URI', 'sqlite://'
+    )
+    CACHE_BACKEND = 'none'
+
+
+def seed(rows):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Actor.__table__.insert(), [
+        {'name': f'Actor {i}', 'age': 18 + i % 70, 'gender': 'female'}
+        for i in range(rows)
+    ])
+    db.session.execute(Movie.__table__.insert(), [
+        {'title': f'Movie {i}', 'release': date(1950 + i % 70, 1, 1)}
+        for i in range(rows)
+    ])
+    db.session.add(Stat(metric='actors.total', bucket='', count=0))
+    db.session.commit()
+
+
+def uncached_list(model):
+    return model.live().order_by(model.id).offset(0).limit(50).all()
+
+
+def uncached_get(model, id):
+    return model.live().filter(model.id == id).first()
+
+
+def uncached_record():
+    Stat.query.filter_by(metric='actors.total', bucket='').update(
+        {Stat.count: Stat.count + 1}, synchronize_session=False
+    )
+
+
+CASES = [
+    ('read_actors page',
+        lambda: uncached_list(Actor),
+        lambda: Actor.select(offset=0, limit=50)),
+    ('read_movies page',
+        lambda: uncached_list(Movie),
+        lambda: Movie.select(offset=0, limit=50)),
+    ('update/delete actor lookup',
+        lambda: uncached_get(Actor, 7),
+        lambda: Actor.get_live(7)),
+    ('update/delete movie lookup',
+        lambda: uncached_get(Movie, 7),
+        lambda: Movie.get_live(7)),
+    ('stats counter update',
+        uncached_record,
+        lambda: Stat.record([('actors.total', '')], 1)),
+]
+
+
+# Returns: microseconds per call (float)
+def measure(fn, calls):
+    fn()
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+        db.session.expunge_all()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        seed(args.rows)
+        results = [
+            (name, measure(uncached, args.calls), measure(cached, args.calls))
+            for name, uncached, cached in CASES
+        ]
+        db.session.rollback()
+
+    print(f'{"query":<30}{"Query us":>10}{"baked us":>10}{"saved us":>10}')
+    for name, uncached, cached in results:
+        print(f'{name:<30}{uncached:>10.1f}{cached:>10.1f}'
+              f'{uncached - cached:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
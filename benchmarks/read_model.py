@@ -0,0 +1,98 @@
+# ----------------------------------------------------------------------------#
+# Read model benchmark
+# ----------------------------------------------------------------------------#
+
+# Reports memory per row and list latency of the in-process read model,
+# next to the SQLAlchemy instances the database path builds.
+# Usage: python benchmarks/read_model.py [--rows N]
+#
+# Runs against SQLALCHEMY_DATABASE_URI, or a temporary SQLite file when it is
+# not set; the actors table is filled with N synthetic rows first.
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agency.app import create_app  # noqa: E402
+from agency.config import Config  # noqa: E402
+from agency.models import db, Actor  # noqa: E402
+from agency.readmodel import Table  # noqa: E402
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'SQLALCHEMY_DATABASE_URI',
+        'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    )
+
+
+def seed(rows):
+    db.drop_all()
+    db.create_all()
+    genders = ('female', 'male', 'non-binary')
+    db.session.execute(Actor.__table__.insert(), [
+        {'name': f'Actor {i}', 'age': 18 + i % 70, 'gender': genders[i % 3]}
+        for i in range(rows)
+    ])
+    db.session.commit()
+
+
+# Returns: bytes allocated and still alive after calling build (int), and
+# what build returned
+def allocated(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def timed(fn, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        seed(args.rows)
+
+        table = Table(Actor)
+        table_bytes, _ = allocated(lambda: table.load(version=None))
+        orm_bytes, rows = allocated(
+            lambda: Actor.live().order_by(Actor.id).all()
+        )
+        db.session.expunge_all()
+
+        filters = [('gender', Actor.filters['gender'][1], 'female')]
+        memory_ms = timed(lambda: table.select(filters, 100, 50))
+        database_ms = timed(
+            lambda: Actor.live().filter(Actor.gender == 'female')
+            .order_by(Actor.id).offset(100).limit(50).all()
+        )
+
+    print(f'rows: {args.rows}')
+    print(f'{"":<28}{"bytes/row":>12}{"page ms":>10}')
+    print(f'{"read model records":<28}'
+          f'{table_bytes / args.rows:>12.0f}{memory_ms:>10.3f}')
+    print(f'{"SQLAlchemy instances":<28}'
+          f'{orm_bytes / args.rows:>12.0f}{database_ms:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
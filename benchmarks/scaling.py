@@ -0,0 +1,236 @@
+# ----------------------------------------------------------------------------#
+# Scaling benchmark
+# ----------------------------------------------------------------------------#
+
+# Measures latency and memory of the read and write endpoints at growing
+# table sizes, and writes a JSON report comparable between runs.
+# Usage: python benchmarks/scaling.py [--sizes 10000,100000,1000000]
+#                                     [--requests N] [--seed N]
+#                                     [--output report.json]
+#                                     [--baseline previous.json]
+#
+# For each size, the tables are dropped and recreated, then seeded with that
+# many actors and movies (see `flask agency seed`). Runs against
+# SQLALCHEMY_DATABASE_URI, or a temporary SQLite file when it is not set.
+# Tokens are signed with a throwaway key loaded through AUTH_KEY_PROVIDER
+# 'pem_dir', so Auth0 is not needed. Responses are not cached.
+# With --baseline, each median is printed next to the one of the previous
+# report for the same size and endpoint.
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import rsa
+from jose import jwt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agency.app import create_app  # noqa: E402
+from agency.auth import auth  # noqa: E402
+from agency.config import Config  # noqa: E402
+from agency.models import db, Actor, Movie, Stat  # noqa: E402
+from agency.seed import seed_table  # noqa: E402
+
+PERMISSIONS = [
+    'read:actors', 'read:movies', 'create:actor', 'create:movie',
+    'update:actor', 'update:movie', 'delete:actor', 'delete:movie',
+]
+MEMORY_SAMPLES = 5
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'SQLALCHEMY_DATABASE_URI',
+        'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    )
+    CACHE_BACKEND = 'none'
+    RATE_LIMIT_ENABLED = False
+    AUTH_KEY_PROVIDER = 'pem_dir'
+    AUTH_PEM_DIR = tempfile.mkdtemp()
+
+
+# Writes a throwaway public key for the app and signs a token with it.
+# Returns: bearer token granting every permission (string)
+def make_token():
+    public_key, private_key = rsa.newkeys(2048)
+    with open(os.path.join(BenchmarkConfig.AUTH_PEM_DIR, 'bench.pem'),
+              'wb') as pem:
+        pem.write(public_key.save_pkcs1())
+    claims = {'sub': 'bench|1', 'iss': auth.ISSUER,
+              'permissions': PERMISSIONS}
+    if auth.API_AUDIENCE:
+        claims['aud'] = auth.API_AUDIENCE
+    return jwt.encode(
+        claims, private_key.save_pkcs1().decode(),
+        algorithm='RS256', headers={'kid': 'bench'}
+    )
+
+
+# Endpoint cases as (name, method, path, body) for a table of rows rows.
+# Deletes take their '{id}' from the ids left over by the other cases.
+def cases(rows, ids):
+    return [
+        ('read_actors', 'GET', '/actors', None),
+        ('read_actors first page', 'GET', '/actors?page=1', None),
+        ('read_actors last page', 'GET',
+            f'/actors?page={max(rows // 50, 1)}', None),
+        ('read_actors filtered', 'GET',
+            '/actors?gender=female&min_age=30&max_age=40', None),
+        ('read_actor', 'GET', f'/actors/{ids[0]}', None),
+        ('read_movies', 'GET', '/movies', None),
+        ('read_movies by release', 'GET',
+            '/movies?release_from=2000-01-01&release_to=2000-12-31', None),
+        ('create_actor', 'POST', '/actors',
+            {'name': 'Bench Actor', 'age': 40, 'gender': 'female'}),
+        ('create_movie', 'POST', '/movies',
+            {'title': 'Bench Movie', 'release': '2020-01-01'}),
+        ('update_actor', 'PATCH', f'/actors/{ids[1]}', {'age': 41}),
+        ('update_movie', 'PATCH', f'/movies/{ids[1]}', {'title': 'Remake'}),
+        ('delete_actor', 'DELETE', '/actors/{id}', None),
+        ('delete_movie', 'DELETE', '/movies/{id}', None),
+    ]
+
+
+def seed(rows, seed_value):
+    db.drop_all()
+    db.create_all()
+    started = time.perf_counter()
+    seed_table(Actor, rows, seed_value)
+    seed_table(Movie, rows, seed_value)
+    Stat.refresh()
+    return time.perf_counter() - started
+
+
+# Returns: latency percentiles and peak Python allocations (dictionary)
+def measure(client, headers, method, path, body, requests, delete_ids):
+    def send():
+        url = path.format(id=delete_ids.pop()) if '{id}' in path else path
+        res = client.open(
+            url, method=method, headers=headers,
+            data=None if body is None else json.dumps(body)
+        )
+        if res.status_code >= 400:
+            raise RuntimeError(f'{method} {url}: {res.status_code}')
+
+    send()
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        send()
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    peaks = []
+    for _ in range(MEMORY_SAMPLES):
+        tracemalloc.start()
+        send()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        'max_ms': round(latencies[-1], 3),
+        'peak_kb': round(max(peaks) / 1024, 1),
+    }
+
+
+def run(app, headers, rows, requests, seed_value):
+    # Distinct ids, drawn the same way on every run, so each delete finds
+    # a live row.
+    deletes = (requests + MEMORY_SAMPLES + 1) * 2
+    if rows < deletes + 2:
+        raise SystemExit(f'Sizes must be at least {deletes + 2} rows.')
+    ids = random.Random(f'{seed_value}:{rows}').sample(
+        range(1, rows + 1), deletes + 2
+    )
+    delete_ids = ids[2:]
+
+    with app.app_context():
+        seed_seconds = seed(rows, seed_value)
+        client = app.test_client()
+        endpoints = {}
+        for name, method, path, body in cases(rows, ids):
+            endpoints[name] = measure(
+                client, headers, method, path, body, requests, delete_ids
+            )
+            db.session.remove()
+    return {
+        'rows': rows,
+        'seed_seconds': round(seed_seconds, 2),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'endpoints': endpoints,
+    }
+
+
+# Returns: median of every endpoint by size in a previous report
+# (dictionary)
+def load_baseline(path):
+    with open(path) as report:
+        return {
+            (size['rows'], name): result['p50_ms']
+            for size in json.load(report)['sizes']
+            for name, result in size['endpoints'].items()
+        }
+
+
+def print_size(size, baseline):
+    print(f'\n{size["rows"]} rows (seeded in {size["seed_seconds"]}s, '
+          f'max RSS {size["max_rss_kb"] // 1024} MB)')
+    print(f'{"endpoint":<26}{"p50 ms":>9}{"p95 ms":>9}{"peak KB":>10}'
+          + (f'{"base p50":>10}' if baseline else ''))
+    for name, result in size['endpoints'].items():
+        line = (f'{name:<26}{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+                f'{result["peak_kb"]:>10.1f}')
+        previous = baseline.get((size['rows'], name)) if baseline else None
+        if previous is not None:
+            line += f'{previous:>10.2f}'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='scaling-report.json')
+    parser.add_argument('--baseline', default=None)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {make_token()}',
+    }
+    app = create_app(BenchmarkConfig)
+
+    report = {
+        'generated_at': datetime.utcnow().isoformat() + 'Z',
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+        'python': platform.python_version(),
+        'requests': args.requests,
+        'seed': args.seed,
+        'sizes': [],
+    }
+    for rows in sizes:
+        size = run(app, headers, rows, args.requests, args.seed)
+        report['sizes'].append(size)
+        print_size(size, baseline)
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    print(f'\nReport written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
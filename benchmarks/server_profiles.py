@@ -0,0 +1,150 @@
+# ----------------------------------------------------------------------------#
+# Server profile benchmark
+# ----------------------------------------------------------------------------#
+
+# Compares gunicorn worker profiles under concurrent clients.
+# Usage: python benchmarks/server_profiles.py [--clients N] [--requests N]
+#                                             [--path /actors] [--token T]
+#
+# Every profile starts gunicorn with gunicorn.conf.py and its own
+# GUNICORN_* overrides, then N client threads each send requests, once
+# reusing one HTTP/1.1 connection and once opening a connection per request.
+# Without --token the unauthenticated '/' is requested. The database is
+# SQLALCHEMY_DATABASE_URI, or a temporary SQLite file with empty tables.
+
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = {
+    'sync': {'GUNICORN_WORKER_CLASS': 'sync'},
+    'gthread': {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '4'},
+    'gevent': {'GUNICORN_WORKER_CLASS': 'gevent'},
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def create_tables(env):
+    subprocess.check_call([
+        sys.executable, '-c',
+        'from agency.app import create_app; from agency.models import db\n'
+        'app = create_app()\n'
+        'with app.app_context(): db.create_all()'
+    ], cwd=ROOT, env=env)
+
+
+def start(profile, env, workers):
+    port = free_port()
+    env = dict(env, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               **PROFILES[profile])
+    server = subprocess.Popen(
+        [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()',
+         '--config', 'gunicorn.conf.py',
+         '--bind', f'127.0.0.1:{port}', 'agency.wsgi'],
+        cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            return server, None
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return server, port
+        except OSError:
+            time.sleep(0.1)
+    return server, None
+
+
+# Returns: requests per second and per request latencies in ms (tuple)
+def load(port, path, headers, clients, requests, keep_alive):
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        connection = None
+        timings = []
+        for _ in range(requests):
+            if connection is None or not keep_alive:
+                connection = http.client.HTTPConnection('127.0.0.1', port)
+            started = time.perf_counter()
+            connection.request('GET', path, headers=headers)
+            connection.getresponse().read()
+            timings.append((time.perf_counter() - started) * 1000)
+            if not keep_alive:
+                connection.close()
+        connection.close()
+        with lock:
+            latencies.extend(timings)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / (time.perf_counter() - started), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--path', default=None)
+    parser.add_argument('--token', default=None)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault(
+        'SQLALCHEMY_DATABASE_URI',
+        'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    )
+    create_tables(env)
+
+    headers = {}
+    if args.token:
+        headers['Authorization'] = f'Bearer {args.token}'
+    path = args.path or ('/actors' if args.token else '/')
+
+    print(f'{"profile":<10}{"connections":<14}{"req/s":>10}'
+          f'{"p50 ms":>10}{"p99 ms":>10}')
+    for profile in PROFILES:
+        server, port = start(profile, env, args.workers)
+        try:
+            if port is None:
+                print(f'{profile:<10}unavailable (is its worker installed?)')
+                continue
+            for keep_alive in (True, False):
+                rate, latencies = load(
+                    port, path, headers, args.clients, args.requests,
+                    keep_alive
+                )
+                latencies.sort()
+                print(
+                    f'{profile:<10}'
+                    f'{"keep-alive" if keep_alive else "per request":<14}'
+                    f'{rate:>10.0f}{statistics.median(latencies):>10.2f}'
+                    f'{latencies[int(len(latencies) * 0.99)]:>10.2f}'
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
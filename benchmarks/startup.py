@@ -0,0 +1,60 @@
+# ----------------------------------------------------------------------------#
+# Startup benchmark
+# ----------------------------------------------------------------------------#
+
+# Measures cold-start time of the application in fresh interpreters.
+# Usage: python benchmarks/startup.py [--runs N]
+#
+# Every run starts a new python process and reports, in milliseconds, the
+# time to import the package, to import the serving entry point (which
+# builds the serving profile), and to build the full profile used by the CLI.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'import agency': 'import agency',
+    'serving profile (agency.wsgi)': 'import agency.wsgi',
+    'full profile (create_app)':
+        'from agency.app import create_app; create_app()',
+}
+
+PROBE = '''
+import time
+started = time.perf_counter()
+{statement}
+print((time.perf_counter() - started) * 1000)
+'''
+
+
+def measure(statement):
+    env = dict(os.environ)
+    env.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite://')
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE.format(statement=statement)],
+        cwd=ROOT, env=env, stderr=subprocess.DEVNULL
+    )
+    return float(output.decode().split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'{"scenario":<32}{"median ms":>12}{"min ms":>10}{"max ms":>10}')
+    for name, statement in SCENARIOS.items():
+        timings = [measure(statement) for _ in range(args.runs)]
+        print(
+            f'{name:<32}{statistics.median(timings):>12.1f}'
+            f'{min(timings):>10.1f}{max(timings):>10.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
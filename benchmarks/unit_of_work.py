@@ -0,0 +1,78 @@
+# ----------------------------------------------------------------------------#
+# Unit of work benchmark
+# ----------------------------------------------------------------------------#
+
+# Compares the cost per model operation with a commit per call (standalone)
+# and with one commit per unit_of_work() block.
+# Usage: python benchmarks/unit_of_work.py [--operations N] [--batch N]
+#
+# Runs against SQLALCHEMY_DATABASE_URI, or a temporary SQLite file when it is
+# not set. Actors are created, updated and deleted; rows are left soft
+# deleted.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agency.app import create_app  # noqa: E402
+from agency.config import Config  # noqa: E402
+from agency.models import db, unit_of_work, Actor  # noqa: E402
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'SQLALCHEMY_DATABASE_URI',
+        'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    )
+    CACHE_BACKEND = 'none'
+
+
+# Creates, updates and deletes one actor per index.
+def mutate(indexes):
+    for i in indexes:
+        actor = Actor(name=f'Actor {i}', age=20 + i % 60, gender='female')
+        actor.insert()
+        actor.age += 1
+        actor.update()
+        actor.delete()
+
+
+# Returns: microseconds per model call (float)
+def measure(operations, batch=0):
+    started = time.perf_counter()
+    if batch:
+        for start in range(0, operations, batch):
+            with unit_of_work():
+                mutate(range(start, min(start + batch, operations)))
+    else:
+        mutate(range(operations))
+    # Three model calls per operation.
+    return (time.perf_counter() - started) / (operations * 3) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--operations', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=100,
+                        help='Operations per unit of work.')
+    args = parser.parse_args()
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        standalone = measure(args.operations)
+        batched = measure(args.operations, args.batch)
+
+    print(f'database: {db.get_engine(app).url.drivername}')
+    print(f'{"mode":<28}{"us per call":>14}')
+    print(f'{"commit per call":<28}{standalone:>14.1f}')
+    print(f'{f"unit of work ({args.batch} ops)":<28}{batched:>14.1f}')
+    print(f'speedup: {standalone / batched:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
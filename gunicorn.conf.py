@@ -0,0 +1,64 @@
+# ----------------------------------------------------------------------------#
+# Gunicorn settings
+# ----------------------------------------------------------------------------#
+
+# Read by `gunicorn agency.wsgi` (see Procfile). Every value can be overridden
+# from the environment, e.g. GUNICORN_WORKER_CLASS=gevent.
+#
+# The default gthread profile keeps client connections alive between
+# requests and lets each worker overlap database and Auth0 waits across
+# threads. gevent needs `pip install gevent psycogreen`.
+
+import multiprocessing
+import os
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', '8000')
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get(
+    'WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1
+))
+# Threads per gthread worker; gevent serves worker_connections greenlets.
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# Seconds an idle HTTP/1.1 connection is kept open for the next request.
+# Sync workers close every connection regardless.
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then, at staggered times so they never all
+# restart together.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# Build the app once in the master, see agency/wsgi.py.
+preload_app = True
+
+
+# A memory cache is private to each worker: a write would only invalidate
+# the entries of the worker that made it.
+def on_starting(server):
+    from agency.config import Config
+
+    if Config.CACHE_BACKEND == 'memory' and server.cfg.workers > 1:
+        raise RuntimeError(
+            'CACHE_BACKEND=memory with %s workers: invalidations would only '
+            'reach the worker that made the change. Use filesystem, redis '
+            'or none.' % server.cfg.workers
+        )
+
+
+def post_fork(server, worker):
+    # Workers forked from the --preload master must not share its pooled
+    # connections.
+    from agency.app import dispose_engine
+    from agency.wsgi import application
+    dispose_engine(application)
+
+    # Make psycopg2 yield to other greenlets while waiting on PostgreSQL.
+    if server.cfg.worker_class_str == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
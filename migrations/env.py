@@ -1,12 +1,16 @@
 from __future__ import with_statement
 
 import logging
+import re
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
+from sqlalchemy import text
 
 from alembic import context
+from alembic.operations import MigrateOperation, Operations
+from alembic.runtime.migration import MigrationContext
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -31,6 +35,165 @@ target_metadata = current_app.extensions['migrate'].db.metadata
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
 # ... etc.
+app_config = current_app.config
+
+# `flask db upgrade -x dry_run=true` prints the SQL of the pending migrations
+# instead of running it, with the estimated size of every table an online
+# index would be built on.
+x_arguments = context.get_x_argument(as_dictionary=True)
+dry_run = x_arguments.get('dry_run', 'false').lower() == 'true'
+
+
+# ----------------------------------------------------------------------------#
+# Online index operations
+# ----------------------------------------------------------------------------#
+
+# Usage in a migration script:
+#
+#     def upgrade():
+#         op.create_index_concurrently(
+#             'ix_movies_release', 'movies', ['release'],
+#             postgresql_where=sa.text('deleted_at IS NULL')
+#         )
+#
+# On PostgreSQL the index is built with CREATE INDEX CONCURRENTLY outside of
+# the migration transaction, so writes to the table are never blocked. Other
+# databases get a plain CREATE INDEX.
+
+@Operations.register_operation('create_index_concurrently')
+class CreateIndexConcurrentlyOp(MigrateOperation):
+    def __init__(self, index_name, table_name, columns, **kw):
+        self.index_name = index_name
+        self.table_name = table_name
+        self.columns = columns
+        self.kw = kw
+
+    @classmethod
+    def create_index_concurrently(cls, operations, index_name, table_name,
+                                  columns, **kw):
+        return operations.invoke(cls(index_name, table_name, columns, **kw))
+
+    def reverse(self):
+        return DropIndexConcurrentlyOp(self.index_name, self.table_name)
+
+
+@Operations.register_operation('drop_index_concurrently')
+class DropIndexConcurrentlyOp(MigrateOperation):
+    def __init__(self, index_name, table_name):
+        self.index_name = index_name
+        self.table_name = table_name
+
+    @classmethod
+    def drop_index_concurrently(cls, operations, index_name, table_name):
+        return operations.invoke(cls(index_name, table_name))
+
+
+# Logs the planner's row estimate and the on-disk size of a table.
+def report_table_size(table_name):
+    connection = config.attributes['connection']
+    rows, size = connection.execute(
+        text(
+            'SELECT c.reltuples::bigint, '
+            'pg_size_pretty(pg_total_relation_size(c.oid)) '
+            'FROM pg_class c WHERE c.oid = to_regclass(:table)'
+        ),
+        table=table_name
+    ).fetchone() or (0, '0 bytes')
+    logger.info('%s: ~%s rows, %s (estimated)', table_name, rows, size)
+
+
+# Returns: True if the index exists, False if not, None if a previous
+# concurrent build failed and left it invalid.
+def index_is_valid(operations, index_name):
+    row = operations.get_bind().execute(
+        text(
+            'SELECT i.indisvalid FROM pg_index i '
+            'JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name'
+        ),
+        name=index_name
+    ).fetchone()
+    if row is None:
+        return False
+    return True if row[0] else None
+
+
+@Operations.implementation_for(CreateIndexConcurrentlyOp)
+def create_index_concurrently(operations, operation):
+    if operations.get_context().dialect.name != 'postgresql':
+        operations.create_index(
+            operation.index_name, operation.table_name, operation.columns,
+            **operation.kw
+        )
+        return
+
+    if dry_run:
+        report_table_size(operation.table_name)
+    else:
+        valid = index_is_valid(operations, operation.index_name)
+        if valid:
+            logger.info('Index %s already exists.', operation.index_name)
+            return
+
+    with operations.get_context().autocommit_block():
+        if not dry_run and valid is None:
+            operations.drop_index(
+                operation.index_name, table_name=operation.table_name,
+                postgresql_concurrently=True
+            )
+
+        # lock_timeout still bounds the wait for the table lock, but the
+        # build itself may take longer than any regular statement.
+        operations.execute(
+            "SET statement_timeout = '%s'"
+            % app_config['MIGRATION_INDEX_STATEMENT_TIMEOUT']
+        )
+        operations.create_index(
+            operation.index_name, operation.table_name, operation.columns,
+            postgresql_concurrently=True, **operation.kw
+        )
+        operations.execute(
+            "SET statement_timeout = '%s'"
+            % app_config['MIGRATION_STATEMENT_TIMEOUT']
+        )
+
+
+@Operations.implementation_for(DropIndexConcurrentlyOp)
+def drop_index_concurrently(operations, operation):
+    if operations.get_context().dialect.name != 'postgresql':
+        operations.drop_index(
+            operation.index_name, table_name=operation.table_name
+        )
+        return
+
+    with operations.get_context().autocommit_block():
+        operations.drop_index(
+            operation.index_name, table_name=operation.table_name,
+            postgresql_concurrently=True
+        )
+
+
+# ----------------------------------------------------------------------------#
+# Autogenerate filters
+# ----------------------------------------------------------------------------#
+
+# The movie partitions and the plain id index standing in for the primary
+# key of the partitioned table only exist in the database, see the
+# movie_partitions revision; autogenerate would otherwise drop them.
+PARTITION_TABLES = re.compile(r'^movies_(history|default|y\d+)$')
+PARTITION_INDEXES = ('ix_movies_id',)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and PARTITION_TABLES.match(name):
+        return False
+    if type_ == 'index' and name in PARTITION_INDEXES:
+        return False
+    return True
+
+
+# ----------------------------------------------------------------------------#
+# Migration runners
+# ----------------------------------------------------------------------------#
 
 
 def run_migrations_offline():
@@ -47,7 +210,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -79,10 +243,37 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
+        config.attributes['connection'] = connection
+        dry_run_args = {}
+
+        if connection.dialect.name == 'postgresql':
+            # Give up instead of queueing behind long transactions, which
+            # would block every other query on the table meanwhile.
+            connection.execute(
+                "SET lock_timeout = '%s'"
+                % app_config['MIGRATION_LOCK_TIMEOUT']
+            )
+            connection.execute(
+                "SET statement_timeout = '%s'"
+                % app_config['MIGRATION_STATEMENT_TIMEOUT']
+            )
+
+        if dry_run:
+            # Emit SQL instead of executing it, starting from the revision
+            # the database is actually at.
+            heads = MigrationContext.configure(connection).get_current_heads()
+            dry_run_args = {
+                'as_sql': True,
+                'starting_rev': heads[0] if heads else None,
+            }
+
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
+            include_object=include_object,
             process_revision_directives=process_revision_directives,
+            transaction_per_migration=True,
+            **dry_run_args,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,42 @@
+"""Soft delete.
+
+Revision ID: 3f1c9a7d2b64
+Revises: 800019d8a1a2
+Create Date: 2026-10-19 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b64'
+down_revision = '800019d8a1a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('actors', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('movies', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    for table in ('actors', 'movies'):
+        op.create_index(
+            f'ix_{table}_live', table, ['id'],
+            postgresql_where=sa.text('deleted_at IS NULL'),
+            sqlite_where=sa.text('deleted_at IS NULL')
+        )
+        op.create_index(
+            f'ix_{table}_deleted_at', table, ['deleted_at'],
+            postgresql_where=sa.text('deleted_at IS NOT NULL'),
+            sqlite_where=sa.text('deleted_at IS NOT NULL')
+        )
+
+
+def downgrade():
+    for table in ('movies', 'actors'):
+        op.drop_index(f'ix_{table}_deleted_at', table_name=table)
+        op.drop_index(f'ix_{table}_live', table_name=table)
+
+    op.drop_column('movies', 'deleted_at')
+    op.drop_column('actors', 'deleted_at')
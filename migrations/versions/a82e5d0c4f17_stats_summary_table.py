@@ -0,0 +1,60 @@
+"""Stats summary table.
+
+Revision ID: a82e5d0c4f17
+Revises: 3f1c9a7d2b64
+Create Date: 2026-10-19 11:03:27.540918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a82e5d0c4f17'
+down_revision = '3f1c9a7d2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stats',
+    sa.Column('metric', sa.String(), nullable=False),
+    sa.Column('bucket', sa.String(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('metric', 'bucket')
+    )
+
+    # Seed the counters from the existing rows.
+    op.execute(
+        "INSERT INTO stats (metric, bucket, count) "
+        "SELECT 'actors.total', '', COUNT(*) FROM actors "
+        "WHERE deleted_at IS NULL"
+    )
+    op.execute(
+        "INSERT INTO stats (metric, bucket, count) "
+        "SELECT 'actors.by_gender', COALESCE(gender, 'unknown'), COUNT(*) "
+        "FROM actors WHERE deleted_at IS NULL "
+        "GROUP BY COALESCE(gender, 'unknown')"
+    )
+    op.execute(
+        "INSERT INTO stats (metric, bucket, count) "
+        "SELECT 'actors.by_age', CASE WHEN age IS NULL THEN 'unknown' "
+        "ELSE CAST(age / 10 * 10 AS VARCHAR) || '-' "
+        "|| CAST(age / 10 * 10 + 9 AS VARCHAR) END, COUNT(*) "
+        "FROM actors WHERE deleted_at IS NULL GROUP BY 2"
+    )
+    op.execute(
+        "INSERT INTO stats (metric, bucket, count) "
+        "SELECT 'movies.total', '', COUNT(*) FROM movies "
+        "WHERE deleted_at IS NULL"
+    )
+    op.execute(
+        "INSERT INTO stats (metric, bucket, count) "
+        "SELECT 'movies.by_year', COALESCE(SUBSTR(CAST(release AS VARCHAR), "
+        "1, 4), 'unknown'), COUNT(*) FROM movies "
+        "WHERE deleted_at IS NULL GROUP BY 2"
+    )
+
+
+def downgrade():
+    op.drop_table('stats')
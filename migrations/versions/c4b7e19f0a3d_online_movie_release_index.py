@@ -0,0 +1,29 @@
+"""Online movie release index.
+
+Revision ID: c4b7e19f0a3d
+Revises: a82e5d0c4f17
+Create Date: 2026-10-19 14:26:09.712350
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4b7e19f0a3d'
+down_revision = 'a82e5d0c4f17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built online, see create_index_concurrently in migrations/env.py.
+    op.create_index_concurrently(
+        'ix_movies_release', 'movies', ['release'],
+        postgresql_where=sa.text('deleted_at IS NULL'),
+        sqlite_where=sa.text('deleted_at IS NULL')
+    )
+
+
+def downgrade():
+    op.drop_index_concurrently('ix_movies_release', 'movies')
@@ -0,0 +1,123 @@
+"""Movie partitions.
+
+Revision ID: e27c4d9a1b58
+Revises: b61d4e2a9f73
+Create Date: 2026-10-19 23:02:41.518204
+
+"""
+from datetime import date
+from alembic import op
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'e27c4d9a1b58'
+down_revision = 'b61d4e2a9f73'
+branch_labels = None
+depends_on = None
+
+
+# Releases before HISTORY_BEFORE share one partition, later ones get a
+# partition per year up to YEARS_AHEAD years from now; further years are
+# created by `flask agency partitions create`.
+HISTORY_BEFORE = 2000
+YEARS_AHEAD = 3
+
+COLUMNS = 'id, title, release, deleted_at, updated_at'
+
+# The live, deleted_at and release indexes of models.py, plus a plain id
+# index: a primary key would have to include release, which may be NULL.
+INDEXES = (
+    'CREATE INDEX ix_movies_id ON movies (id)',
+    'CREATE INDEX ix_movies_live ON movies (id) WHERE deleted_at IS NULL',
+    'CREATE INDEX ix_movies_deleted_at ON movies (deleted_at) '
+    'WHERE deleted_at IS NOT NULL',
+    'CREATE INDEX ix_movies_release ON movies (release) '
+    'WHERE deleted_at IS NULL',
+)
+
+
+def is_postgres():
+    return op.get_context().dialect.name == 'postgresql'
+
+
+# Rows are copied while the old table is locked, within the revision's
+# transaction: the copy and the index builds are only bounded by
+# MIGRATION_COPY_STATEMENT_TIMEOUT.
+def copy_timeout():
+    op.execute(
+        "SET LOCAL statement_timeout = '%s'"
+        % current_app.config['MIGRATION_COPY_STATEMENT_TIMEOUT']
+    )
+
+
+def upgrade():
+    # Other databases have no declarative partitioning; movies stays a
+    # single table there.
+    if not is_postgres():
+        return
+
+    op.execute('ALTER TABLE movies RENAME TO movies_unpartitioned')
+    op.execute('ALTER SEQUENCE movies_id_seq OWNED BY NONE')
+    op.execute(
+        'CREATE TABLE movies ('
+        "id integer NOT NULL DEFAULT nextval('movies_id_seq'), "
+        'title varchar, '
+        'release date, '
+        'deleted_at timestamp without time zone, '
+        'updated_at timestamp without time zone'
+        ') PARTITION BY RANGE (release)'
+    )
+    op.execute(
+        'CREATE TABLE movies_history PARTITION OF movies '
+        f"FOR VALUES FROM (MINVALUE) TO ('{HISTORY_BEFORE}-01-01')"
+    )
+    for year in range(HISTORY_BEFORE, date.today().year + YEARS_AHEAD + 1):
+        op.execute(
+            f'CREATE TABLE movies_y{year} PARTITION OF movies '
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+    op.execute('CREATE TABLE movies_default PARTITION OF movies DEFAULT')
+
+    copy_timeout()
+    op.execute(
+        f'INSERT INTO movies ({COLUMNS}) '
+        f'SELECT {COLUMNS} FROM movies_unpartitioned'
+    )
+    op.execute('DROP TABLE movies_unpartitioned')
+    op.execute('ALTER SEQUENCE movies_id_seq OWNED BY movies.id')
+
+    # Indexes created on the parent are built on every partition.
+    for statement in INDEXES:
+        op.execute(statement)
+    op.execute('ANALYZE movies')
+
+
+def downgrade():
+    if not is_postgres():
+        return
+
+    op.execute('ALTER TABLE movies RENAME TO movies_partitioned')
+    op.execute('ALTER SEQUENCE movies_id_seq OWNED BY NONE')
+    op.execute(
+        'CREATE TABLE movies ('
+        "id integer NOT NULL DEFAULT nextval('movies_id_seq'), "
+        'title varchar, '
+        'release date, '
+        'deleted_at timestamp without time zone, '
+        'updated_at timestamp without time zone, '
+        'CONSTRAINT movies_pkey PRIMARY KEY (id)'
+        ')'
+    )
+
+    copy_timeout()
+    op.execute(
+        f'INSERT INTO movies ({COLUMNS}) '
+        f'SELECT {COLUMNS} FROM movies_partitioned'
+    )
+    op.execute('DROP TABLE movies_partitioned')
+    op.execute('ALTER SEQUENCE movies_id_seq OWNED BY movies.id')
+
+    for statement in INDEXES[1:]:
+        op.execute(statement)
+    op.execute('ANALYZE movies')